@@ -1,30 +1,55 @@
-from pyrogram import Client, filters
-from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from pyrogram import Client, filters, idle
+from pyrogram.types import CallbackQuery
 from dotenv import load_dotenv
+import asyncio
 import os
 import logging
+import time
+from collections import Counter, defaultdict
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('admin_bot.log'),
-        logging.StreamHandler()
-    ]
+from batching import KeyedBatcher
+from flood_control import FloodAwareDispatcher
+from logging_setup import setup_logging_from_env
+from metrics import MetricsServer, registry, stage_seconds
+from moderation_keyboard import (
+    ACTION_APPROVE, ACTION_APPROVE_ALL, ACTION_QUEUE, ACTION_QUEUE_ALL, ACTION_REJECT, KeyboardTemplate
 )
-logger = logging.getLogger(__name__)
+from peer_registry import PeerRegistry
+from pending_store import create_pending_store
+from publish_queue import STATUS_FAILED, STATUS_PUBLISHED, STATUS_QUEUED, PublishQueue, PublishScheduler
+from publisher import ChannelPublisher
+from relay_metadata import RelayMetadataStore, relay_key
 
 # Загрузка переменных окружения
 load_dotenv()
 
+# Настройка логирования: запись в консоль и файл выполняется в фоновом потоке
+setup_logging_from_env('admin_bot.log', log_file_env='ADMIN_BOT_LOG_FILE')
+logger = logging.getLogger(__name__)
+
 # Параметры подключения для бота
 bot_token = os.getenv('BOT_TOKEN')  
 api_id = os.getenv('API_ID')
 api_hash = os.getenv('API_HASH')
 admin_ids = [int(id.strip()) for id in os.getenv('ADMIN_IDS', '').split(',')]  
 target_channels = os.getenv('TARGET_CHANNEL_USERNAMES', '').split(',')  # Список целевых каналов
-user_bot_id = int(os.getenv('USER_BOT_ID'))  
+user_bot_ids = [int(id.strip()) for id in os.getenv('USER_BOT_ID', '').split(',')]  # Несколько — при шардировании
+fanout_concurrency = int(os.getenv('FANOUT_CONCURRENCY') or 8)
+flood_max_retries = int(os.getenv('FLOOD_MAX_RETRIES') or 3)
+channel_rate_per_minute = float(os.getenv('CHANNEL_RATE_PER_MINUTE') or 20)
+channel_burst = int(os.getenv('CHANNEL_BURST') or 3)
+pending_store_backend = os.getenv('PENDING_STORE') or 'sqlite'
+pending_store_path = os.getenv('PENDING_STORE_PATH') or 'pending_posts.db'
+pending_max_posts = int(os.getenv('PENDING_MAX_POSTS') or 5000)
+pending_ttl_hours = float(os.getenv('PENDING_TTL_HOURS') or 72)
+album_delay = float(os.getenv('ALBUM_DELAY') or 1.5)
+batch_publish_concurrency = int(os.getenv('BATCH_PUBLISH_CONCURRENCY') or 4)
+publish_slot_minutes = float(os.getenv('PUBLISH_SLOT_MINUTES') or 10)
+publish_queue_path = os.getenv('PUBLISH_QUEUE_PATH') or 'publish_queue.db'
+relay_metadata_path = os.getenv('RELAY_METADATA_PATH') or 'relay_metadata.db'
+relay_metadata_wait = float(os.getenv('RELAY_METADATA_WAIT') or 2)
+metrics_port = int(os.getenv('ADMIN_BOT_METRICS_PORT') or 0)
+metrics_host = os.getenv('METRICS_HOST') or '127.0.0.1'
 
 # Логируем конфигурацию при запуске
 logger.info("=== Bot Configuration ===")
@@ -32,7 +57,7 @@ logger.info(f"Bot Token: {bot_token}")
 logger.info(f"API ID: {api_id}")
 logger.info(f"Admin IDs: {admin_ids}")
 logger.info(f"Target Channels: {target_channels}")
-logger.info(f"User Bot ID: {user_bot_id}")
+logger.info(f"User Bot IDs: {user_bot_ids}")
 
 # Создание клиента
 bot = Client(
@@ -42,8 +67,43 @@ bot = Client(
     bot_token=bot_token
 )
 
-# Словарь для хранения сообщений, ожидающих одобрения
-pending_posts = {}
+# Каналы, админы и юзер-бот разрешаются один раз при запуске
+peer_registry = PeerRegistry(bot)
+
+# Параллельная рассылка уведомлений админам с учетом FloodWait
+dispatcher = FloodAwareDispatcher(max_concurrency=fanout_concurrency, max_retries=flood_max_retries)
+
+# Параллельная публикация в целевые каналы с ограничением частоты для каждого канала
+publisher = ChannelPublisher(
+    rate_per_minute=channel_rate_per_minute,
+    burst=channel_burst,
+    max_retries=flood_max_retries
+)
+
+# Очередь отложенных публикаций (0 минут — отключена, посты публикуются только сразу)
+publish_queue = PublishQueue(
+    publish_queue_path, interval=publish_slot_minutes * 60
+) if publish_slot_minutes > 0 else None
+
+# Клавиатура карточки модерации собирается один раз при запуске
+keyboard_template = KeyboardTemplate(target_channels, queue=publish_queue is not None)
+
+# Хранилище сообщений, ожидающих одобрения (только идентификаторы)
+pending_posts = create_pending_store(
+    pending_store_backend,
+    pending_store_path,
+    max_posts=pending_max_posts,
+    ttl=pending_ttl_hours * 3600
+)
+
+# Метаданные постов, записанные User Bot (источник, тип, отпечаток, время)
+relay_metadata = RelayMetadataStore(relay_metadata_path)
+
+# Число постов, ожидающих решения админов
+registry.gauge('tgbot_pending_posts', 'Posts waiting for moderation', callback=lambda: len(pending_posts))
+if publish_queue is not None:
+    registry.gauge('tgbot_publish_queue_depth', 'Channel publications waiting in the queue',
+                   callback=lambda: len(publish_queue))
 
 @bot.on_message(filters.command("start"))
 async def start_command(client, message):
@@ -64,6 +124,123 @@ async def start_command(client, message):
     except Exception as e:
         logger.error(f"Error in start_command: {str(e)}", exc_info=True)
 
+async def find_metadata(message):
+    """
+    Находит метаданные, которые User Bot записал для поста.
+
+    Args:
+        message: Первое сообщение поста от user_bot
+
+    Returns:
+        RelayMetadata | None: Метаданные или None, если записи нет
+    """
+    try:
+        metadata = await relay_metadata.lookup(relay_key(message), timeout=relay_metadata_wait)
+    except Exception as e:
+        logger.error(f"Error reading relay metadata for message {message.id}: {e}")
+        return None
+
+    if metadata is None:
+        logger.warning(f"No relay metadata for message {message.id}")
+        return None
+    stage_seconds.observe(time.time() - metadata.received_at, stage='relay')
+    if metadata.posted_at:
+        logger.info(
+            f"Message {message.id} from {metadata.source_info} arrived "
+            f"{time.time() - metadata.posted_at:.1f}s after publication"
+        )
+    return metadata
+
+async def send_moderation_card(messages):
+    """
+    Отправляет всем админам пост и карточку модерации с кнопками.
+
+    Args:
+        messages: Сообщения поста от user_bot (несколько — для альбома)
+    """
+    message = messages[0]
+    message_ids = [item.id for item in messages]
+
+    # Кнопки для каждого целевого канала и отклонения берутся из готового шаблона
+    keyboard = keyboard_template.markup(message.id)
+
+    # Проверяем тип сообщения и добавляем соответствующее описание
+    media_type = message.media.value if message.media else 'text'
+    if message.media_group_id:
+        media_type = 'media_group'
+    message_type = "Новый пост"
+    if media_type == 'media_group':
+        message_type = "Новый альбом"
+    elif media_type == 'voice':
+        message_type = "Новое голосовое сообщение"
+    elif media_type == 'video_note':
+        message_type = "Новое видеосообщение"
+
+    # Источник поста User Bot записал в общую базу метаданных
+    metadata = await find_metadata(message)
+    notification_text = f"⬆️ {message_type} для публикации\n"
+    if metadata:
+        notification_text += f"📢 Источник: {metadata.source_info}\n"
+    notification_text += "Выберите действие:"
+
+    async def notify_admin(admin_id):
+        logger.info(f"Sending notification to admin {admin_id}")
+
+        # Пересылаем оригинальное сообщение (альбом — одним запросом)
+        forwarded_messages = await dispatcher.call(
+            admin_id, lambda: peer_registry.send(
+                admin_id, lambda peer_id: bot.forward_messages(peer_id, message.chat.id, message_ids)
+            )
+        )
+        forwarded = forwarded_messages[0]
+
+        # Отправляем уведомление с кнопками
+        notification = await dispatcher.call(admin_id, lambda: bot.send_message(
+            chat_id=admin_id,
+            text=notification_text,
+            reply_to_message_id=forwarded.id,
+            reply_markup=keyboard
+        ))
+
+        # Сохраняем информацию о посте сразу, чтобы админ мог нажать кнопку до конца рассылки
+        post_info = pending_posts.add_admin_message(
+            str(message.id), message.chat.id, message.id, media_type,
+            admin_id, notification.id, forwarded.id
+        )
+        if post_info is None:
+            # Пока карточка доставлялась, пост уже забрал другой админ: убираем кнопки
+            logger.info(f"Post {message.id} was already handled before the card reached admin {admin_id}")
+            await dispatcher.call(admin_id, lambda: bot.edit_message_text(
+                admin_id, notification.id, "↩️ Пост уже обработан другим админом"
+            ))
+
+    # Отправляем сообщение всем админам параллельно
+    with stage_seconds.time(stage='admin_fanout'):
+        deliveries = await dispatcher.fan_out(admin_ids, notify_admin)
+
+    for delivery in deliveries:
+        stage_seconds.observe(delivery.latency, stage='admin_notify')
+        if delivery.error:
+            logger.error(
+                f"Error sending notification to admin {delivery.chat_id}: {str(delivery.error)}",
+                exc_info=delivery.error
+            )
+        else:
+            logger.info(f"Successfully sent notification to admin {delivery.chat_id} in {delivery.latency:.2f}s")
+
+    if deliveries:
+        fan_out_time = max(delivery.latency for delivery in deliveries)
+        logger.info(f"Fan-out of message {message.id} to {len(deliveries)} admins took {fan_out_time:.2f}s")
+
+async def flush_album(media_group_id, messages):
+    """Отправляет собранный альбом одной карточкой"""
+    messages.sort(key=lambda item: item.id)
+    logger.info(f"Collected album {media_group_id} with {len(messages)} items")
+    await send_moderation_card(messages)
+
+# Буфер альбомов от user_bot
+album_buffer = KeyedBatcher(flush_album, delay=album_delay)
+
 @bot.on_message(~filters.command("start"))
 async def handle_new_post(client, message):
     """Обработка входящих сообщений от user_bot"""
@@ -72,71 +249,306 @@ async def handle_new_post(client, message):
         logger.info(f"Received message from user {user_id}")
         
         # Обработка сообщений от юзер-бота
-        if user_id == user_bot_id:
-            # Создаем кнопки для каждого целевого канала
-            buttons = [
-                [InlineKeyboardButton("📢 Выложить во все каналы", callback_data=f"approve_all_{message.id}")]
-            ]
+        if user_id in user_bot_ids:
+            # Элементы альбома собираем в одну карточку
+            if message.media_group_id:
+                album_buffer.add(message.media_group_id, message)
+            else:
+                await send_moderation_card([message])
+        else:
+            logger.info(f"Message from non-user-bot {user_id}, ignoring")
             
-            for channel in target_channels:
-                channel = channel.strip()
-                if channel:
-                    buttons.append([
-                        InlineKeyboardButton(f"Выложить в {channel}", callback_data=f"approve_{message.id}_{channel}")
-                    ])
+    except Exception as e:
+        logger.error(f"Error in handle_new_post: {str(e)}", exc_info=True)
+
+def get_message_type(post_info):
+    """Описание типа поста для уведомлений"""
+    if post_info.media_type == 'media_group':
+        return "альбом"
+    if post_info.media_type == 'voice':
+        return "голосовое сообщение"
+    if post_info.media_type == 'video_note':
+        return "видеосообщение"
+    return "пост"
+
+async def update_admin_cards(updates):
+    """
+    Обновляет уведомления о нескольких постах у всех админов за один проход.
+
+    Все правки выполняются параллельно через dispatcher: при FloodWait
+    приостанавливается только чат того админа, к которому он относится.
+
+    Args:
+        updates: Пары (данные поста, новый текст карточки)
+    """
+    async def edit(admin_id, notification_id, text):
+        try:
+            await dispatcher.call(admin_id, lambda: bot.edit_message_text(admin_id, notification_id, text))
+        except Exception as e:
+            logger.error(f"Error updating admin {admin_id} message: {str(e)}")
+
+    await asyncio.gather(*(
+        edit(admin_id, messages['notification'], text)
+        for post_info, text in updates
+        for admin_id, messages in post_info.admin_messages.items()
+    ))
+
+async def update_admin_messages(post_info, text):
+    """Параллельно обновляет уведомления о посте у всех админов"""
+    await update_admin_cards([(post_info, text)])
+
+async def get_copy_post(post_info, originals=None):
+    """
+    Готовит публикацию поста.
+
+    Args:
+        post_info: Данные поста (PendingPost или QueuedPost)
+        originals: Заранее полученные исходные сообщения по ключу поста (см. fetch_originals)
+
+    Returns:
+        Функция copy_post(channel), возвращающая корутину публикации, или None, если пост недоступен
+    """
+    if post_info.media_type == 'media_group':
+        # Альбом публикуется целиком одним copy_media_group
+        def copy_post(channel):
+            return bot.copy_media_group(channel, post_info.chat_id, post_info.message_id)
+        return copy_post
+
+    if originals is not None:
+        original_message = originals.get(post_info.key)
+    else:
+        # Получаем исходное сообщение только в момент публикации
+        with stage_seconds.time(stage='fetch_original'):
+            original_message = await bot.get_messages(post_info.chat_id, post_info.message_id)
+    if not original_message or original_message.empty:
+        return None
+    return original_message.copy
+
+async def fetch_originals(posts):
+    """
+    Получает исходные сообщения постов одним get_messages на каждые 200 постов чата.
+
+    Returns:
+        dict: Ключ поста -> исходное сообщение
+    """
+    by_chat = defaultdict(list)
+    for post_info in posts:
+        if post_info.media_type != 'media_group':
+            by_chat[post_info.chat_id].append(post_info)
+
+    originals = {}
+    for chat_id, chat_posts in by_chat.items():
+        for start in range(0, len(chat_posts), 200):
+            batch = chat_posts[start:start + 200]
+            with stage_seconds.time(stage='fetch_original'):
+                messages = await bot.get_messages(chat_id, [post_info.message_id for post_info in batch])
+            for post_info, original_message in zip(batch, messages):
+                originals[post_info.key] = original_message
+    return originals
+
+def note_published(channels):
+    """Сдвигает слоты очереди, чтобы пост из очереди не вышел сразу после публикации в обход нее"""
+    if publish_queue is not None:
+        for channel in channels:
+            publish_queue.mark_published(channel)
+
+def publish_result_text(post_info, report):
+    """Текст карточки после публикации во все каналы"""
+    message_type = get_message_type(post_info)
+    result_message = f"✅ {message_type.capitalize()} опубликован(о) в каналы:\n"
+    if report.successful_channels:
+        result_message += "\n".join([f"• {channel}" for channel in report.successful_channels])
+    else:
+        result_message += "❌ Не удалось опубликовать ни в один канал"
+
+    if report.failed_channels:
+        result_message += f"\n\n❌ Не удалось опубликовать в каналы:\n"
+        result_message += "\n".join([f"• {channel}" for channel in report.failed_channels])
+    return result_message
+
+async def approve_post(callback_query, message_id, post_info, target_channel):
+    """
+    Публикует пост во все каналы или в один канал.
+
+    Пост уже забран из хранилища; если не удалось опубликовать ни в один
+    канал, он возвращается на модерацию.
+
+    Args:
+        callback_query: Нажатие кнопки
+        message_id: Ключ поста в хранилище
+        post_info: Данные поста на модерации
+        target_channel: Канал для публикации или None — во все каналы
+    """
+    # Пост опубликован хотя бы в один канал или публиковать нечего: на модерацию не возвращается
+    settled = False
+    try:
+        copy_post = await get_copy_post(post_info)
+        if copy_post is None:
+            settled = True
+            await callback_query.answer("Это сообщение больше не доступно", show_alert=True)
+            return
+
+        # Публикуем по id каналов, разрешенным при запуске
+        def copy_to_channel(channel):
+            return peer_registry.send(channel, copy_post)
+
+        message_type = get_message_type(post_info)
+        
+        if target_channel is None:
+            # Публикуем во все каналы параллельно
+            with stage_seconds.time(stage='publish'):
+                report = await publisher.publish(keyboard_template.channels, copy_to_channel)
+            successful_channels = report.successful_channels
+            settled = bool(successful_channels)
+            if not settled:
+                pending_posts.restore(post_info)
+            note_published(successful_channels)
+
+            for channel in successful_channels:
+                logger.info(f"Successfully published {message_type} to channel {channel}")
             
-            # Добавляем кнопку отклонения
-            buttons.append([InlineKeyboardButton("❌ Не выкладывать", callback_data=f"reject_{message.id}")])
+            # Обновляем сообщения у всех админов
+            await update_admin_messages(post_info, publish_result_text(post_info, report))
             
-            keyboard = InlineKeyboardMarkup(buttons)
-
-            # Отправляем сообщение всем админам
-            for admin_id in admin_ids:
-                try:
-                    logger.info(f"Sending notification to admin {admin_id}")
-                    
-                    # Проверяем тип сообщения и добавляем соответствующее описание
-                    message_type = "Новый пост"
-                    if message.voice:
-                        message_type = "Новое голосовое сообщение"
-                    elif message.video_note:
-                        message_type = "Новое видеосообщение"
-                    
-                    # Получаем информацию об источнике из метаданных
-                    source_info = getattr(message, '_source_info', '')
-                    notification_text = f"⬆️ {message_type} для публикации\nВыберите действие:"
-                    
-                    # Пересылаем оригинальное сообщение
-                    forwarded = await message.forward(admin_id)
-                    
-                    # Отправляем уведомление с кнопками
-                    notification = await bot.send_message(
-                        chat_id=admin_id,
-                        text=notification_text,
-                        reply_to_message_id=forwarded.id,
-                        reply_markup=keyboard
-                    )
-                    
-                    # Сохраняем информацию о посте
-                    if str(message.id) not in pending_posts:
-                        pending_posts[str(message.id)] = {
-                            'original_message': message,
-                            'admin_messages': {}
-                        }
-                    
-                    pending_posts[str(message.id)]['admin_messages'][admin_id] = {
-                        'notification': notification,
-                        'forwarded': forwarded
-                    }
-                    
-                    logger.info(f"Successfully sent notification to admin {admin_id}")
-                except Exception as e:
-                    logger.error(f"Error sending notification to admin {admin_id}: {str(e)}", exc_info=True)
+            await callback_query.answer(
+                "Публикация во все каналы завершена", 
+                show_alert=True
+            )
+                
         else:
-            logger.info(f"Message from non-user-bot {user_id}, ignoring")
+            # Публикуем в один канал
+            logger.info(f"Attempting to publish message to channel {target_channel}")
+            with stage_seconds.time(stage='publish'):
+                report = await publisher.publish([target_channel], copy_to_channel)
+            
+            if report.successful_channels:
+                settled = True
+                logger.info(f"Successfully published {message_type} to channel {target_channel}")
+                note_published(report.successful_channels)
+                
+                # Обновляем сообщения у всех админов
+                await update_admin_messages(
+                    post_info,
+                    f"✅ {message_type.capitalize()} успешно опубликован(о) в канал {target_channel}"
+                )
+                
+                await callback_query.answer(
+                    f"{message_type.capitalize()} успешно опубликован(о) в канал {target_channel}", 
+                    show_alert=True
+                )
+            else:
+                error = report.errors.get(target_channel)
+                raise Exception(
+                    f"Не удалось опубликовать {message_type} в канал {target_channel}"
+                    + (f": {error}" if error else "")
+                )
             
     except Exception as e:
-        logger.error(f"Error in handle_new_post: {str(e)}", exc_info=True)
+        if not settled:
+            pending_posts.restore(post_info)
+        error_msg = str(e)
+        logger.error(f"Error in approve action: {error_msg}", exc_info=True)
+        await callback_query.answer("Произошла ошибка при публикации", show_alert=True)
+        await bot.send_message(
+            callback_query.from_user.id,
+            f"Ошибка при публикации: {error_msg}"
+        )
+        return
+
+def format_time(timestamp):
+    return time.strftime('%d.%m %H:%M', time.localtime(timestamp))
+
+def queue_status_text(entries):
+    """Текст карточки поста из очереди: состояние публикации в каждый канал"""
+    message_type = get_message_type(entries[0])
+    if all(entry.status == STATUS_PUBLISHED for entry in entries):
+        text = f"✅ {message_type.capitalize()} опубликован(о) по расписанию:\n"
+    else:
+        text = f"🕒 {message_type.capitalize()} в очереди на публикацию:\n"
+
+    lines = []
+    for entry in entries:
+        if entry.status == STATUS_PUBLISHED:
+            lines.append(f"✅ {entry.channel} — опубликован(о) {format_time(entry.published_at)}")
+        elif entry.status == STATUS_FAILED:
+            lines.append(f"❌ {entry.channel} — не удалось опубликовать")
+        else:
+            lines.append(f"🕒 {entry.channel} — {format_time(entry.publish_at)}")
+    return text + "\n".join(lines)
+
+async def queue_post(callback_query, message_id, post_info, target_channel):
+    """
+    Ставит пост в очередь на публикацию во все каналы или в один канал.
+
+    Args:
+        callback_query: Нажатие кнопки
+        message_id: Ключ поста в хранилище
+        post_info: Данные поста на модерации
+        target_channel: Канал для публикации или None — во все каналы
+    """
+    channels = keyboard_template.channels if target_channel is None else [target_channel]
+    try:
+        entries = publish_queue.schedule(post_info, channels)
+    except Exception:
+        pending_posts.restore(post_info)
+        raise
+    publish_scheduler.wake()
+    logger.info(
+        f"Queued post {message_id}: "
+        + ', '.join(f"{entry.channel} at {format_time(entry.publish_at)}" for entry in entries)
+    )
+
+    await update_admin_messages(post_info, queue_status_text(entries))
+    await callback_query.answer(
+        f"Пост в очереди, ближайшая публикация {format_time(min(entry.publish_at for entry in entries))}",
+        show_alert=True
+    )
+
+async def publish_queued(entry):
+    """Публикует пост из очереди в канал записи"""
+    copy_post = await get_copy_post(entry)
+    if copy_post is None:
+        logger.error(f"Queued post {entry.post_key} is no longer available")
+        return False
+
+    with stage_seconds.time(stage='publish'):
+        report = await publisher.publish([entry.channel], lambda channel: peer_registry.send(channel, copy_post))
+    if report.successful_channels:
+        logger.info(f"Published queued post {entry.post_key} to channel {entry.channel}")
+        return True
+    return False
+
+async def report_queued(entry):
+    """Обновляет карточки у всех админов, когда публикация из очереди завершилась"""
+    entries = publish_queue.post_entries(entry.post_key)
+    if not entries:
+        return
+    await update_admin_messages(entry, queue_status_text(entries))
+    if all(item.status != STATUS_QUEUED for item in entries):
+        publish_queue.forget(entry.post_key)
+
+# Фоновая публикация постов из очереди с ограничением частоты для каждого канала
+publish_scheduler = PublishScheduler(
+    publish_queue, publish_queued, report_queued, max_attempts=flood_max_retries
+) if publish_queue is not None else None
+
+async def reject_post(callback_query, message_id, post_info, target_channel):
+    """Отклоняет пост и обновляет карточки у всех админов"""
+    message_type = get_message_type(post_info)
+        
+    # Обновляем сообщения у всех админов
+    await update_admin_messages(post_info, f"❌ {message_type.capitalize()} был(о) отклонен(о)")
+    
+    await callback_query.answer(f"{message_type.capitalize()} отклонен(о)", show_alert=True)
+
+# Обработчики кнопок карточки модерации по коду действия
+callback_handlers = {
+    ACTION_APPROVE_ALL: approve_post,
+    ACTION_APPROVE: approve_post,
+    ACTION_REJECT: reject_post,
+    ACTION_QUEUE_ALL: queue_post,
+    ACTION_QUEUE: queue_post,
+}
 
 @bot.on_callback_query()
 async def handle_callback(client, callback_query: CallbackQuery):
@@ -147,137 +559,21 @@ async def handle_callback(client, callback_query: CallbackQuery):
             await callback_query.answer("У вас нет прав для выполнения этого действия", show_alert=True)
             return
 
-        data_parts = callback_query.data.split('_')
-        action = data_parts[0]
-        
-        if action == "approve" and data_parts[1] == "all":
-            message_id = data_parts[2]
-        else:
-            message_id = data_parts[1]
-            target_channel = data_parts[2] if len(data_parts) > 2 else None
-        
-        post_info = pending_posts.get(message_id)
+        callback = keyboard_template.decode(callback_query.data)
+        if callback is None:
+            await callback_query.answer("Эта кнопка устарела", show_alert=True)
+            return
+
+        message_id = str(callback.message_id)
+        # Пост забирается из хранилища до обработки: второе нажатие или пакетная команда
+        # его уже не найдут и не опубликуют повторно
+        post_info = pending_posts.pop(message_id)
         
         if not post_info:
             await callback_query.answer("Это сообщение больше не доступно", show_alert=True)
             return
 
-        if action == "approve":
-            try:
-                original_message = post_info['original_message']
-                message_type = "пост"
-                
-                if original_message.voice:
-                    message_type = "голосовое сообщение"
-                elif original_message.video_note:
-                    message_type = "видеосообщение"
-                
-                if data_parts[1] == "all":
-                    # Публикуем во все каналы
-                    successful_channels = []
-                    failed_channels = []
-                    
-                    for channel in target_channels:
-                        channel = channel.strip()
-                        if not channel:
-                            continue
-                            
-                        try:
-                            channel_post = await original_message.copy(channel)
-                            if channel_post:
-                                successful_channels.append(channel)
-                                logger.info(f"Successfully published {message_type} to channel {channel}")
-                            else:
-                                failed_channels.append(channel)
-                                logger.error(f"Failed to publish {message_type} to channel {channel}")
-                        except Exception as e:
-                            failed_channels.append(channel)
-                            logger.error(f"Error publishing to channel {channel}: {e}")
-                    
-                    # Формируем сообщение о результатах
-                    result_message = f"✅ {message_type.capitalize()} опубликован(о) в каналы:\n"
-                    if successful_channels:
-                        result_message += "\n".join([f"• {channel}" for channel in successful_channels])
-                    else:
-                        result_message += "❌ Не удалось опубликовать ни в один канал"
-                    
-                    if failed_channels:
-                        result_message += f"\n\n❌ Не удалось опубликовать в каналы:\n"
-                        result_message += "\n".join([f"• {channel}" for channel in failed_channels])
-                    
-                    # Обновляем сообщения у всех админов
-                    for admin_id, messages in post_info['admin_messages'].items():
-                        try:
-                            await messages['notification'].edit_text(result_message)
-                        except Exception as e:
-                            logger.error(f"Error updating admin {admin_id} message: {str(e)}")
-                    
-                    await callback_query.answer(
-                        "Публикация во все каналы завершена", 
-                        show_alert=True
-                    )
-                    
-                    # Удаляем информацию о посте только если есть успешные публикации
-                    if successful_channels:
-                        del pending_posts[message_id]
-                        
-                else:
-                    # Публикуем в один канал
-                    logger.info(f"Attempting to publish message to channel {target_channel}")
-                    channel_post = await original_message.copy(target_channel)
-                    
-                    if channel_post:
-                        logger.info(f"Successfully published {message_type} to channel {target_channel}")
-                        
-                        # Обновляем сообщения у всех админов
-                        for admin_id, messages in post_info['admin_messages'].items():
-                            try:
-                                await messages['notification'].edit_text(
-                                    f"✅ {message_type.capitalize()} успешно опубликован(о) в канал {target_channel}"
-                                )
-                            except Exception as e:
-                                logger.error(f"Error updating admin {admin_id} message: {str(e)}")
-                        
-                        await callback_query.answer(
-                            f"{message_type.capitalize()} успешно опубликован(о) в канал {target_channel}", 
-                            show_alert=True
-                        )
-                        
-                        # Удаляем информацию о посте после успешной публикации
-                        del pending_posts[message_id]
-                    else:
-                        raise Exception(f"Не удалось опубликовать {message_type} в канал {target_channel}")
-                    
-            except Exception as e:
-                error_msg = str(e)
-                logger.error(f"Error in approve action: {error_msg}", exc_info=True)
-                await callback_query.answer("Произошла ошибка при публикации", show_alert=True)
-                await bot.send_message(
-                    callback_query.from_user.id,
-                    f"Ошибка при публикации: {error_msg}"
-                )
-                return
-
-        elif action == "reject":
-            original_message = post_info['original_message']
-            message_type = "пост"
-            
-            if original_message.voice:
-                message_type = "голосовое сообщение"
-            elif original_message.video_note:
-                message_type = "видеосообщение"
-                
-            # Обновляем сообщения у всех админов
-            for admin_id, messages in post_info['admin_messages'].items():
-                try:
-                    await messages['notification'].edit_text(f"❌ {message_type.capitalize()} был(о) отклонен(о)")
-                except Exception as e:
-                    logger.error(f"Error updating admin {admin_id} message: {str(e)}")
-            
-            await callback_query.answer(f"{message_type.capitalize()} отклонен(о)", show_alert=True)
-            
-            # Удаляем информацию о посте
-            del pending_posts[message_id]
+        await callback_handlers[callback.action](callback_query, message_id, post_info, callback.channel)
         
     except Exception as e:
         logger.error(f"Error in handle_callback: {str(e)}", exc_info=True)
@@ -287,11 +583,203 @@ async def handle_callback(client, callback_query: CallbackQuery):
             f"Произошла ошибка: {str(e)}"
         )
 
+# Сколько постов показывает /pending
+PENDING_LIST_LIMIT = 20
+
+# Единицы возраста в /reject_older_than, число без единицы — часы
+AGE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Пакетные команды выполняются по одной, чтобы два админа не опубликовали одни и те же посты дважды
+batch_lock = asyncio.Lock()
+
+def parse_age(value):
+    """
+    Разбирает возраст вида 90m, 12h, 2d или 6 (часы).
+
+    Returns:
+        float | None: Возраст в секундах или None, если формат неверный
+    """
+    value = value.strip().lower()
+    unit = AGE_UNITS.get(value[-1:]) if value else None
+    try:
+        return float(value[:-1]) * unit if unit else float(value) * 3600
+    except ValueError:
+        return None
+
+def format_age(seconds):
+    if seconds < 3600:
+        return f"{int(seconds // 60)} мин"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f} ч"
+    return f"{seconds / 86400:.1f} дн"
+
+@bot.on_message(filters.command("pending") & filters.user(admin_ids), group=-1)
+async def pending_command(client, message):
+    """Обработчик команды /pending: сводка постов на модерации"""
+    try:
+        posts = sorted(pending_posts.values(), key=lambda post_info: post_info.created_at)
+        if not posts:
+            await message.reply("Постов на модерации нет")
+        else:
+            now = time.time()
+            counts = Counter(get_message_type(post_info) for post_info in posts)
+            text = (
+                f"📋 На модерации: {len(posts)}\n"
+                f"Самый старый ждет {format_age(now - posts[0].created_at)}\n"
+                + ", ".join(f"{message_type}: {count}" for message_type, count in counts.most_common())
+                + "\n\n"
+                + "\n".join(
+                    f"• {get_message_type(post_info)} от {format_time(post_info.created_at)} "
+                    f"({format_age(now - post_info.created_at)})"
+                    for post_info in posts[:PENDING_LIST_LIMIT]
+                )
+            )
+            if len(posts) > PENDING_LIST_LIMIT:
+                text += f"\n… и еще {len(posts) - PENDING_LIST_LIMIT}"
+            text += (
+                "\n\n/approve_all_pending [канал] — опубликовать все"
+                "\n/reject_older_than <возраст> — отклонить старше, например 12h или 2d"
+            )
+            await message.reply(text)
+    except Exception as e:
+        logger.error(f"Error in pending_command: {str(e)}", exc_info=True)
+    message.stop_propagation()
+
+@bot.on_message(filters.command("approve_all_pending") & filters.user(admin_ids), group=-1)
+async def approve_all_pending_command(client, message):
+    """
+    Обработчик команды /approve_all_pending [канал]: публикует все посты на модерации.
+
+    Без аргумента посты публикуются во все каналы. Посты публикуются
+    конвейером publisher.publish_many, карточки всех опубликованных постов
+    обновляются одним проходом.
+    """
+    try:
+        target_channel = message.command[1] if len(message.command) > 1 else None
+        if target_channel is not None and target_channel not in keyboard_template.channels:
+            await message.reply(
+                f"Неизвестный канал {target_channel}. Каналы:\n"
+                + "\n".join(f"• {channel}" for channel in keyboard_template.channels)
+            )
+        elif batch_lock.locked():
+            await message.reply("Пакетная операция уже выполняется, дождитесь ее завершения")
+        else:
+            async with batch_lock:
+                await approve_all_pending(message, target_channel)
+    except Exception as e:
+        logger.error(f"Error in approve_all_pending_command: {str(e)}", exc_info=True)
+        await message.reply(f"Ошибка при публикации: {str(e)}")
+    message.stop_propagation()
+
+async def approve_all_pending(message, target_channel):
+    posts = pending_posts.values()
+    if not posts:
+        await message.reply("Постов на модерации нет")
+        return
+    channels = keyboard_template.channels if target_channel is None else [target_channel]
+    await message.reply(f"⏳ Публикую {len(posts)} постов в {', '.join(channels)}")
+
+    started = time.monotonic()
+    # Исходные сообщения запрашиваются пачками, а не по одному на пост
+    originals = await fetch_originals(posts)
+    skipped = set()
+
+    async def prepare(post_info):
+        # Пост забирается из хранилища перед публикацией: его могли одобрить
+        # или отклонить кнопкой, пока шла пакетная публикация
+        if pending_posts.pop(post_info.key) is None:
+            skipped.add(post_info.key)
+            return None
+        return await get_copy_post(post_info, originals)
+
+    with stage_seconds.time(stage='publish'):
+        reports = await publisher.publish_many(posts, channels, prepare, concurrency=batch_publish_concurrency)
+
+    updates = []
+    published = unavailable = failed = 0
+    for post_info, report in zip(posts, reports):
+        if post_info.key in skipped:
+            continue
+        if report is None:
+            unavailable += 1
+            updates.append((post_info, "⚠️ Исходное сообщение больше не доступно"))
+            continue
+        if not report.successful_channels:
+            failed += 1
+            pending_posts.restore(post_info)
+            continue
+
+        published += 1
+        note_published(report.successful_channels)
+        if target_channel is None:
+            updates.append((post_info, publish_result_text(post_info, report)))
+        else:
+            message_type = get_message_type(post_info)
+            updates.append(
+                (post_info, f"✅ {message_type.capitalize()} успешно опубликован(о) в канал {target_channel}")
+            )
+
+    await update_admin_cards(updates)
+    logger.info(
+        f"Batch approval by {message.from_user.id}: {published} published, {failed} failed, "
+        f"{unavailable} unavailable, {len(skipped)} skipped in {time.monotonic() - started:.2f}s"
+    )
+
+    text = f"✅ Опубликовано: {published} из {len(posts)}"
+    if failed:
+        text += f"\n❌ Не удалось опубликовать: {failed} (остались на модерации)"
+    if unavailable:
+        text += f"\n⚠️ Исходное сообщение недоступно: {unavailable}"
+    if skipped:
+        text += f"\n↩️ Уже обработаны другим админом: {len(skipped)}"
+    await message.reply(text)
+
+@bot.on_message(filters.command("reject_older_than") & filters.user(admin_ids), group=-1)
+async def reject_older_than_command(client, message):
+    """Обработчик команды /reject_older_than <возраст>: отклоняет посты, ждущие дольше возраста"""
+    try:
+        age = parse_age(message.command[1]) if len(message.command) > 1 else None
+        if age is None or age <= 0:
+            await message.reply("Укажите возраст, например: /reject_older_than 12h (s, m, h, d; без единицы — часы)")
+        else:
+            cutoff = time.time() - age
+            rejected = []
+            for post_info in pending_posts.values():
+                if post_info.created_at < cutoff and pending_posts.pop(post_info.key) is not None:
+                    rejected.append(post_info)
+
+            await update_admin_cards([
+                (post_info, f"❌ {get_message_type(post_info).capitalize()} был(о) отклонен(о)")
+                for post_info in rejected
+            ])
+            logger.info(f"Batch rejection by {message.from_user.id}: {len(rejected)} posts older than {age:.0f}s")
+            await message.reply(f"❌ Отклонено постов старше {format_age(age)}: {len(rejected)}")
+    except Exception as e:
+        logger.error(f"Error in reject_older_than_command: {str(e)}", exc_info=True)
+    message.stop_propagation()
+
+async def run_bot():
+    """Запускает бота и проверяет, что все каналы и админы из конфигурации доступны"""
+    if metrics_port:
+        await MetricsServer(registry, metrics_port, metrics_host).start()
+    await bot.start()
+    try:
+        # Неизвестный канал или админ — ошибка конфигурации, падаем сразу, а не при первой публикации
+        await peer_registry.resolve_all(keyboard_template.channels + admin_ids + user_bot_ids)
+        if publish_scheduler is not None:
+            # Посты, время которых наступило во время простоя, публикуются сразу
+            publish_scheduler.start()
+        await idle()
+    finally:
+        if publish_scheduler is not None:
+            await publish_scheduler.stop()
+        await bot.stop()
+
 def main():
     try:
         logger.info("=== Starting Notification Bot ===")
         logger.info("Press Ctrl+C to stop the bot")
-        bot.run()
+        bot.run(run_bot())
     except Exception as e:
         logger.error(f"Error starting bot: {str(e)}", exc_info=True)
 
@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import sqlite3
+import time
+
+from flood_control import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointStore:
+    """
+    Последний обработанный id сообщения для каждого исходного канала.
+
+    Хранится в SQLite, поэтому после перезапуска известно, с какого места
+    догонять историю канала. Принятое сообщение отмечается через received,
+    обработанное (пересланное, подавленное или отброшенное) — через done.
+    Отметка канала не обгоняет ни одно сообщение, которое еще в обработке,
+    поэтому посты, оставшиеся в очереди при остановке, будут догнаны.
+
+    snapshot фиксирует отметки перед подключением: пока догонка не отпустит
+    канал через release, отметка не сдвигается, даже если новые посты уже
+    обработаны, и пропущенный промежуток не теряется при повторном сбое.
+    """
+
+    def __init__(self, db_path, seen_limit=5000):
+        self.seen_limit = seen_limit
+        self._db = sqlite3.connect(db_path, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        # Запись на каждое сообщение: без fsync на каждую транзакцию
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS checkpoints (chat_id INTEGER PRIMARY KEY, message_id INTEGER, updated_at REAL)'
+        )
+        self._last = dict(self._db.execute('SELECT chat_id, message_id FROM checkpoints'))
+        # Принятые, но еще не обработанные сообщения каждого канала
+        self._in_flight = {}
+        # Наибольший обработанный id каждого канала
+        self._done = {}
+        # Сообщения, принятые в этом запуске: догонка их не повторяет
+        self._seen = {}
+        # Отметки, зафиксированные snapshot до завершения догонки
+        self._holds = {}
+
+    def get(self, chat_id):
+        return self._last.get(chat_id)
+
+    def advance(self, chat_id, message_id):
+        """Сдвигает отметку канала вперед; более старые id игнорируются."""
+        if message_id <= self._last.get(chat_id, 0):
+            return
+        self._last[chat_id] = message_id
+        self._db.execute(
+            'INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)', (chat_id, message_id, time.time())
+        )
+
+    def received(self, chat_id, message_id):
+        """Отмечает сообщение, принятое в обработку."""
+        self._in_flight.setdefault(chat_id, set()).add(message_id)
+        seen = self._seen.setdefault(chat_id, set())
+        seen.add(message_id)
+        if len(seen) > 2 * self.seen_limit:
+            self._seen[chat_id] = set(sorted(seen)[-self.seen_limit:])
+
+    def seen(self, chat_id, message_id):
+        """Принималось ли сообщение в этом запуске."""
+        return message_id in self._seen.get(chat_id, ())
+
+    def done(self, chat_id, message_id):
+        """Отмечает сообщение обработанным и сдвигает отметку канала, если это возможно."""
+        in_flight = self._in_flight.get(chat_id)
+        if not in_flight or message_id not in in_flight:
+            return
+        in_flight.discard(message_id)
+        self._done[chat_id] = max(self._done.get(chat_id, 0), message_id)
+        self._settle(chat_id)
+
+    def snapshot(self):
+        """
+        Фиксирует отметки каналов для догонки.
+
+        Returns:
+            dict: id канала -> последний обработанный id
+        """
+        for chat_id, message_id in self._last.items():
+            self._holds.setdefault(chat_id, message_id)
+        return dict(self._last)
+
+    def release(self, chat_id):
+        """Снимает фиксацию, когда пропущенные посты канала приняты в обработку."""
+        if self._holds.pop(chat_id, None) is not None:
+            self._settle(chat_id)
+
+    def _settle(self, chat_id):
+        mark = self._done.get(chat_id)
+        if mark is None:
+            return
+        in_flight = self._in_flight.get(chat_id)
+        if in_flight:
+            mark = min(mark, min(in_flight) - 1)
+        if chat_id in self._holds:
+            mark = min(mark, self._holds[chat_id])
+        self.advance(chat_id, mark)
+
+
+class HistoryBackfill:
+    """
+    Догоняет посты, опубликованные, пока бот был выключен или без связи.
+
+    Для каждого канала история читается пачками get_chat_history от новых
+    сообщений к отметке, зафиксированной CheckpointStore.snapshot до
+    подключения. Сообщения, уже принятые в этом запуске, пропускаются. Каналы обрабатываются параллельно
+    (не больше concurrency), запросы истории ограничены rate в секунду.
+    Найденные сообщения передаются в process(message) по возрастанию id.
+    Если пропущено больше max_messages, догоняются только последние
+    max_messages, чтобы долгий простой не завалил админов постами.
+    """
+
+    def __init__(self, client, checkpoints, process, max_messages=200, concurrency=3, rate=1.0, batch_size=100,
+                 reconnect_timeout=600):
+        self.client = client
+        self.checkpoints = checkpoints
+        self.process = process
+        self.max_messages = max_messages
+        self.batch_size = min(batch_size, 100)
+        self.reconnect_timeout = reconnect_timeout
+        self.chat_ids = []
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._bucket = TokenBucket(rate, 1)
+        self._lock = asyncio.Lock()
+        self._reconnect_task = None
+        self._reconnect_snapshot = None
+        self._closed = False
+
+    async def run(self, chat_ids, snapshot=None):
+        """
+        Догоняет пропущенные посты всех каналов.
+
+        Args:
+            chat_ids: Исходные каналы
+            snapshot: Отметки из CheckpointStore.snapshot, взятые до подключения
+        """
+        self.chat_ids = list(chat_ids)
+        if snapshot is None:
+            snapshot = self.checkpoints.snapshot()
+        # Повторный запуск во время догонки дождется ее и проверит каналы еще раз
+        async with self._lock:
+            started = time.monotonic()
+            counts = await asyncio.gather(*(
+                self._backfill_channel(chat_id, snapshot.get(chat_id)) for chat_id in self.chat_ids
+            ))
+            if any(counts):
+                logger.info(
+                    f"Backfilled {sum(counts)} missed messages from {sum(1 for count in counts if count)} channels "
+                    f"in {time.monotonic() - started:.2f}s"
+                )
+
+    def close(self):
+        """Отключает догонку при переподключении перед остановкой клиента."""
+        self._closed = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+
+    def schedule_after_reconnect(self):
+        """
+        Запускает догонку, как только сессия снова подключится.
+
+        Отметки фиксируются сразу, до переподключения: посты, принятые после
+        него, не сдвинут начало пропущенного промежутка.
+        """
+        if self._closed:
+            return
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_snapshot = self.checkpoints.snapshot()
+            self._reconnect_task = asyncio.ensure_future(self._run_after_reconnect())
+
+    async def _run_after_reconnect(self):
+        try:
+            await asyncio.wait_for(self.client.session.is_started.wait(), self.reconnect_timeout)
+        except asyncio.TimeoutError:
+            return
+        logger.info("Session reconnected, checking source channels for missed posts")
+        await self.run(self.chat_ids, self._reconnect_snapshot)
+
+    async def _backfill_channel(self, chat_id, last_id):
+        async with self._semaphore:
+            try:
+                count = await self._backfill(chat_id, last_id)
+            except Exception as e:
+                # Отметка остается зафиксированной: промежуток будет догнан при следующей догонке
+                logger.error(f"Error backfilling chat {chat_id}: {e}")
+                return 0
+            self.checkpoints.release(chat_id)
+            return count
+
+    async def _backfill(self, chat_id, last_id):
+        if last_id is None:
+            # Канал без отметки (первый запуск): догонять нечего, запоминаем текущую позицию
+            await self._bucket.acquire()
+            async for message in self.client.get_chat_history(chat_id, limit=1):
+                self.checkpoints.advance(chat_id, message.id)
+            return 0
+
+        # История идет от новых сообщений к старым
+        missed = []
+        offset_id = 0
+        while True:
+            await self._bucket.acquire()
+            batch = [message async for message in self.client.get_chat_history(
+                chat_id, limit=self.batch_size, offset_id=offset_id
+            )]
+            newer = [message for message in batch if message.id > last_id]
+            # Принятые вживую после подключения уже в обработке
+            missed.extend(message for message in newer if not self.checkpoints.seen(chat_id, message.id))
+            if len(newer) < len(batch) or len(batch) < self.batch_size or len(missed) > self.max_messages:
+                break
+            offset_id = batch[-1].id
+
+        if len(missed) > self.max_messages:
+            logger.warning(
+                f"Chat {chat_id}: more than {self.max_messages} messages missed since {last_id}, "
+                f"only the latest {self.max_messages} will be forwarded"
+            )
+            missed = missed[:self.max_messages]
+
+        missed = [message for message in reversed(missed) if not message.empty and not message.service]
+        for message in missed:
+            await self.process(message)
+        if missed:
+            logger.info(f"Chat {chat_id}: backfilled {len(missed)} messages after {last_id}")
+        return len(missed)
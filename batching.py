@@ -0,0 +1,82 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class KeyedBatcher:
+    """
+    Собирает элементы с одинаковым ключом в пачку.
+
+    Пачка отдается в flush(key, items), когда в течение delay секунд не
+    пришло новых элементов с этим ключом или когда набрано max_size
+    элементов. С debounce=False окно в delay секунд отсчитывается от первого
+    элемента пачки и не продлевается новыми.
+    """
+
+    def __init__(self, flush, delay=1.0, max_size=None, debounce=True):
+        self.flush = flush
+        self.delay = delay
+        self.max_size = max_size
+        self.debounce = debounce
+        self.flushed_batches = 0
+        self.flushed_items = 0
+        self.max_batch = 0
+        self._batches = {}
+        self._timers = {}
+        self._flushing = set()
+
+    def __len__(self):
+        return len(self._batches)
+
+    @property
+    def busy(self):
+        """Есть ли накопленные или еще отправляемые пачки"""
+        return bool(self._batches or self._flushing)
+
+    async def drain(self):
+        """Отдает все накопленные пачки, не дожидаясь окна, и ждет завершения flush."""
+        for key in list(self._batches):
+            timer = self._timers.pop(key, None)
+            if timer:
+                timer.cancel()
+            self._flush_later(key)
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
+
+    @property
+    def average_batch(self):
+        return self.flushed_items / self.flushed_batches if self.flushed_batches else 0.0
+
+    def add(self, key, item):
+        batch = self._batches.setdefault(key, [])
+        batch.append(item)
+
+        if self.max_size and len(batch) >= self.max_size:
+            timer = self._timers.pop(key, None)
+            if timer:
+                timer.cancel()
+            self._flush_later(key)
+        elif self.debounce or key not in self._timers:
+            timer = self._timers.pop(key, None)
+            if timer:
+                timer.cancel()
+            loop = asyncio.get_event_loop()
+            self._timers[key] = loop.call_later(self.delay, self._flush_later, key)
+
+    def _flush_later(self, key):
+        self._timers.pop(key, None)
+        items = self._batches.pop(key, None)
+        if items:
+            self.flushed_batches += 1
+            self.flushed_items += len(items)
+            self.max_batch = max(self.max_batch, len(items))
+            task = asyncio.ensure_future(self._run_flush(key, items))
+            self._flushing.add(task)
+            task.add_done_callback(self._flushing.discard)
+
+    async def _run_flush(self, key, items):
+        try:
+            await self.flush(key, items)
+        except Exception as e:
+            logger.error(f"Error flushing batch {key} ({len(items)} items): {e}", exc_info=True)
@@ -0,0 +1,130 @@
+"""
+Микро-бенчмарк проверки ограничений на копирование.
+
+Сравнивает прежнюю реализацию check_copy_restrictions с RestrictionEngine
+на синтетическом корпусе подписей.
+
+Запуск:
+    python benchmarks/bench_restrictions.py --messages 50000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from restrictions import DEFAULT_RULES, RestrictionEngine  # noqa: E402
+
+WORDS = (
+    'новости сегодня канал подписывайтесь видео фото обзор лучшие моменты '
+    'breaking news update photo video daily digest weekend review market '
+    'погода спорт музыка кино технологии'
+).split()
+
+
+def legacy_check_copy_restrictions(message):
+    """Прежняя реализация из user_bot (без логирования)."""
+    copy_restriction_keywords = [
+        'не копировать',
+        'copyright',
+        'all rights reserved',
+        '©',
+        'watermark',
+        'водяной знак',
+        'запрещено копирование',
+        'копирование запрещено',
+        'do not copy',
+        'no repost',
+        'не репостить',
+        'без репоста'
+    ]
+
+    text_to_check = message.text or message.caption or ''
+    text_lower = text_to_check.lower()
+
+    for keyword in copy_restriction_keywords:
+        if keyword in text_lower:
+            return True
+
+    if message.photo or message.video:
+        if message.caption and any(mark in message.caption.lower() for mark in ['watermark', 'водяной знак']):
+            return True
+
+    if message.entities:
+        for entity in message.entities:
+            if entity.type in ['hashtag', 'cashtag']:
+                hashtag = text_lower[entity.offset:entity.offset + entity.length].lower()
+                if any(tag in hashtag for tag in ['#nocopy', '#неrepost', '#запретпоста']):
+                    return True
+
+    return False
+
+
+def build_corpus(size, restricted_ratio, seed):
+    """Генерирует сообщения: тексты и подписи к медиа разной длины."""
+    rng = random.Random(seed)
+    terms = DEFAULT_RULES['keywords'] + DEFAULT_RULES['hashtags']
+    corpus = []
+    for _ in range(size):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(5, 120))]
+        entities = []
+        if rng.random() < restricted_ratio:
+            term = rng.choice(terms)
+            words.insert(rng.randint(0, len(words)), term)
+        text = ' '.join(words).capitalize()
+        if '#' in text:
+            offset = text.index('#')
+            length = text.find(' ', offset)
+            length = (length if length != -1 else len(text)) - offset
+            entities.append(SimpleNamespace(type='hashtag', offset=offset, length=length))
+
+        is_media = rng.random() < 0.6
+        corpus.append(SimpleNamespace(
+            chat=SimpleNamespace(id=-1000000000000 - rng.randint(0, 20)),
+            text=None if is_media else text,
+            caption=text if is_media else None,
+            photo=is_media or None,
+            video=None,
+            entities=entities or None
+        ))
+    return corpus
+
+
+def run(messages, repeat, restricted_ratio, seed):
+    corpus = build_corpus(messages, restricted_ratio, seed)
+    engine = RestrictionEngine()
+
+    legacy_hits = sum(1 for message in corpus if legacy_check_copy_restrictions(message))
+    engine_hits = sum(1 for message in corpus if engine.match(message))
+
+    legacy = min(timeit.repeat(lambda: [legacy_check_copy_restrictions(m) for m in corpus], number=1, repeat=repeat))
+    compiled = min(timeit.repeat(lambda: [engine.match(m) for m in corpus], number=1, repeat=repeat))
+
+    return {
+        'messages': messages,
+        'restricted_ratio': restricted_ratio,
+        'legacy_hits': legacy_hits,
+        'engine_hits': engine_hits,
+        'legacy_us_per_message': round(legacy / messages * 1e6, 3),
+        'engine_us_per_message': round(compiled / messages * 1e6, 3),
+        'speedup': round(legacy / compiled, 2) if compiled else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--restricted-ratio', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.messages, args.repeat, args.restricted_ratio, args.seed), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,385 @@
+"""
+Локальная замена pyrogram.Client для нагрузочных тестов без Telegram.
+
+FakeTelegram хранит сообщения всех чатов, имитирует задержку запросов,
+скорость передачи файлов и FloodWait, считает вызовы API и фиксирует
+момент публикации каждого поста в целевых каналах.
+"""
+import asyncio
+import io
+import os
+import random
+import re
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from types import SimpleNamespace
+
+import pyrogram
+from pyrogram.enums import MessageMediaType
+from pyrogram.errors import ChatForwardsRestricted, FloodWait
+
+CHUNK_SIZE = 1024 * 1024
+ORIGIN_RE = re.compile(r'\bpost-(\d+)\b')
+ORIGIN_HEADER = re.compile(rb'^ORIGIN:(-?\d+);')
+
+MEDIA_TYPES = {
+    'photo': MessageMediaType.PHOTO,
+    'video': MessageMediaType.VIDEO,
+    'document': MessageMediaType.DOCUMENT,
+    'voice': MessageMediaType.VOICE,
+    'video_note': MessageMediaType.VIDEO_NOTE,
+}
+
+# Методы, которые могут получить FloodWait
+FLOOD_METHODS = {
+    'forward_messages', 'send_message', 'send_photo', 'send_video', 'send_document', 'send_voice',
+    'send_video_note', 'send_media_group', 'copy_message', 'copy_media_group', 'edit_message_text'
+}
+
+
+class FakeMessage:
+    """Сообщение с набором полей pyrogram.types.Message, которые используют боты."""
+
+    def __init__(self, client, chat, message_id, origin=None, text=None, caption=None, media_kind=None,
+                 media=None, media_group_id=None, from_user=None, reply_markup=None):
+        self._client = client
+        self.id = message_id
+        self.chat = chat
+        self.from_user = from_user
+        self.origin = origin
+        self.text = text
+        self.caption = caption
+        self.media = MEDIA_TYPES.get(media_kind)
+        self.media_group_id = media_group_id
+        self.reply_markup = reply_markup
+        self.empty = False
+        self.date = datetime.now()
+        for kind in MEDIA_TYPES:
+            setattr(self, kind, media if kind == media_kind else None)
+        self.forward_from_chat = None
+        self.forward_from_message_id = None
+        self.entities = None
+        self.caption_entities = None
+
+    @property
+    def media_kind(self):
+        return self.media.value if self.media else None
+
+    async def copy(self, chat_id, **kwargs):
+        return await self._client.copy_message(chat_id, self.chat.id, self.id)
+
+    def __repr__(self):
+        return f"FakeMessage(chat={self.chat.id}, id={self.id}, origin={self.origin}, media={self.media_kind})"
+
+
+class FakeCallbackQuery:
+    def __init__(self, client, data, from_user_id, message):
+        self._client = client
+        self.data = data
+        self.from_user = SimpleNamespace(id=from_user_id)
+        self.message = message
+        self.answers = []
+
+    async def answer(self, text=None, show_alert=None, **kwargs):
+        await self._client._api('answer_callback_query')
+        self.answers.append(text)
+
+
+class FakeCommand:
+    """Команда админа боту: поля command и from_user, ответы копятся в replies."""
+
+    def __init__(self, client, from_user_id, command):
+        self._client = client
+        self.chat = SimpleNamespace(id=from_user_id)
+        self.from_user = SimpleNamespace(id=from_user_id)
+        self.command = command
+        self.replies = []
+
+    async def reply(self, text, **kwargs):
+        self.replies.append(text)
+        return await self._client.send_message(self.chat.id, text)
+
+    def stop_propagation(self):
+        # Обработчики вызываются напрямую, цепочки обработчиков нет
+        pass
+
+
+class FakeTelegram:
+    """
+    Общее состояние имитации: чаты, файлы, счетчики и моменты публикаций.
+
+    Args:
+        latency: (min, max) задержка одного запроса в секундах
+        bandwidth: Скорость передачи файлов, байт в секунду
+        flood_probability: Вероятность FloodWait на запрос отправки
+        flood_seconds: Значение FloodWait
+        forward_restricted_probability: Вероятность запрета пересылки из канала
+        stream_failure_probability: Вероятность обрыва соединения на чанк при скачивании части файла
+    """
+
+    def __init__(self, latency=(0.01, 0.05), bandwidth=50 * 1024 * 1024, flood_probability=0.0, flood_seconds=1,
+                 forward_restricted_probability=0.0, stream_failure_probability=0.0, seed=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.flood_probability = flood_probability
+        self.flood_seconds = flood_seconds
+        self.forward_restricted_probability = forward_restricted_probability
+        self.stream_failure_probability = stream_failure_probability
+        self.stream_failures = 0
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.flood_waits = 0
+        self.bytes_downloaded = 0
+        self.bytes_uploaded = 0
+        self.messages = {}
+        self.files = {}
+        self.published = defaultdict(dict)
+        self.target_channels = set()
+        self.clients = {}
+        self.client_ids = {}
+        self.update_handlers = {}
+        self.card_handler = None
+        self.tasks = set()
+        self._ids = defaultdict(int)
+        self._file_ids = 0
+
+    # Хранилище
+
+    def chat(self, chat_id):
+        return SimpleNamespace(id=chat_id, username=None, title=f"Chat {chat_id}", type=None)
+
+    def next_id(self, chat_id):
+        self._ids[chat_id] += 1
+        return self._ids[chat_id]
+
+    def register_file(self, kind, size, origin, file_name=None):
+        self._file_ids += 1
+        file_id = f"{kind}-{self._file_ids}"
+        unique_id = f"u-{origin}-{kind}-{size}"
+        self.files[file_id] = (size, origin)
+        return SimpleNamespace(file_id=file_id, file_unique_id=unique_id, file_size=size, file_name=file_name,
+                               duration=0, width=0, height=0, mime_type=None)
+
+    def store(self, client, chat_id, origin=None, from_user=None, forward_from=(None, None), **fields):
+        message = FakeMessage(client, self.chat(chat_id), self.next_id(chat_id), origin=origin,
+                              from_user=from_user, **fields)
+        message.forward_from_chat, message.forward_from_message_id = forward_from
+        self.messages[(chat_id, message.id)] = message
+        if chat_id in self.target_channels and origin is not None:
+            self.published[origin].setdefault(chat_id, time.monotonic())
+        self._deliver(chat_id, message)
+        return message
+
+    def clone(self, client, chat_id, source, from_user=None, forward=False):
+        media = getattr(source, source.media_kind) if source.media_kind else None
+        if media is not None:
+            size, origin = self.files[media.file_id]
+            media = self.register_file(source.media_kind, size, origin, media.file_name)
+        # Пересланное сообщение хранит исходный чат и id, копия — нет
+        forward_from = (source.forward_from_chat, source.forward_from_message_id) if source.forward_from_chat \
+            else (source.chat, source.id) if forward else (None, None)
+        return self.store(client, chat_id, origin=source.origin, from_user=from_user, text=source.text,
+                          caption=source.caption, media_kind=source.media_kind, media=media,
+                          media_group_id=source.media_group_id, forward_from=forward_from)
+
+    def spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def _deliver(self, chat_id, message):
+        # Сообщение в личном чате с ботом становится апдейтом для этого бота
+        handler = self.update_handlers.get(chat_id)
+        if handler:
+            bot_client, callback = handler
+            bot_view = FakeMessage(bot_client, self.chat(message.from_user.id), message.id, origin=message.origin,
+                                   text=message.text, caption=message.caption, media_kind=message.media_kind,
+                                   media=getattr(message, message.media_kind) if message.media_kind else None,
+                                   media_group_id=message.media_group_id, from_user=message.from_user)
+            bot_view.forward_from_chat = message.forward_from_chat
+            bot_view.forward_from_message_id = message.forward_from_message_id
+            self.messages[(bot_view.chat.id, bot_view.id)] = bot_view
+            self.spawn(callback(bot_client, bot_view))
+        elif message.reply_markup is not None and self.card_handler:
+            self.spawn(self.card_handler(chat_id, message))
+
+    # Имитация сети
+
+    async def api(self, method):
+        self.calls[method] += 1
+        await asyncio.sleep(self.random.uniform(*self.latency))
+        if method in FLOOD_METHODS and self.random.random() < self.flood_probability:
+            self.flood_waits += 1
+            raise FloodWait(value=self.flood_seconds)
+
+    async def transfer(self, size):
+        if self.bandwidth:
+            await asyncio.sleep(size / self.bandwidth)
+
+
+_telegram = None
+
+
+def install(telegram):
+    """Подменяет pyrogram.Client на FakeClient, работающий поверх telegram."""
+    global _telegram
+    _telegram = telegram
+    pyrogram.Client = FakeClient
+
+
+class FakeClient:
+    """Замена pyrogram.Client: те же методы, но без сети."""
+
+    def __init__(self, name, api_id=None, api_hash=None, phone_number=None, bot_token=None, **kwargs):
+        self.name = name
+        self.telegram = _telegram
+        self.me = SimpleNamespace(id=self.telegram.client_ids.get(name), is_bot=bot_token is not None)
+        self.is_connected = True
+        self.telegram.clients[name] = self
+
+    # Регистрация обработчиков: боты вызываются напрямую из нагрузочного теста
+
+    def on_message(self, *args, **kwargs):
+        return lambda function: function
+
+    def on_callback_query(self, *args, **kwargs):
+        return lambda function: function
+
+    def on_disconnect(self, *args, **kwargs):
+        return lambda function: function
+
+    def run(self, *args, **kwargs):
+        raise RuntimeError("FakeClient is driven by the load test, not by run()")
+
+    async def _api(self, method):
+        await self.telegram.api(method)
+
+    # Сообщения
+
+    async def send_message(self, chat_id, text, reply_to_message_id=None, reply_markup=None, **kwargs):
+        await self._api('send_message')
+        match = ORIGIN_RE.search(text or '')
+        origin = int(match.group(1)) if match else None
+        return self.telegram.store(self, chat_id, origin=origin, from_user=self.me, text=text,
+                                   reply_markup=reply_markup)
+
+    async def forward_messages(self, chat_id, from_chat_id, message_ids, **kwargs):
+        await self._api('forward_messages')
+        if self.telegram.random.random() < self.telegram.forward_restricted_probability:
+            raise ChatForwardsRestricted()
+        ids = [message_ids] if isinstance(message_ids, int) else list(message_ids)
+        forwarded = [self.telegram.clone(self, chat_id, self.telegram.messages[(from_chat_id, message_id)],
+                                         from_user=self.me, forward=True) for message_id in ids]
+        return forwarded[0] if isinstance(message_ids, int) else forwarded
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        await self._api('copy_message')
+        return self.telegram.clone(self, chat_id, self.telegram.messages[(from_chat_id, message_id)],
+                                   from_user=self.me)
+
+    async def copy_media_group(self, chat_id, from_chat_id, message_id, **kwargs):
+        await self._api('copy_media_group')
+        first = self.telegram.messages[(from_chat_id, message_id)]
+        group = sorted(
+            (message for (chat, _), message in self.telegram.messages.items()
+             if chat == from_chat_id and message.media_group_id == first.media_group_id),
+            key=lambda message: message.id
+        )
+        return [self.telegram.clone(self, chat_id, message, from_user=self.me) for message in group]
+
+    async def get_messages(self, chat_id, message_ids, **kwargs):
+        await self._api('get_messages')
+        ids = [message_ids] if isinstance(message_ids, int) else list(message_ids)
+        found = [self.telegram.messages.get((chat_id, message_id)) or SimpleNamespace(empty=True, id=message_id)
+                 for message_id in ids]
+        return found[0] if isinstance(message_ids, int) else found
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        await self._api('edit_message_text')
+        message = self.telegram.messages.get((chat_id, message_id))
+        if message is not None:
+            message.text = text
+            message.reply_markup = kwargs.get('reply_markup')
+        return message
+
+    # Медиа
+
+    async def stream_media(self, message, limit=0, offset=0):
+        self.telegram.calls['stream_media'] += 1
+        file_id = message if isinstance(message, str) else getattr(message, message.media_kind).file_id
+        size, origin = self.telegram.files[file_id]
+        header = f"ORIGIN:{origin};".encode()
+        chunks = max(1, -(-size // CHUNK_SIZE))
+        end = chunks if not limit else min(chunks, offset + limit)
+        for index in range(offset, end):
+            await self.telegram.api('get_file')
+            failure_probability = self.telegram.stream_failure_probability
+            if limit and failure_probability and self.telegram.random.random() < failure_probability:
+                self.telegram.stream_failures += 1
+                raise ConnectionError('Connection lost while streaming file part')
+            length = min(CHUNK_SIZE, size - index * CHUNK_SIZE)
+            await self.telegram.transfer(length)
+            self.telegram.bytes_downloaded += length
+            chunk = bytearray(length)
+            if index == 0:
+                chunk[:len(header)] = header
+            yield bytes(chunk)
+
+    async def _upload(self, kind, file, file_name=None):
+        if isinstance(file, str) and file in self.telegram.files:
+            size, origin = self.telegram.files[file]
+            return self.telegram.register_file(kind, size, origin, file_name)
+
+        if isinstance(file, str):
+            size = os.path.getsize(file)
+            with open(file, 'rb') as source:
+                head = source.read(64)
+        else:
+            position = file.tell()
+            file.seek(0, io.SEEK_END)
+            size = file.tell()
+            file.seek(position)
+            head = file.read(64)
+            file.seek(position)
+
+        match = ORIGIN_HEADER.match(head)
+        origin = int(match.group(1)) if match else None
+        await self.telegram.transfer(size)
+        self.telegram.bytes_uploaded += size
+        return self.telegram.register_file(kind, size, origin, file_name)
+
+    async def _send_media(self, kind, chat_id, file, caption=None, file_name=None, **kwargs):
+        await self._api(f'send_{kind}')
+        media = await self._upload(kind, file, file_name)
+        return self.telegram.store(self, chat_id, origin=self.telegram.files[media.file_id][1],
+                                   from_user=self.me, caption=caption, media_kind=kind, media=media)
+
+    async def send_photo(self, chat_id, photo, caption=None, **kwargs):
+        return await self._send_media('photo', chat_id, photo, caption, **kwargs)
+
+    async def send_video(self, chat_id, video, caption=None, **kwargs):
+        return await self._send_media('video', chat_id, video, caption, **kwargs)
+
+    async def send_document(self, chat_id, document, caption=None, **kwargs):
+        return await self._send_media('document', chat_id, document, caption, **kwargs)
+
+    async def send_voice(self, chat_id, voice, caption=None, **kwargs):
+        return await self._send_media('voice', chat_id, voice, caption, **kwargs)
+
+    async def send_video_note(self, chat_id, video_note, **kwargs):
+        return await self._send_media('video_note', chat_id, video_note, **kwargs)
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        await self._api('send_media_group')
+        group_id = f"fake-group-{self.telegram.next_id('groups')}"
+        sent = []
+        for item in media:
+            kind = item.__class__.__name__.replace('InputMedia', '').lower()
+            uploaded = await self._upload(kind, item.media)
+            origin = self.telegram.files[uploaded.file_id][1]
+            sent.append(self.telegram.store(self, chat_id, origin=origin, from_user=self.me,
+                                            caption=item.caption, media_kind=kind, media=uploaded,
+                                            media_group_id=group_id))
+        return sent
@@ -0,0 +1,284 @@
+"""
+Нагрузочный тест обоих ботов без Telegram.
+
+Синтетические посты из исходных каналов проходят весь путь:
+user_bot.forward_new_post -> admin_bot.handle_new_post -> карточка модерации ->
+admin_bot.handle_callback (автоматическое одобрение) -> публикация в каналы.
+С --approve batch карточки копятся, а затем все посты публикуются одной
+командой /approve_all_pending.
+Результат выводится в JSON: задержка от поста до публикации, пропускная
+способность, пиковая память и число вызовов API на пост.
+
+Запуск:
+    python benchmarks/load_test.py --posts 500 --rate 50 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_client import FakeCallbackQuery, FakeCommand, FakeTelegram, install  # noqa: E402
+from metrics import stage_seconds  # noqa: E402
+
+USER_BOT_ID = 7001
+ADMIN_BOT_ID = 7002
+MB = 1024 * 1024
+
+# Состав трафика: (тип, доля, (мин. размер, макс. размер))
+MEDIA_MIX = (
+    ('text', 0.35, (0, 0)),
+    ('photo', 0.35, (100 * 1024, 2 * MB)),
+    ('video', 0.12, (2 * MB, 60 * MB)),
+    ('document', 0.08, (50 * 1024, 20 * MB)),
+    ('voice', 0.06, (20 * 1024, 1 * MB)),
+    ('video_note', 0.04, (200 * 1024, 4 * MB)),
+)
+
+
+def percentile(values, share):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(share * (len(ordered) - 1)))))
+    return round(ordered[index], 4)
+
+
+def stage_summary():
+    """Число измерений и среднее время каждого этапа из метрик ботов."""
+    return {
+        stage: {'count': count, 'mean': round(total / count, 4)}
+        for (stage,), (_, total, count) in sorted(stage_seconds._series.items())
+    }
+
+
+def configure_environment(args, workdir):
+    source_ids = [-1000000000000 - index for index in range(1, args.sources + 1)]
+    admin_ids = [9000 + index for index in range(1, args.admins + 1)]
+    channels = [f"@bench_channel_{index}" for index in range(1, args.channels + 1)]
+    defaults = {
+        'API_ID': '1',
+        'API_HASH': 'bench',
+        'PHONE_NUMBER': '+10000000000',
+        'BOT_TOKEN': '1:bench',
+        'SOURCE_CHANNEL_IDS': ','.join(map(str, source_ids)),
+        'ADMIN_BOT_ID': str(ADMIN_BOT_ID),
+        'USER_BOT_ID': str(USER_BOT_ID),
+        'ADMIN_IDS': ','.join(map(str, admin_ids)),
+        'TARGET_CHANNEL_USERNAMES': ','.join(channels),
+        'PENDING_STORE': 'memory',
+        'RESTRICTIONS_CONFIG': os.path.join(ROOT, 'restrictions.json'),
+        'MEDIA_CACHE_PATH': os.path.join(workdir, 'media_cache.db'),
+        'CHANNEL_RATE_PER_MINUTE': str(args.channel_rate),
+        'CHANNEL_BURST': str(args.channel_burst),
+        'PUBLISH_SLOT_MINUTES': str(args.publish_slot / 60),
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+    return source_ids, admin_ids, channels
+
+
+def pick_media(rng):
+    roll = rng.random()
+    for kind, share, sizes in MEDIA_MIX:
+        roll -= share
+        if roll <= 0:
+            return kind, rng.randint(*sizes)
+    return MEDIA_MIX[0][0], 0
+
+
+def make_post(telegram, client, rng, origin, source_id, args):
+    """Создает пост в исходном канале. Возвращает сообщения поста (несколько для альбома)."""
+    words = ' '.join(f"w{rng.randint(0, 100000)}" for _ in range(rng.randint(6, 40)))
+    restricted = rng.random() < args.restricted_ratio
+    text = f"post-{origin} {words}" + (" © all rights reserved" if restricted else "")
+
+    if rng.random() < args.album_ratio:
+        group_id = f"album-{origin}"
+        return [
+            telegram.store(client, source_id, origin=origin, caption=text if index == 0 else None,
+                           media_kind='photo', media=telegram.register_file('photo', rng.randint(100 * 1024, MB), origin),
+                           media_group_id=group_id)
+            for index in range(rng.randint(2, 10))
+        ]
+
+    kind, size = pick_media(rng)
+    if kind == 'text':
+        return [telegram.store(client, source_id, origin=origin, text=text)]
+    media = telegram.register_file(kind, size, origin, file_name=f"{kind}-{origin}")
+    caption = None if kind == 'video_note' else text
+    return [telegram.store(client, source_id, origin=origin, caption=caption, media_kind=kind, media=media)]
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix='bot_bench_')
+    source_ids, admin_ids, channels = configure_environment(args, workdir)
+
+    telegram = FakeTelegram(
+        latency=(args.latency_min, args.latency_max),
+        bandwidth=args.bandwidth_mb * MB,
+        flood_probability=args.flood_probability,
+        flood_seconds=args.flood_seconds,
+        forward_restricted_probability=args.forward_restricted_ratio,
+        stream_failure_probability=args.stream_failure_probability,
+        seed=args.seed
+    )
+    telegram.client_ids = {'user_bot': USER_BOT_ID, 'notification_bot': ADMIN_BOT_ID}
+    telegram.target_channels = set(channels)
+    install(telegram)
+
+    # Боты читают конфигурацию и создают клиентов при импорте
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import admin_bot
+        import user_bot
+    finally:
+        os.chdir(cwd)
+    logging.getLogger().setLevel(getattr(logging, args.log_level))
+
+    telegram.update_handlers[ADMIN_BOT_ID] = (admin_bot.bot, admin_bot.handle_new_post)
+
+    async def approve(chat_id, card):
+        # Первый админ одобряет публикацию во все каналы
+        if chat_id != admin_ids[0]:
+            return
+        await asyncio.sleep(args.think_time)
+        # Первая строка: «во все каналы» сразу или через очередь публикаций
+        data = card.reply_markup.inline_keyboard[0][1 if args.approve == 'queue' else 0].callback_data
+        await admin_bot.handle_callback(admin_bot.bot, FakeCallbackQuery(admin_bot.bot, data, chat_id, card))
+
+    telegram.card_handler = approve if args.approve != 'batch' else None
+    if args.approve == 'queue':
+        admin_bot.publish_scheduler.start()
+
+    rng = telegram.random
+    posted_at = {}
+    tracemalloc_enabled = args.tracemalloc
+    if tracemalloc_enabled:
+        tracemalloc.start()
+
+    started = time.monotonic()
+    for origin in range(1, args.posts + 1):
+        source_id = source_ids[rng.randrange(len(source_ids))]
+        messages = make_post(telegram, user_bot.app, rng, origin, source_id, args)
+        posted_at[origin] = time.monotonic()
+        for message in messages:
+            telegram.spawn(user_bot.forward_new_post(user_bot.app, message))
+        if args.rate:
+            await asyncio.sleep(1 / args.rate)
+
+    def completed():
+        return [origin for origin in posted_at if len(telegram.published.get(origin, ())) == len(channels)]
+
+    if args.approve == 'batch':
+        # Ждем, пока все карточки дойдут до админов, и одобряем все посты одной командой
+        last_calls = -1
+        while sum(telegram.calls.values()) != last_calls:
+            last_calls = sum(telegram.calls.values())
+            await asyncio.sleep(max(args.think_time, 0.5))
+        command = FakeCommand(admin_bot.bot, admin_ids[0], ['approve_all_pending'])
+        await admin_bot.approve_all_pending_command(admin_bot.bot, command)
+        logging.getLogger(__name__).warning(command.replies[-1] if command.replies else 'No reply to batch command')
+
+    # Ждем, пока все посты будут опубликованы или пока запросы не прекратятся
+    deadline = time.monotonic() + args.drain_timeout
+    last_calls, last_progress = -1, time.monotonic()
+    while len(completed()) < len(posted_at) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        calls = sum(telegram.calls.values())
+        if calls != last_calls:
+            last_calls, last_progress = calls, time.monotonic()
+        elif time.monotonic() - last_progress > args.idle_timeout:
+            break
+
+    done = completed()
+    latencies = [max(telegram.published[origin].values()) - posted_at[origin] for origin in done]
+    # Время простоя в ожидании недошедших постов в пропускную способность не входит
+    finished = max((max(telegram.published[origin].values()) for origin in done), default=time.monotonic())
+
+    peak_traced = tracemalloc.get_traced_memory()[1] if tracemalloc_enabled else None
+    api_calls = sum(count for method, count in telegram.calls.items() if method != 'stream_media')
+
+    return {
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'posts': args.posts,
+        'published': len(latencies),
+        'unfinished': args.posts - len(latencies),
+        'duration_seconds': round(finished - started, 3),
+        'throughput_posts_per_second': round(len(latencies) / (finished - started), 3) if latencies else 0,
+        'end_to_end_latency_seconds': {
+            'mean': round(statistics.mean(latencies), 4) if latencies else None,
+            'p50': percentile(latencies, 0.5),
+            'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99),
+            'max': round(max(latencies), 4) if latencies else None,
+        },
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'peak_traced_bytes': peak_traced,
+        'api_calls_total': api_calls,
+        'api_calls_per_post': round(api_calls / args.posts, 3),
+        'api_calls': dict(sorted(telegram.calls.items())),
+        'stage_seconds': stage_summary(),
+        'flood_waits_injected': telegram.flood_waits,
+        'stream_failures_injected': telegram.stream_failures,
+        'bytes_downloaded': telegram.bytes_downloaded,
+        'bytes_uploaded': telegram.bytes_uploaded,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--posts', type=int, default=200, help='Число постов')
+    parser.add_argument('--rate', type=float, default=20, help='Постов в секунду (0 — все сразу)')
+    parser.add_argument('--sources', type=int, default=5, help='Исходных каналов')
+    parser.add_argument('--admins', type=int, default=3, help='Админов')
+    parser.add_argument('--channels', type=int, default=3, help='Целевых каналов')
+    parser.add_argument('--album-ratio', type=float, default=0.05, help='Доля альбомов')
+    parser.add_argument('--restricted-ratio', type=float, default=0.05, help='Доля постов с запретом копирования')
+    parser.add_argument('--forward-restricted-ratio', type=float, default=0.02,
+                        help='Вероятность отказа forward_messages')
+    parser.add_argument('--latency-min', type=float, default=0.02, help='Мин. задержка запроса, с')
+    parser.add_argument('--latency-max', type=float, default=0.08, help='Макс. задержка запроса, с')
+    parser.add_argument('--bandwidth-mb', type=float, default=50, help='Скорость передачи файлов, МБ/с')
+    parser.add_argument('--flood-probability', type=float, default=0.0, help='Вероятность FloodWait на запрос')
+    parser.add_argument('--flood-seconds', type=int, default=1, help='Значение FloodWait, с')
+    parser.add_argument('--stream-failure-probability', type=float, default=0.0,
+                        help='Вероятность обрыва на чанк при скачивании файла по частям')
+    parser.add_argument('--channel-rate', type=float, default=600,
+                        help='Лимит публикаций в канал в минуту (CHANNEL_RATE_PER_MINUTE)')
+    parser.add_argument('--channel-burst', type=int, default=20, help='CHANNEL_BURST')
+    parser.add_argument('--approve', choices=('now', 'queue', 'batch'), default='now',
+                        help='Публиковать сразу, через очередь публикаций или одной командой /approve_all_pending')
+    parser.add_argument('--publish-slot', type=float, default=0.05,
+                        help='Интервал между публикациями из очереди в один канал, с (PUBLISH_SLOT_MINUTES)')
+    parser.add_argument('--think-time', type=float, default=0.1, help='Время реакции админа, с')
+    parser.add_argument('--drain-timeout', type=float, default=300, help='Сколько ждать завершения, с')
+    parser.add_argument('--idle-timeout', type=float, default=10, help='Остановка, если нет запросов столько секунд')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tracemalloc', action='store_true', help='Считать пик памяти через tracemalloc')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', help='Файл для результата (по умолчанию stdout)')
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    report = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            output.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import asynccontextmanager
+
+from pyrogram.errors import FloodWait
+
+from flood_control import TRANSIENT_ERRORS, TokenBucket
+from metrics import retries_total, stage_seconds
+
+logger = logging.getLogger(__name__)
+
+# Размер чанка stream_media: offset и limit задаются в чанках
+CHUNK_SIZE = 1024 * 1024
+
+# Ошибки, после которых часть скачивается заново с места обрыва
+PART_ERRORS = TRANSIENT_ERRORS + (OSError,)
+
+
+class ChunkedDownloader:
+    """
+    Скачивает крупные файлы частями по нескольким соединениям с докачкой.
+
+    Файл делится на части по part_size байт, каждая часть скачивается
+    отдельным stream_media с offset и limit и пишется в свое место файла.
+    Готовые части отмечаются в файле .parts рядом со скачиваемым, поэтому
+    после обрыва повторяется только недокачанный остаток части. Файл
+    удаляется после отправки и после ошибки передачи; остается только файл
+    передачи, прерванной остановкой бота, — ее пост догоняется после запуска,
+    и скачивание продолжается с места остановки. Такие файлы старше
+    stale_after секунд удаляются при запуске. Имена частичных файлов
+    начинаются с prefix, чтобы шарды с общим work_dir не докачивали файлы
+    друг друга.
+
+    Общий для всех передач бюджет: не больше max_parts частей одновременно и
+    не больше bandwidth байт в секунду на скачивание и отправку крупных файлов
+    (0 — без ограничения), чтобы небольшие посты не ждали крупных.
+    """
+
+    def __init__(self, client, max_parts=4, bandwidth=0, part_size=8 * CHUNK_SIZE, max_retries=5, work_dir=None,
+                 prefix='relay_', stale_after=24 * 3600):
+        self.client = client
+        self.prefix = prefix
+        self.part_chunks = max(1, part_size // CHUNK_SIZE)
+        self.max_retries = max_retries
+        self.work_dir = work_dir or tempfile.gettempdir()
+        self.resumed = 0
+        self._semaphore = asyncio.Semaphore(max_parts)
+        self._bucket = TokenBucket(bandwidth, max(bandwidth, CHUNK_SIZE)) if bandwidth else None
+        self._locks = {}
+        self._remove_stale(stale_after)
+
+    def _paths(self, media, file_name):
+        path = os.path.join(
+            self.work_dir, f"{self.prefix}{media.file_unique_id}{os.path.splitext(file_name or '')[1]}"
+        )
+        return path, path + '.parts'
+
+    def _remove_stale(self, stale_after):
+        now = time.time()
+        try:
+            names = os.listdir(self.work_dir)
+        except OSError:
+            return
+        for name in names:
+            if not (name.startswith(self.prefix) and name.endswith('.parts')):
+                continue
+            state_path = os.path.join(self.work_dir, name)
+            try:
+                if now - os.path.getmtime(state_path) > stale_after:
+                    self._discard(state_path[:-len('.parts')], state_path)
+            except OSError as e:
+                logger.error(f"Error removing stale partial download {state_path}: {e}")
+
+    @staticmethod
+    def _discard(path, state_path):
+        for file_path in (path, state_path):
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+
+    @asynccontextmanager
+    async def fetch(self, media, file_name):
+        """
+        Скачивает файл и отдает путь к нему.
+
+        Одновременные передачи одного файла выполняются по очереди. Файл
+        удаляется при выходе, кроме отмены при остановке бота: тогда он
+        остается для докачки после запуска.
+
+        Args:
+            media: Объект медиа Pyrogram
+            file_name: Имя файла для расширения
+        """
+        key = media.file_unique_id
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                path, state_path = self._paths(media, file_name)
+                keep = False
+                try:
+                    with stage_seconds.time(stage='download'):
+                        await self._download(media, path, state_path)
+                    yield path
+                except asyncio.CancelledError:
+                    # Повторной попытки в этом процессе не будет, файл нужен для докачки после запуска
+                    keep = True
+                    raise
+                finally:
+                    if not keep:
+                        self._discard(path, state_path)
+        finally:
+            if not lock.locked():
+                self._locks.pop(key, None)
+
+    def upload_progress(self):
+        """
+        Функция progress для send_*, ограничивающая скорость отправки крупного файла.
+
+        Returns:
+            Корутина-функция progress(current, total) или None без ограничения скорости
+        """
+        if self._bucket is None:
+            return None
+        sent = [0]
+
+        async def progress(current, total):
+            delta, sent[0] = current - sent[0], current
+            while delta > 0:
+                step = min(delta, self._bucket.capacity)
+                await self._bucket.acquire(step)
+                delta -= step
+        return progress
+
+    async def _download(self, media, path, state_path):
+        size = getattr(media, 'file_size', 0) or 0
+        total_chunks = max(1, -(-size // CHUNK_SIZE))
+        part_count = -(-total_chunks // self.part_chunks)
+        state = self._load_state(path, state_path, size)
+        done = set(state['done'])
+        if done:
+            self.resumed += 1
+            logger.info(f"Resuming download of {media.file_unique_id}: {len(done)}/{part_count} parts done")
+
+        tasks = [
+            asyncio.ensure_future(self._download_part(media, path, index, total_chunks))
+            for index in range(part_count) if index not in done
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                index = await task
+                state['done'].append(index)
+                self._save_state(state_path, state)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    def _load_state(self, path, state_path, size):
+        try:
+            with open(state_path, encoding='utf-8') as state_file:
+                state = json.load(state_file)
+            if state['size'] == size and state['part_chunks'] == self.part_chunks and os.path.exists(path):
+                return state
+        except (OSError, ValueError, KeyError):
+            pass
+
+        # Начинаем заново: файл нужного размера, части дописываются на свои места
+        with open(path, 'wb') as file:
+            file.truncate(size)
+        state = {'size': size, 'part_chunks': self.part_chunks, 'done': []}
+        self._save_state(state_path, state)
+        return state
+
+    @staticmethod
+    def _save_state(state_path, state):
+        with open(state_path, 'w', encoding='utf-8') as state_file:
+            json.dump(state, state_file)
+
+    async def _download_part(self, media, path, index, total_chunks):
+        first = index * self.part_chunks
+        count = min(self.part_chunks, total_chunks - first)
+        loop = asyncio.get_event_loop()
+        written = 0
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    with open(path, 'r+b') as file:
+                        file.seek((first + written) * CHUNK_SIZE)
+                        async for chunk in self.client.stream_media(
+                            media.file_id, offset=first + written, limit=count - written
+                        ):
+                            if self._bucket is not None:
+                                await self._bucket.acquire(len(chunk))
+                            await loop.run_in_executor(None, file.write, chunk)
+                            written += 1
+                return index
+            except FloodWait as e:
+                delay = e.value
+                error = e
+            except PART_ERRORS as e:
+                delay = min(2 ** attempt, 30)
+                error = e
+
+            attempt += 1
+            if attempt > self.max_retries:
+                raise error
+            retries_total.inc(component='chunked_download')
+            logger.warning(
+                f"Part {index} of {media.file_unique_id} interrupted after {written}/{count} chunks, "
+                f"resuming in {delay:.0f}s: {error}"
+            )
+            await asyncio.sleep(delay)
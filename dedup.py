@@ -0,0 +1,256 @@
+import asyncio
+import hashlib
+import logging
+import re
+import sqlite3
+import time
+from collections import OrderedDict, namedtuple
+
+from media_relay import get_media
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+suppressed_total = registry.counter(
+    'tgbot_dedup_suppressed_total', 'Messages suppressed as duplicates of already forwarded ones', ('kind',)
+)
+
+# Найденный дубликат: по какому признаку и когда последний раз встречен оригинал
+DuplicateMatch = namedtuple('DuplicateMatch', ['kind', 'fingerprint', 'seen_at'])
+
+_URL_RE = re.compile(r'https?://\S+|t\.me/\S+|@\w+')
+_WORD_RE = re.compile(r'\w+')
+
+MINHASH_PERMUTATIONS = 32
+MINHASH_BANDS = 8
+_ROWS = MINHASH_PERMUTATIONS // MINHASH_BANDS
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 32) - 1
+# Фиксированные коэффициенты, чтобы отпечатки совпадали между перезапусками
+_COEFFICIENTS = [
+    (int.from_bytes(hashlib.blake2b(b'a%d' % i, digest_size=8).digest(), 'big') % _PRIME | 1,
+     int.from_bytes(hashlib.blake2b(b'b%d' % i, digest_size=8).digest(), 'big') % _PRIME)
+    for i in range(MINHASH_PERMUTATIONS)
+]
+
+
+def normalize_text(text):
+    """Приводит текст к виду для сравнения: без ссылок, упоминаний, регистра и пунктуации."""
+    return _WORD_RE.findall(_URL_RE.sub(' ', text.lower()))
+
+
+def minhash(words):
+    """
+    Считает MinHash-сигнатуру множества слов.
+
+    Доля совпадающих позиций двух сигнатур оценивает коэффициент Жаккара
+    исходных множеств, поэтому подписи с мелкими правками остаются похожими.
+    """
+    hashes = [int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'big')
+              for word in set(words)]
+    return tuple(min((a * value + b) % _PRIME for value in hashes) & _MASK for a, b in _COEFFICIENTS)
+
+
+def similarity(left, right):
+    return sum(1 for x, y in zip(left, right) if x == y) / MINHASH_PERMUTATIONS
+
+
+def _encode(signature):
+    return 'text:' + ''.join(f'{value:08x}' for value in signature)
+
+
+def _decode(fingerprint):
+    return tuple(int(fingerprint[i:i + 8], 16) for i in range(5, len(fingerprint), 8))
+
+
+def _bands(signature):
+    return [(band, signature[band * _ROWS:(band + 1) * _ROWS]) for band in range(MINHASH_BANDS)]
+
+
+class DedupIndex:
+    """
+    Индекс уже пересланных сообщений для подавления повторов между каналами.
+
+    Медиа сравнивается по file_unique_id, текст без медиа — по MinHash
+    нормализованного текста: дубликатом считается текст с оценкой сходства
+    не ниже threshold. Записи живут window секунд с последнего появления,
+    при превышении max_entries вытесняются давно не встречавшиеся (LRU).
+    Если задан db_path, индекс сохраняется в SQLite и переживает перезапуск.
+    Несколько процессов (шарды User Bot) могут делить один файл: проверка
+    выполняется в транзакции, которая сначала подтягивает записи, добавленные
+    другими процессами, поэтому повтор из канала другого шарда тоже подавляется.
+
+    Запись помнит сообщение, которое ее создало: то же сообщение, пришедшее
+    снова (например, при догонке после остановки до пересылки), повтором
+    самого себя не считается.
+    """
+
+    def __init__(self, window=24 * 3600, max_entries=50000, threshold=0.8, min_words=5, db_path=None):
+        self.window = window
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.min_words = min_words
+        self.checked = 0
+        self.suppressed = 0
+        self._entries = OrderedDict()
+        # fingerprint -> (chat_id, message_id) сообщения, создавшего запись
+        self._origins = {}
+        self._bands = {}
+        self._db = None
+        # Самая поздняя запись базы, уже загруженная в память
+        self._synced_at = 0.0
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS dedup_entries ('
+                'fingerprint TEXT PRIMARY KEY, seen_at REAL, chat_id INTEGER, message_id INTEGER)'
+            )
+            # Базы прежнего формата хранили только отпечаток и время
+            columns = {row[1] for row in self._db.execute('PRAGMA table_info(dedup_entries)')}
+            for column in ('chat_id', 'message_id'):
+                if column not in columns:
+                    self._db.execute(f'ALTER TABLE dedup_entries ADD COLUMN {column} INTEGER')
+            self._db.execute('CREATE INDEX IF NOT EXISTS dedup_entries_seen_at ON dedup_entries (seen_at)')
+            self._db.execute('DELETE FROM dedup_entries WHERE seen_at < ?', (time.time() - self.window,))
+            self._sync()
+            logger.info(f"Dedup index {db_path}: {len(self._entries)} entries restored")
+
+    @property
+    def stats(self):
+        return {'checked': self.checked, 'suppressed': self.suppressed, 'entries': len(self._entries)}
+
+    async def fingerprint(self, message):
+        """
+        Вычисляет отпечаток сообщения.
+
+        MinHash считается в пуле потоков, чтобы не задерживать цикл событий.
+
+        Returns:
+            str | None: 'media:<file_unique_id>', 'text:<minhash>' или None
+        """
+        media_info = get_media(message)
+        if media_info:
+            return f"media:{media_info[1].file_unique_id}"
+
+        text = message.text or message.caption
+        if not text:
+            return None
+        loop = asyncio.get_event_loop()
+        words = normalize_text(text)
+        if len(words) < self.min_words:
+            return None
+        signature = await loop.run_in_executor(None, minhash, words)
+        return _encode(signature)
+
+    async def check(self, message, fingerprint=None):
+        """
+        Проверяет сообщение и запоминает его, если это не дубликат.
+
+        Args:
+            message: Объект сообщения Pyrogram
+            fingerprint: Заранее вычисленный отпечаток сообщения
+
+        Returns:
+            DuplicateMatch | None: Совпадение с ранее пересланным сообщением или None
+        """
+        if fingerprint is None:
+            fingerprint = await self.fingerprint(message)
+        if fingerprint is None:
+            return None
+
+        self.checked += 1
+        origin = (message.chat.id, message.id)
+        if self._db is None:
+            return self._check(fingerprint, origin)
+
+        # Процессы с общим файлом проверяют и записывают посты по очереди
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            self._sync()
+            return self._check(fingerprint, origin)
+        finally:
+            self._db.execute('COMMIT')
+
+    def _sync(self):
+        """Загружает записи, добавленные или продленные в базе после прошлой синхронизации."""
+        rows = self._db.execute(
+            'SELECT fingerprint, seen_at, chat_id, message_id FROM dedup_entries WHERE seen_at > ? ORDER BY seen_at',
+            (self._synced_at,)
+        ).fetchall()
+        for fingerprint, seen_at, chat_id, message_id in rows:
+            origin = (chat_id, message_id) if message_id is not None else None
+            self._add(fingerprint, seen_at, origin, persist=False)
+
+    def _check(self, fingerprint, origin):
+        self._evict_expired()
+        match = self._find(fingerprint)
+        if match and self._origins.get(match.fingerprint) != origin:
+            self.suppressed += 1
+            suppressed_total.inc(kind=match.kind)
+            # Повтор продлевает жизнь записи оригинала
+            self._add(match.fingerprint, time.time(), self._origins.get(match.fingerprint))
+            return match
+
+        self._add(fingerprint, time.time(), origin)
+        return None
+
+    def _find(self, fingerprint):
+        seen_at = self._entries.get(fingerprint)
+        if seen_at is not None:
+            return DuplicateMatch(fingerprint.split(':', 1)[0], fingerprint, seen_at)
+
+        if not fingerprint.startswith('text:'):
+            return None
+
+        # Кандидаты — тексты, у которых совпала хотя бы одна полоса сигнатуры
+        signature = _decode(fingerprint)
+        checked = set()
+        for band in _bands(signature):
+            for candidate in self._bands.get(band, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                if similarity(signature, _decode(candidate)) >= self.threshold:
+                    return DuplicateMatch('near_text', candidate, self._entries[candidate])
+        return None
+
+    def _add(self, fingerprint, seen_at, origin, persist=True):
+        self._synced_at = max(self._synced_at, seen_at)
+        self._entries[fingerprint] = seen_at
+        self._entries.move_to_end(fingerprint)
+        self._origins[fingerprint] = origin
+        if fingerprint.startswith('text:'):
+            for band in _bands(_decode(fingerprint)):
+                self._bands.setdefault(band, set()).add(fingerprint)
+        if persist and self._db:
+            chat_id, message_id = origin or (None, None)
+            self._db.execute(
+                'INSERT OR REPLACE INTO dedup_entries VALUES (?, ?, ?, ?)', (fingerprint, seen_at, chat_id, message_id)
+            )
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, fingerprint):
+        self._entries.pop(fingerprint, None)
+        self._origins.pop(fingerprint, None)
+        if fingerprint.startswith('text:'):
+            for band in _bands(_decode(fingerprint)):
+                candidates = self._bands.get(band)
+                if candidates:
+                    candidates.discard(fingerprint)
+                    if not candidates:
+                        del self._bands[band]
+        if self._db:
+            self._db.execute('DELETE FROM dedup_entries WHERE fingerprint = ?', (fingerprint,))
+
+    def _evict_expired(self):
+        # Записи упорядочены по времени последнего появления
+        deadline = time.time() - self.window
+        while self._entries:
+            fingerprint, seen_at = next(iter(self._entries.items()))
+            if seen_at >= deadline:
+                break
+            self._remove(fingerprint)
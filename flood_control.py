@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import time
+from collections import namedtuple
+
+from pyrogram.errors import FloodWait, InternalServerError, ServiceUnavailable
+
+from metrics import flood_wait_seconds_total, flood_waits_total, retries_total
+
+logger = logging.getLogger(__name__)
+
+# Результат доставки в один чат
+DeliveryResult = namedtuple('DeliveryResult', ['chat_id', 'result', 'error', 'latency'])
+
+# Временные ошибки, после которых запрос имеет смысл повторить
+TRANSIENT_ERRORS = (InternalServerError, ServiceUnavailable, ConnectionError, asyncio.TimeoutError)
+
+
+class TokenBucket:
+    """Ограничитель частоты запросов: rate токенов в секунду, не более capacity подряд."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens=1):
+        async with self._lock:
+            self._refill()
+            while self._tokens < tokens:
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= tokens
+
+
+class FloodAwareDispatcher:
+    """
+    Выполняет запросы к нескольким чатам параллельно с ограничением числа
+    одновременных запросов.
+
+    При FloodWait приостанавливается только тот чат, к которому относится
+    ошибка: остальные чаты продолжают получать сообщения. Повторные FloodWait
+    для одного чата увеличивают паузу экспоненциально.
+    """
+
+    def __init__(self, max_concurrency=8, max_retries=3, base_backoff=1.0, max_backoff=300.0):
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._paused_until = {}
+        self._flood_streak = {}
+        self.stats = {}
+
+    def pause(self, chat_id, seconds):
+        """Приостанавливает отправку в чат на указанное число секунд."""
+        streak = self._flood_streak.get(chat_id, 0)
+        delay = min(max(seconds, self.base_backoff * 2 ** streak), self.max_backoff)
+        self._flood_streak[chat_id] = streak + 1
+        self._paused_until[chat_id] = max(self._paused_until.get(chat_id, 0), time.monotonic() + delay)
+        return delay
+
+    async def _wait_if_paused(self, chat_id):
+        delay = self._paused_until.get(chat_id, 0) - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def call(self, chat_id, make_call):
+        """
+        Выполняет запрос к чату с учетом FloodWait.
+
+        Args:
+            chat_id: Чат, к которому относится запрос
+            make_call: Функция без аргументов, возвращающая корутину запроса
+
+        Returns:
+            Результат запроса
+        """
+        attempt = 0
+        while True:
+            await self._wait_if_paused(chat_id)
+            try:
+                async with self._semaphore:
+                    result = await make_call()
+                self._flood_streak.pop(chat_id, None)
+                return result
+            except FloodWait as e:
+                flood_waits_total.inc(component='fan_out')
+                flood_wait_seconds_total.inc(e.value, component='fan_out')
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                retries_total.inc(component='fan_out')
+                delay = self.pause(chat_id, e.value)
+                logger.warning(f"FloodWait for chat {chat_id}: pausing it for {delay:.1f}s (attempt {attempt})")
+
+    async def fan_out(self, chat_ids, deliver):
+        """
+        Параллельно выполняет deliver(chat_id) для каждого чата.
+
+        Args:
+            chat_ids: Список чатов
+            deliver: Корутина-функция доставки в один чат
+
+        Returns:
+            list[DeliveryResult]: Результаты в порядке chat_ids
+        """
+        async def run(chat_id):
+            started = time.monotonic()
+            try:
+                result, error = await deliver(chat_id), None
+            except Exception as e:
+                result, error = None, e
+            latency = time.monotonic() - started
+            self._record(chat_id, latency)
+            return DeliveryResult(chat_id, result, error, latency)
+
+        return await asyncio.gather(*(run(chat_id) for chat_id in chat_ids))
+
+    def _record(self, chat_id, latency):
+        stats = self.stats.setdefault(chat_id, {'count': 0, 'total': 0.0, 'last': 0.0, 'max': 0.0})
+        stats['count'] += 1
+        stats['total'] += latency
+        stats['last'] = latency
+        stats['max'] = max(stats['max'], latency)
@@ -0,0 +1,183 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Стандартные атрибуты LogRecord; все остальные попадают в JSON как поля из extra
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует запись одной строкой JSON: время, уровень, логгер, сообщение и поля из extra."""
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        elif record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Прореживает частые INFO-записи.
+
+    С каждого места вызова в секунду проходят первые burst записей, из
+    остальных — каждая every-я с полем sampled, сколько записей пропущено.
+    WARNING и выше проходят всегда.
+    """
+
+    def __init__(self, burst=20, every=10):
+        super().__init__()
+        self.burst = burst
+        self.every = every
+        self._sites = {}
+
+    def filter(self, record):
+        if not self.burst or record.levelno > logging.INFO:
+            return True
+
+        site = (record.pathname, record.lineno)
+        second = int(record.created)
+        state = self._sites.get(site)
+        if state is None or state[0] != second:
+            state = self._sites[site] = [second, 0, state[2] if state else 0]
+        state[1] += 1
+        if state[1] <= self.burst:
+            return True
+
+        state[2] += 1
+        if state[2] < self.every:
+            return False
+        record.sampled = state[2] - 1
+        state[2] = 0
+        return True
+
+
+_exception_formatter = logging.Formatter()
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """
+    Кладет подготовленную запись в очередь, не дожидаясь записи в файл.
+
+    Длинные сообщения обрезаются до max_length символов. Если очередь
+    переполнена, запись отбрасывается, а не блокирует цикл событий.
+    """
+
+    def __init__(self, log_queue, max_length=2000):
+        super().__init__(log_queue)
+        self.max_length = max_length
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Аргументы и исключение превращаются в строки здесь, в потоке вызова,
+        # чтобы в очередь не попадали ссылки на изменяемые объекты
+        record = copy.copy(record)
+        message = record.getMessage()
+        if self.max_length and len(message) > self.max_length:
+            message = f"{message[:self.max_length]}… (+{len(message) - self.max_length} chars)"
+        if record.exc_info and not record.exc_text:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+        record.msg = record.message = message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _file_handler(path, max_bytes, rotate_when, backup_count):
+    if rotate_when:
+        return logging.handlers.TimedRotatingFileHandler(
+            path, when=rotate_when, backupCount=backup_count, encoding='utf-8'
+        )
+    return logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+    )
+
+
+def setup_logging(log_file=None, level='INFO', fmt='json', max_bytes=10 * 1024 * 1024, rotate_when=None,
+                  backup_count=5, sample_burst=20, sample_every=10, max_length=2000, queue_size=10000):
+    """
+    Настраивает корневой логгер: записи уходят в очередь, а в консоль и файл
+    их пишет фоновый поток, поэтому запись в лог не блокирует цикл событий.
+
+    Args:
+        log_file: Файл лога или None, чтобы писать только в консоль
+        level: Уровень логирования
+        fmt: 'json' — одна JSON-запись на строку, 'text' — прежний текстовый формат
+        max_bytes: Размер файла, после которого он ротируется
+        rotate_when: Ротация по времени ('midnight', 'H' и т.д.) вместо ротации по размеру
+        backup_count: Сколько старых файлов хранить
+        sample_burst: Сколько INFO-записей в секунду пропускать с одного места вызова, 0 — без прореживания
+        sample_every: Из остальных INFO-записей пропускать каждую N-ю
+        max_length: Максимальная длина сообщения, 0 — без обрезки
+        queue_size: Размер очереди записей
+
+    Returns:
+        AsyncQueueHandler: Обработчик, подключенный к корневому логгеру
+    """
+    formatter = JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(_file_handler(log_file, max_bytes, rotate_when, backup_count))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(queue_size)
+    queue_handler = AsyncQueueHandler(log_queue, max_length=max_length)
+    if sample_burst:
+        queue_handler.addFilter(SamplingFilter(sample_burst, sample_every))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # Дописываем оставшиеся в очереди записи при выходе
+    atexit.register(listener.stop)
+    return queue_handler
+
+
+def setup_logging_from_env(default_log_file=None, log_file_env=None):
+    """
+    Настраивает логирование по переменным окружения LOG_*.
+
+    Args:
+        default_log_file: Файл лога, если переменная log_file_env не задана
+        log_file_env: Переменная окружения с путем к файлу лога этого бота
+    """
+    return setup_logging(
+        log_file=(os.getenv(log_file_env) if log_file_env else None) or default_log_file,
+        level=(os.getenv('LOG_LEVEL') or 'INFO').upper(),
+        fmt=os.getenv('LOG_FORMAT') or 'json',
+        max_bytes=int(float(os.getenv('LOG_MAX_MB') or 10) * 1024 * 1024),
+        rotate_when=os.getenv('LOG_ROTATE_WHEN') or None,
+        backup_count=int(os.getenv('LOG_BACKUP_COUNT') or 5),
+        sample_burst=int(os.getenv('LOG_SAMPLE_BURST') or 20),
+        sample_every=int(os.getenv('LOG_SAMPLE_EVERY') or 10),
+        max_length=int(os.getenv('LOG_MAX_MESSAGE_LENGTH') or 2000),
+        queue_size=int(os.getenv('LOG_QUEUE_SIZE') or 10000)
+    )
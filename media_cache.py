@@ -0,0 +1,118 @@
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+
+from pyrogram.errors import (
+    FileIdInvalid, FileReferenceEmpty, FileReferenceExpired, FileReferenceInvalid, MediaEmpty, MediaInvalid
+)
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+lookups_total = registry.counter(
+    'tgbot_media_cache_lookups_total', 'Media cache lookups by file_unique_id', ('result',)
+)
+invalidations_total = registry.counter(
+    'tgbot_media_cache_invalidations_total', 'Cached file_ids rejected by Telegram and removed'
+)
+
+# Ошибки, означающие, что сохраненный file_id больше не принимается
+STALE_FILE_ID_ERRORS = (
+    FileIdInvalid, FileReferenceEmpty, FileReferenceExpired, FileReferenceInvalid, MediaEmpty, MediaInvalid
+)
+
+
+class MediaCache:
+    """
+    Соответствие file_unique_id исходного файла и file_id нашей загруженной копии.
+
+    Повторная пересылка того же файла (логотип канала, репост видео)
+    отправляется по file_id без скачивания и загрузки. Записи живут ttl
+    секунд, при превышении max_entries вытесняются давно не использованные.
+    Если задан db_path, кеш сохраняется в SQLite и переживает перезапуск.
+    """
+
+    def __init__(self, max_entries=20000, ttl=30 * 24 * 3600, db_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._db = None
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS media_cache (file_unique_id TEXT PRIMARY KEY, file_id TEXT, stored_at REAL)'
+            )
+            if self.ttl:
+                self._db.execute('DELETE FROM media_cache WHERE stored_at < ?', (time.time() - self.ttl,))
+            for file_unique_id, file_id, stored_at in self._db.execute(
+                'SELECT file_unique_id, file_id, stored_at FROM media_cache ORDER BY stored_at'
+            ):
+                self._entries[file_unique_id] = (file_id, stored_at)
+            self._trim()
+            logger.info(f"Media cache {db_path}: {len(self._entries)} entries restored")
+
+    @property
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'entries': len(self._entries)
+        }
+
+    def get(self, file_unique_id):
+        """
+        Возвращает file_id ранее загруженной копии файла.
+
+        Args:
+            file_unique_id: Уникальный идентификатор исходного файла
+
+        Returns:
+            str | None: file_id или None, если файла нет в кеше
+        """
+        entry = self._entries.get(file_unique_id)
+        if entry is None or (self.ttl and time.time() - entry[1] > self.ttl):
+            if entry is not None:
+                self._remove(file_unique_id)
+            self.misses += 1
+            lookups_total.inc(result='miss')
+            return None
+
+        self._entries.move_to_end(file_unique_id)
+        self.hits += 1
+        lookups_total.inc(result='hit')
+        return entry[0]
+
+    def put(self, file_unique_id, file_id):
+        stored_at = time.time()
+        self._entries[file_unique_id] = (file_id, stored_at)
+        self._entries.move_to_end(file_unique_id)
+        if self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO media_cache VALUES (?, ?, ?)', (file_unique_id, file_id, stored_at)
+            )
+        self._trim()
+
+    def invalidate(self, file_unique_id):
+        """Удаляет file_id, который Telegram отказался принять."""
+        if file_unique_id in self._entries:
+            self.invalidations += 1
+            invalidations_total.inc()
+            self._remove(file_unique_id)
+            logger.warning(f"Stale cached file_id for {file_unique_id} invalidated")
+
+    def _remove(self, file_unique_id):
+        self._entries.pop(file_unique_id, None)
+        if self._db:
+            self._db.execute('DELETE FROM media_cache WHERE file_unique_id = ?', (file_unique_id,))
+
+    def _trim(self):
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
@@ -0,0 +1,271 @@
+import asyncio
+import io
+import logging
+import os
+import tempfile
+from contextlib import AsyncExitStack, asynccontextmanager
+
+from pyrogram.types import InputMediaDocument, InputMediaPhoto, InputMediaVideo
+
+from media_cache import STALE_FILE_ID_ERRORS
+from metrics import stage_seconds
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# Тип медиа -> (метод отправки, поддерживает ли подпись, имя файла по умолчанию)
+MEDIA_KINDS = (
+    ('photo', 'send_photo', True, 'photo.jpg'),
+    ('video', 'send_video', True, 'video.mp4'),
+    ('document', 'send_document', True, 'document'),
+    ('voice', 'send_voice', True, 'voice.ogg'),
+    ('video_note', 'send_video_note', False, 'video_note.mp4'),
+)
+
+# Типы медиа, которые можно отправить в составе альбома
+ALBUM_MEDIA = {
+    'photo': InputMediaPhoto,
+    'video': InputMediaVideo,
+    'document': InputMediaDocument,
+}
+
+
+def get_media(message):
+    """
+    Определяет медиа сообщения, которое умеет пересылать релей.
+
+    Args:
+        message: Объект сообщения Pyrogram
+
+    Returns:
+        tuple | None: (тип, объект медиа, метод отправки, подпись, имя файла) или None
+    """
+    for kind, method, with_caption, default_name in MEDIA_KINDS:
+        media = getattr(message, kind, None)
+        if media:
+            return kind, media, method, with_caption, getattr(media, 'file_name', None) or default_name
+    return None
+
+
+class ByteBudget:
+    """Общий лимит байтов для одновременных передач."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.used = 0
+        self._condition = asyncio.Condition()
+
+    def fits(self, size):
+        return size <= self.capacity
+
+    async def acquire(self, size):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.used + size <= self.capacity)
+            self.used += size
+
+    async def release(self, size):
+        async with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+
+class MediaRelay:
+    """
+    Пересылает копию сообщения без промежуточного сохранения в рабочий каталог.
+
+    Небольшие файлы скачиваются частями прямо в буфер в памяти и сразу
+    отправляются. Суммарный объем буферов всех одновременных передач
+    ограничен ``memory_cap``. Файлы крупнее ``memory_threshold`` (или если
+    они не помещаются в лимит) пишутся во временный файл, который удаляется
+    сразу после отправки, в том числе при ошибке.
+
+    Если передан cache (MediaCache), уже загруженные файлы отправляются по
+    file_id без повторной передачи.
+
+    Если передан chunked (ChunkedDownloader), файлы от ``chunked_threshold``
+    скачиваются частями параллельно с докачкой после обрыва, а их отправка
+    укладывается в общий лимит скорости крупных передач.
+    """
+
+    def __init__(self, client, memory_threshold=20 * MB, memory_cap=200 * MB, spill_cap=2048 * MB, spill_dir=None,
+                 cache=None, chunked=None, chunked_threshold=50 * MB):
+        self.client = client
+        self.cache = cache
+        self.chunked = chunked
+        self.chunked_threshold = chunked_threshold
+        self.memory_threshold = memory_threshold
+        self.memory_budget = ByteBudget(memory_cap)
+        self.spill_budget = ByteBudget(spill_cap)
+        self.spill_dir = spill_dir or None
+        self.in_flight = 0
+
+    async def copy_to(self, chat_id, message):
+        """
+        Отправляет в chat_id копию текста или медиа сообщения.
+
+        Args:
+            chat_id: Получатель копии
+            message: Исходное сообщение Pyrogram
+
+        Returns:
+            Message | None: Отправленное сообщение или None для неподдерживаемых типов
+        """
+        if message.text:
+            return await self.client.send_message(chat_id, message.text)
+
+        media_info = get_media(message)
+        if media_info is None:
+            logger.warning(f"Unsupported message type for manual forwarding: {message.id} ({message.media})")
+            return None
+
+        kind, media, method, with_caption, file_name = media_info
+        kwargs = {'caption': message.caption or ''} if with_caption else {}
+        if kind in ('video', 'document'):
+            kwargs['file_name'] = file_name
+
+        send = getattr(self.client, method)
+        cached_file_id = self._cached_file_id(media)
+        if cached_file_id:
+            try:
+                with stage_seconds.time(stage='send_cached'):
+                    return await send(chat_id, cached_file_id, **kwargs)
+            except STALE_FILE_ID_ERRORS:
+                self.cache.invalidate(media.file_unique_id)
+
+        size = getattr(media, 'file_size', 0) or 0
+        in_memory = size <= self.memory_threshold and self.memory_budget.fits(size)
+        if self._is_chunked(size, in_memory):
+            progress = self.chunked.upload_progress()
+            if progress is not None:
+                kwargs['progress'] = progress
+        async with self._reserve(size, in_memory):
+            async with self._fetch(media, file_name, in_memory) as file:
+                with stage_seconds.time(stage='upload'):
+                    sent_msg = await send(chat_id, file, **kwargs)
+        self._remember(media, sent_msg)
+        return sent_msg
+
+    async def copy_album_to(self, chat_id, messages):
+        """
+        Отправляет в chat_id копию альбома одним send_media_group.
+
+        Args:
+            chat_id: Получатель копии
+            messages: Сообщения альбома в исходном порядке
+
+        Returns:
+            list[Message]: Отправленные сообщения альбома
+        """
+        items = []
+        for message in messages:
+            media_info = get_media(message)
+            if media_info is None or media_info[0] not in ALBUM_MEDIA:
+                logger.warning(f"Unsupported album item for manual forwarding: {message.id} ({message.media})")
+                continue
+            items.append((message, media_info))
+        if not items:
+            return []
+
+        cached = self._cached_album_ids(items)
+        try:
+            return await self._send_album(chat_id, items, cached)
+        except STALE_FILE_ID_ERRORS:
+            # Ошибка не связана с кешем, если альбом отправлялся без сохраненных file_id
+            if not cached:
+                raise
+            # Неизвестно, какой из file_id устарел, поэтому сбрасываем все использованные
+            for message, (_, media, _, _, _) in items:
+                if message.id in cached:
+                    self.cache.invalidate(media.file_unique_id)
+            return await self._send_album(chat_id, items, {})
+
+    def _cached_album_ids(self, items):
+        """Сохраненные file_id элементов альбома: id сообщения -> file_id"""
+        cached = {}
+        for message, (_, media, _, _, _) in items:
+            file_id = self._cached_file_id(media)
+            if file_id:
+                cached[message.id] = file_id
+        return cached
+
+    async def _send_album(self, chat_id, items, cached):
+
+        # Память резервируется сразу под весь альбом, иначе элементы одного
+        # альбома могли бы ждать друг друга
+        size = sum(getattr(media_info[1], 'file_size', 0) or 0
+                   for message, media_info in items if message.id not in cached)
+        in_memory = size <= self.memory_threshold and self.memory_budget.fits(size)
+        async with self._reserve(size, in_memory), AsyncExitStack() as stack:
+            media_group = []
+            for message, (kind, media, _, _, file_name) in items:
+                file = cached.get(message.id)
+                if file is None:
+                    file = await stack.enter_async_context(self._fetch(media, file_name, in_memory))
+                media_group.append(ALBUM_MEDIA[kind](file, caption=message.caption or ''))
+            with stage_seconds.time(stage='upload'):
+                sent_messages = await self.client.send_media_group(chat_id, media_group)
+
+        for (message, (_, media, _, _, _)), sent_msg in zip(items, sent_messages):
+            if message.id not in cached:
+                self._remember(media, sent_msg)
+        return sent_messages
+
+    def _cached_file_id(self, media):
+        if self.cache is None:
+            return None
+        return self.cache.get(media.file_unique_id)
+
+    def _remember(self, media, sent_msg):
+        if self.cache is None or sent_msg is None:
+            return
+        sent_info = get_media(sent_msg)
+        if sent_info:
+            self.cache.put(media.file_unique_id, sent_info[1].file_id)
+
+    @asynccontextmanager
+    async def _reserve(self, size, in_memory):
+        budget = self.memory_budget if in_memory else self.spill_budget
+        reserved = min(size, budget.capacity)
+        await budget.acquire(reserved)
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            await budget.release(reserved)
+
+    def _is_chunked(self, size, in_memory):
+        return self.chunked is not None and not in_memory and size >= self.chunked_threshold
+
+    @asynccontextmanager
+    async def _fetch(self, media, file_name, in_memory):
+        """Скачивает медиа в буфер в памяти или во временный файл, удаляемый при выходе."""
+        size = getattr(media, 'file_size', 0) or 0
+        if self._is_chunked(size, in_memory):
+            async with self.chunked.fetch(media, file_name) as path:
+                yield path
+            return
+
+        if in_memory:
+            buffer = io.BytesIO()
+            with stage_seconds.time(stage='download'):
+                async for chunk in self.client.stream_media(media.file_id):
+                    buffer.write(chunk)
+            buffer.name = file_name
+            buffer.seek(0)
+            yield buffer
+            return
+
+        loop = asyncio.get_event_loop()
+        fd, path = tempfile.mkstemp(prefix='relay_', suffix=os.path.splitext(file_name)[1], dir=self.spill_dir)
+        try:
+            with os.fdopen(fd, 'wb') as spill_file, stage_seconds.time(stage='download'):
+                async for chunk in self.client.stream_media(media.file_id):
+                    await loop.run_in_executor(None, spill_file.write, chunk)
+            yield path
+        finally:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.error(f"Error removing spill file {path}: {e}")
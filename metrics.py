@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import math
+import time
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержки, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    )
+    return '{' + pairs + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик событий."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(_Metric):
+    """
+    Текущее значение величины.
+
+    Если задан callback, значение читается только в момент запроса /metrics,
+    поэтому горячий путь за него ничего не платит.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self._values = {}
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        values = dict(self._values)
+        if self.callback is not None:
+            try:
+                values[()] = self.callback()
+            except Exception as e:
+                logger.error(f"Error reading gauge {self.name}: {e}")
+                return []
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.monotonic() - self.started, **self.labels)
+        return False
+
+
+class Histogram(_Metric):
+    """Распределение длительностей по корзинам с суммой и количеством наблюдений."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            # Счетчики по корзинам, сумма, количество
+            series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, **labels):
+        """
+        Контекстный менеджер, измеряющий длительность блока.
+
+        Пример:
+            with stage_seconds.time(stage='forward'):
+                await app.forward_messages(...)
+        """
+        return _Timer(self, labels)
+
+    def _samples(self):
+        samples = []
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames + ('le',), key + (_format_value(bound),))
+                samples.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            samples.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            samples.append(f"{self.name}_count{labels} {count}")
+        return samples
+
+
+class MetricsRegistry:
+    """Набор метрик процесса, отдаваемый в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                raise ValueError(f"Metric {metric.name} is already registered with a different type or labels")
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        gauge = self._register(Gauge(name, documentation, labelnames))
+        if callback is not None:
+            gauge.callback = callback
+        return gauge
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# Общий реестр процесса: модули регистрируют в нем свои метрики при импорте
+registry = MetricsRegistry()
+
+# Метрики горячих путей обоих ботов
+stage_seconds = registry.histogram(
+    'tgbot_stage_seconds', 'Duration of a processing stage in seconds', ('stage',)
+)
+flood_waits_total = registry.counter(
+    'tgbot_flood_waits_total', 'FloodWait errors received from Telegram', ('component',)
+)
+flood_wait_seconds_total = registry.counter(
+    'tgbot_flood_wait_seconds_total', 'Seconds of waiting requested by FloodWait errors', ('component',)
+)
+retries_total = registry.counter(
+    'tgbot_retries_total', 'Requests retried after FloodWait or a transient error', ('component',)
+)
+manual_fallbacks_total = registry.counter(
+    'tgbot_manual_fallbacks_total', 'Posts recreated manually instead of forwarded', ('reason',)
+)
+
+
+class MetricsServer:
+    """
+    Локальный HTTP-сервер, отдающий метрики по GET /metrics.
+
+    Обрабатывает только простые GET-запросы без тела, чего достаточно для
+    Prometheus и curl.
+    """
+
+    def __init__(self, registry, port, host='127.0.0.1'):
+        self.registry = registry
+        self.port = port
+        self.host = host
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Metrics endpoint listening on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Заголовки запроса не нужны, но их надо дочитать
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if not line or line in (b'\r\n', b'\n'):
+                    break
+
+            parts = request_line.decode('latin-1').split()
+            path = parts[1].split('?', 1)[0] if len(parts) > 1 else ''
+            if len(parts) > 1 and parts[0] == 'GET' and path == '/metrics':
+                status, body = '200 OK', self.registry.render().encode('utf-8')
+            else:
+                status, body = '404 Not Found', b'Not Found\n'
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.error(f"Error serving metrics request: {e}")
+        finally:
+            writer.close()
@@ -0,0 +1,91 @@
+import base64
+import binascii
+import struct
+import zlib
+from collections import namedtuple
+
+from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+# Действия кнопок карточки модерации
+ACTION_APPROVE_ALL = 1
+ACTION_APPROVE = 2
+ACTION_REJECT = 3
+ACTION_QUEUE_ALL = 4
+ACTION_QUEUE = 5
+
+# Действия, относящиеся к одному каналу: их кнопки несут индекс и контрольную сумму канала
+_CHANNEL_ACTIONS = (ACTION_APPROVE, ACTION_QUEUE)
+
+# Разобранная кнопка: действие, id поста и канал (для публикации в один канал)
+CallbackData = namedtuple('CallbackData', ['action', 'message_id', 'channel'])
+
+# Действие, id поста, индекс канала, контрольная сумма имени канала: 9 байт, 12 символов base64
+_PACKED = struct.Struct('>BIHH')
+_ENCODED_LENGTH = 12
+
+
+def _channel_tag(channel):
+    return zlib.crc32(channel.encode('utf-8')) & 0xFFFF
+
+
+class KeyboardTemplate:
+    """
+    Клавиатура карточки модерации, собранная один раз из списка каналов.
+
+    callback_data кнопки — 9 байт в base64 (12 символов) независимо от имени
+    канала: канал передается индексом, а контрольная сумма имени защищает от
+    публикации не в тот канал, если список каналов изменился после отправки
+    карточки.
+    """
+
+    def __init__(self, channels, queue=False):
+        self.channels = [channel.strip() for channel in channels if channel.strip()]
+        self._tags = [_channel_tag(channel) for channel in self.channels]
+        # Рядом с каждой кнопкой публикации — кнопка постановки в очередь, если она включена
+        self._rows = (
+            [[("📢 Выложить во все каналы", ACTION_APPROVE_ALL, 0)]
+             + ([("🕒 В очередь", ACTION_QUEUE_ALL, 0)] if queue else [])]
+            + [[(f"Выложить в {channel}", ACTION_APPROVE, index)]
+               + ([("🕒 В очередь", ACTION_QUEUE, index)] if queue else [])
+               for index, channel in enumerate(self.channels)]
+            + [[("❌ Не выкладывать", ACTION_REJECT, 0)]]
+        )
+
+    def encode(self, action, message_id, channel_index=0):
+        tag = self._tags[channel_index] if action in _CHANNEL_ACTIONS else 0
+        packed = _PACKED.pack(action, int(message_id), channel_index, tag)
+        return base64.urlsafe_b64encode(packed).decode('ascii')
+
+    def markup(self, message_id):
+        """Клавиатура для поста message_id."""
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton(label, callback_data=self.encode(action, message_id, index))
+             for label, action, index in row]
+            for row in self._rows
+        ])
+
+    def decode(self, data):
+        """
+        Разбирает callback_data кнопки.
+
+        Args:
+            data: callback_data нажатой кнопки
+
+        Returns:
+            CallbackData | None: Разобранные данные или None, если кнопка неизвестна или устарела
+        """
+        if len(data) != _ENCODED_LENGTH:
+            return None
+
+        try:
+            action, message_id, channel_index, tag = _PACKED.unpack(base64.urlsafe_b64decode(data))
+        except (binascii.Error, struct.error, ValueError):
+            return None
+
+        if action in _CHANNEL_ACTIONS:
+            if channel_index >= len(self.channels) or self._tags[channel_index] != tag:
+                return None
+            return CallbackData(action, message_id, self.channels[channel_index])
+        if action in (ACTION_APPROVE_ALL, ACTION_QUEUE_ALL, ACTION_REJECT):
+            return CallbackData(action, message_id, None)
+        return None
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import re
+import time
+from collections import namedtuple
+
+from pyrogram import raw, utils
+from pyrogram.errors import (
+    ChannelInvalid, ChannelPrivate, ChatIdInvalid, PeerIdInvalid, UsernameInvalid, UsernameNotOccupied
+)
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, означающие, что сохраненный пир больше не годится и его нужно разрешить заново
+PEER_INVALID_ERRORS = (
+    ChannelInvalid, ChannelPrivate, ChatIdInvalid, PeerIdInvalid, UsernameInvalid, UsernameNotOccupied
+)
+
+# Разрешенный пир: числовой id чата, InputPeer с access hash и время разрешения
+ResolvedPeer = namedtuple('ResolvedPeer', ['chat_id', 'input_peer', 'resolved_at'])
+
+
+class PeerResolutionError(Exception):
+    """Не удалось разрешить часть пиров при запуске."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__(
+            "Unknown peers: " + ', '.join(f"{peer} ({error})" for peer, error in failures.items())
+        )
+
+
+def _peer_chat_id(input_peer, fallback):
+    if isinstance(input_peer, raw.types.InputPeerUser):
+        return input_peer.user_id
+    if isinstance(input_peer, raw.types.InputPeerChat):
+        return -input_peer.chat_id
+    if isinstance(input_peer, raw.types.InputPeerChannel):
+        return utils.get_channel_id(input_peer.channel_id)
+    return fallback
+
+
+class PeerRegistry:
+    """
+    Кеш пиров, разрешенных один раз при запуске.
+
+    Юзернеймы каналов превращаются в числовые id, а InputPeer с access hash
+    остается в хранилище сессии Pyrogram, поэтому отправка не вызывает
+    ResolveUsername. Если Telegram отклоняет пир, запись разрешается заново
+    в фоне, а текущий запрос завершается ошибкой как раньше.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._peers = {}
+        self._refreshing = {}
+
+    def __len__(self):
+        return len(self._peers)
+
+    def get(self, peer):
+        return self._peers.get(peer)
+
+    def chat_id(self, peer):
+        """Числовой id чата для отправки или исходное значение, если пир не разрешен."""
+        resolved = self._peers.get(peer)
+        return resolved.chat_id if resolved else peer
+
+    async def resolve_all(self, peers):
+        """
+        Параллельно разрешает все пиры.
+
+        Args:
+            peers: Юзернеймы и id чатов
+
+        Raises:
+            PeerResolutionError: Если какой-либо пир не удалось разрешить
+        """
+        peers = list(dict.fromkeys(peers))
+        started = time.monotonic()
+        results = await asyncio.gather(*(self._resolve(peer) for peer in peers), return_exceptions=True)
+
+        failures = {peer: result for peer, result in zip(peers, results) if isinstance(result, Exception)}
+        if failures:
+            raise PeerResolutionError(failures)
+        logger.info(f"Resolved {len(peers)} peers in {time.monotonic() - started:.2f}s")
+
+    async def send(self, peer, make_call):
+        """
+        Выполняет запрос к разрешенному пиру.
+
+        Args:
+            peer: Юзернейм или id чата из конфигурации
+            make_call: Функция make_call(chat_id), возвращающая корутину запроса
+
+        Returns:
+            Результат запроса
+        """
+        try:
+            return await make_call(self.chat_id(peer))
+        except PEER_INVALID_ERRORS:
+            self.refresh(peer)
+            raise
+
+    def refresh(self, peer):
+        """Запускает повторное разрешение пира в фоне (не больше одного на пир)."""
+        task = self._refreshing.get(peer)
+        if task is None or task.done():
+            self._refreshing[peer] = asyncio.ensure_future(self._refresh(peer))
+
+    async def _refresh(self, peer):
+        try:
+            await self._resolve(peer, force=True)
+            logger.info(f"Peer {peer} refreshed: {self._peers[peer].chat_id}")
+        except Exception as e:
+            logger.error(f"Error refreshing peer {peer}: {e}")
+
+    async def _resolve(self, peer, force=False):
+        if force:
+            if isinstance(peer, str) and not peer.lstrip('-').isdigit():
+                # Хранилище сессии вернуло бы тот же устаревший пир, поэтому спрашиваем Telegram
+                await self.client.invoke(raw.functions.contacts.ResolveUsername(
+                    username=re.sub(r"[@+\s]", "", peer.lower())
+                ))
+            else:
+                await self.client.get_chat(peer)
+
+        input_peer = await self.client.resolve_peer(peer)
+        resolved = ResolvedPeer(_peer_chat_id(input_peer, peer), input_peer, time.time())
+        self._peers[peer] = resolved
+        return resolved
@@ -0,0 +1,256 @@
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class PendingPost:
+    """
+    Компактная запись о посте, ожидающем модерации.
+
+    Хранит только идентификаторы: чат и id исходного сообщения, тип медиа
+    и id уведомления и пересланной копии у каждого админа. Объект Message
+    запрашивается у Telegram только когда админ нажимает кнопку.
+    """
+
+    __slots__ = ('key', 'chat_id', 'message_id', 'media_type', 'created_at', 'admin_messages')
+
+    def __init__(self, key, chat_id, message_id, media_type, created_at=None, admin_messages=None):
+        self.key = key
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.media_type = media_type
+        self.created_at = created_at or time.time()
+        # admin_id -> {'notification': id, 'forwarded': id}
+        self.admin_messages = admin_messages or {}
+
+
+class _ClaimedKeys:
+    """
+    Ключи постов, забранных pop на публикацию или отклонение.
+
+    Карточка, доставленная админу позже (например, после FloodWait), не
+    должна заново создать запись о посте, который другой админ уже забрал.
+    Хранятся последние limit ключей.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._keys = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def add(self, key):
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        while len(self._keys) > self.limit:
+            self._keys.popitem(last=False)
+
+    def discard(self, key):
+        self._keys.pop(key, None)
+
+
+class MemoryPendingStore:
+    """Хранилище в памяти с вытеснением по LRU и времени жизни записи."""
+
+    def __init__(self, max_posts=5000, ttl=72 * 3600):
+        self.max_posts = max_posts
+        self.ttl = ttl
+        self._posts = OrderedDict()
+        self._claimed = _ClaimedKeys(max_posts)
+
+    def __len__(self):
+        return len(self._posts)
+
+    def add_admin_message(self, key, chat_id, message_id, media_type, admin_id, notification_id, forwarded_id):
+        """
+        Добавляет уведомление админа, создавая запись о посте при необходимости.
+
+        Returns:
+            PendingPost | None: Запись о посте или None, если пост уже забран pop
+        """
+        if key in self._claimed:
+            return None
+        self.evict_expired()
+        post = self._posts.get(key)
+        if post is None:
+            post = self._posts[key] = PendingPost(key, chat_id, message_id, media_type)
+        post.admin_messages[admin_id] = {'notification': notification_id, 'forwarded': forwarded_id}
+        self._posts.move_to_end(key)
+
+        while len(self._posts) > self.max_posts:
+            evicted_key, _ = self._posts.popitem(last=False)
+            logger.warning(f"Pending post {evicted_key} evicted: store is full")
+        return post
+
+    def get(self, key):
+        post = self._posts.get(key)
+        if post is None:
+            return None
+        if self._expired(post):
+            del self._posts[key]
+            return None
+        self._posts.move_to_end(key)
+        return post
+
+    def pop(self, key):
+        post = self._posts.pop(key, None)
+        if post is not None:
+            self._claimed.add(key)
+        return post
+
+    def restore(self, post):
+        """Возвращает на модерацию пост, забранный pop, сохраняя уведомления, добавленные за это время."""
+        self._claimed.discard(post.key)
+        current = self._posts.get(post.key)
+        if current is not None:
+            post.admin_messages.update(current.admin_messages)
+        self._posts[post.key] = post
+        self._posts.move_to_end(post.key)
+
+    def values(self):
+        self.evict_expired()
+        return list(self._posts.values())
+
+    def evict_expired(self):
+        expired = [key for key, post in self._posts.items() if self._expired(post)]
+        for key in expired:
+            del self._posts[key]
+        return len(expired)
+
+    def _expired(self, post):
+        return self.ttl and time.time() - post.created_at > self.ttl
+
+
+class SqlitePendingStore:
+    """
+    Хранилище в SQLite (режим WAL): посты на модерации переживают перезапуск бота.
+
+    Вытеснение то же, что у MemoryPendingStore: по времени жизни и по
+    давности последнего обращения при превышении max_posts.
+    """
+
+    def __init__(self, path='pending_posts.db', max_posts=5000, ttl=72 * 3600):
+        self.max_posts = max_posts
+        self.ttl = ttl
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS pending_posts ('
+            'key TEXT PRIMARY KEY, chat_id INTEGER, message_id INTEGER, media_type TEXT, '
+            'created_at REAL, accessed_at REAL, admin_messages TEXT)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS pending_posts_accessed ON pending_posts (accessed_at)')
+        self._claimed = _ClaimedKeys(max_posts)
+        logger.info(f"Pending posts store {path}: {len(self)} posts restored")
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM pending_posts').fetchone()[0]
+
+    @staticmethod
+    def _row_to_post(row):
+        key, chat_id, message_id, media_type, created_at, admin_messages = row
+        admin_messages = {int(admin_id): ids for admin_id, ids in json.loads(admin_messages).items()}
+        return PendingPost(key, chat_id, message_id, media_type, created_at, admin_messages)
+
+    def _select(self, key):
+        row = self._db.execute(
+            'SELECT key, chat_id, message_id, media_type, created_at, admin_messages '
+            'FROM pending_posts WHERE key = ?', (key,)
+        ).fetchone()
+        return self._row_to_post(row) if row else None
+
+    def add_admin_message(self, key, chat_id, message_id, media_type, admin_id, notification_id, forwarded_id):
+        """
+        Добавляет уведомление админа, создавая запись о посте при необходимости.
+
+        Returns:
+            PendingPost | None: Запись о посте или None, если пост уже забран pop
+        """
+        if key in self._claimed:
+            return None
+        self.evict_expired()
+        now = time.time()
+        post = self._select(key) or PendingPost(key, chat_id, message_id, media_type, now)
+        post.admin_messages[admin_id] = {'notification': notification_id, 'forwarded': forwarded_id}
+        self._write(post, now)
+
+        overflow = len(self) - self.max_posts
+        if overflow > 0:
+            self._db.execute(
+                'DELETE FROM pending_posts WHERE key IN '
+                '(SELECT key FROM pending_posts ORDER BY accessed_at LIMIT ?)', (overflow,)
+            )
+            logger.warning(f"{overflow} pending posts evicted: store is full")
+        return post
+
+    def get(self, key):
+        post = self._select(key)
+        if post is None:
+            return None
+        if self.ttl and time.time() - post.created_at > self.ttl:
+            self.pop(key)
+            return None
+        self._db.execute('UPDATE pending_posts SET accessed_at = ? WHERE key = ?', (time.time(), key))
+        return post
+
+    def _write(self, post, accessed_at):
+        self._db.execute(
+            'INSERT OR REPLACE INTO pending_posts VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (post.key, post.chat_id, post.message_id, post.media_type, post.created_at, accessed_at,
+             json.dumps(post.admin_messages))
+        )
+
+    def pop(self, key):
+        post = self._select(key)
+        if post is not None:
+            self._db.execute('DELETE FROM pending_posts WHERE key = ?', (key,))
+            self._claimed.add(key)
+        return post
+
+    def restore(self, post):
+        """Возвращает на модерацию пост, забранный pop, сохраняя уведомления, добавленные за это время."""
+        self._claimed.discard(post.key)
+        current = self._select(post.key)
+        if current is not None:
+            post.admin_messages.update(current.admin_messages)
+        self._write(post, time.time())
+
+    def values(self):
+        self.evict_expired()
+        rows = self._db.execute(
+            'SELECT key, chat_id, message_id, media_type, created_at, admin_messages '
+            'FROM pending_posts ORDER BY created_at'
+        ).fetchall()
+        return [self._row_to_post(row) for row in rows]
+
+    def evict_expired(self):
+        if not self.ttl:
+            return 0
+        cursor = self._db.execute('DELETE FROM pending_posts WHERE created_at < ?', (time.time() - self.ttl,))
+        return cursor.rowcount
+
+
+def create_pending_store(backend, path, max_posts, ttl):
+    """
+    Создает хранилище постов на модерации.
+
+    Args:
+        backend: 'memory' или 'sqlite'
+        path: Путь к базе для backend='sqlite'
+        max_posts: Максимальное число постов на модерации
+        ttl: Время жизни поста в секундах (0 — без ограничения)
+
+    Returns:
+        MemoryPendingStore | SqlitePendingStore
+    """
+    if backend == 'memory':
+        return MemoryPendingStore(max_posts, ttl)
+    if backend == 'sqlite':
+        return SqlitePendingStore(path, max_posts, ttl)
+    raise ValueError(f"Unknown pending store backend: {backend}")
@@ -0,0 +1,269 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Публикация поста в один канал: данные поста, канал, назначенное время и состояние
+QueuedPost = namedtuple('QueuedPost', [
+    'id', 'post_key', 'chat_id', 'message_id', 'media_type', 'admin_messages',
+    'channel', 'publish_at', 'attempts', 'status', 'published_at'
+])
+
+STATUS_QUEUED = 'queued'
+STATUS_PUBLISHED = 'published'
+STATUS_FAILED = 'failed'
+
+_COLUMNS = (
+    'id, post_key, chat_id, message_id, media_type, admin_messages, '
+    'channel, publish_at, attempts, status, published_at'
+)
+
+
+def _row_to_entry(row):
+    admin_messages = {int(admin_id): ids for admin_id, ids in json.loads(row[5]).items()}
+    return QueuedPost(*row[:5], admin_messages, *row[6:])
+
+
+class PublishQueue:
+    """
+    Очередь отложенных публикаций в SQLite: одобренные посты переживают перезапуск бота.
+
+    Каждая публикация в канал получает время не раньше, чем через interval
+    секунд после предыдущей публикации в этот канал, поэтому посты, одобренные
+    пачкой, расходятся по каналам равномерно. Если публикация выходит позже
+    назначенного (после простоя) или в обход очереди, следующие публикации
+    канала сдвигаются, чтобы интервал сохранился.
+    """
+
+    def __init__(self, path='publish_queue.db', interval=600):
+        self.interval = interval
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS publish_queue ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, post_key TEXT, chat_id INTEGER, message_id INTEGER, '
+            'media_type TEXT, admin_messages TEXT, channel TEXT, publish_at REAL, attempts INTEGER, '
+            'status TEXT, published_at REAL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS publish_queue_due ON publish_queue (status, publish_at)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS publish_queue_post ON publish_queue (post_key)')
+        # Время последней назначенной или выполненной публикации в каждый канал
+        self._db.execute('CREATE TABLE IF NOT EXISTS channel_slots (channel TEXT PRIMARY KEY, last_at REAL)')
+        logger.info(f"Publish queue {path}: {len(self)} posts queued")
+
+    def __len__(self):
+        return self._db.execute(
+            'SELECT COUNT(*) FROM publish_queue WHERE status = ?', (STATUS_QUEUED,)
+        ).fetchone()[0]
+
+    def _last_at(self, channel):
+        row = self._db.execute('SELECT last_at FROM channel_slots WHERE channel = ?', (channel,)).fetchone()
+        return row[0] if row else None
+
+    def _set_last_at(self, channel, at):
+        self._db.execute('INSERT OR REPLACE INTO channel_slots VALUES (?, ?)', (channel, at))
+
+    def schedule(self, post_info, channels):
+        """
+        Ставит пост в очередь на публикацию в каналы.
+
+        Args:
+            post_info: Данные поста на модерации (PendingPost)
+            channels: Каналы для публикации
+
+        Returns:
+            list[QueuedPost]: Публикации с назначенным временем
+        """
+        now = time.time()
+        entries = []
+        with self._db:
+            for channel in channels:
+                last_at = self._last_at(channel)
+                publish_at = now if last_at is None else max(now, last_at + self.interval)
+                self._set_last_at(channel, publish_at)
+                cursor = self._db.execute(
+                    'INSERT INTO publish_queue (post_key, chat_id, message_id, media_type, admin_messages, '
+                    'channel, publish_at, attempts, status, published_at) VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, NULL)',
+                    (post_info.key, post_info.chat_id, post_info.message_id, post_info.media_type,
+                     json.dumps(post_info.admin_messages), channel, publish_at, STATUS_QUEUED)
+                )
+                entries.append(QueuedPost(
+                    cursor.lastrowid, post_info.key, post_info.chat_id, post_info.message_id, post_info.media_type,
+                    post_info.admin_messages, channel, publish_at, 0, STATUS_QUEUED, None
+                ))
+        return entries
+
+    def mark_published(self, channel, at=None):
+        """Учитывает публикацию в обход очереди, чтобы следующий пост из очереди не вышел сразу за ней"""
+        self.respace(channel, at or time.time())
+
+    def respace(self, channel, after, exclude=None):
+        """
+        Сдвигает ожидающие публикации канала не раньше чем на interval секунд после after и друг после друга.
+
+        Порядок публикаций сохраняется, записи, которые и так выходят позже,
+        не переносятся.
+
+        Args:
+            channel: Канал
+            after: Время публикации, от которой отсчитывается интервал
+            exclude: id записи, которая публикуется сейчас
+        """
+        rows = self._db.execute(
+            'SELECT id, publish_at FROM publish_queue WHERE status = ? AND channel = ? ORDER BY publish_at, id',
+            (STATUS_QUEUED, channel)
+        ).fetchall()
+        at = after
+        with self._db:
+            for entry_id, publish_at in rows:
+                if entry_id == exclude:
+                    continue
+                at = max(publish_at, at + self.interval)
+                if at != publish_at:
+                    self._db.execute('UPDATE publish_queue SET publish_at = ? WHERE id = ?', (at, entry_id))
+            last_at = self._last_at(channel)
+            if last_at is None or at > last_at:
+                self._set_last_at(channel, at)
+
+    def due(self, now, limit=20):
+        rows = self._db.execute(
+            f'SELECT {_COLUMNS} FROM publish_queue WHERE status = ? AND publish_at <= ? ORDER BY publish_at LIMIT ?',
+            (STATUS_QUEUED, now, limit)
+        ).fetchall()
+        return [_row_to_entry(row) for row in rows]
+
+    def next_at(self):
+        row = self._db.execute(
+            'SELECT MIN(publish_at) FROM publish_queue WHERE status = ?', (STATUS_QUEUED,)
+        ).fetchone()
+        return row[0]
+
+    def retry(self, entry, not_before):
+        """
+        Переносит неудачную публикацию на ближайшее свободное время канала.
+
+        Returns:
+            float: Новое время публикации, не раньше not_before
+        """
+        with self._db:
+            last_at = self._last_at(entry.channel)
+            publish_at = not_before if last_at is None else max(not_before, last_at + self.interval)
+            self._set_last_at(entry.channel, publish_at)
+            self._db.execute(
+                'UPDATE publish_queue SET attempts = attempts + 1, publish_at = ? WHERE id = ?', (publish_at, entry.id)
+            )
+        return publish_at
+
+    def finish(self, entry_id, status):
+        self._db.execute(
+            'UPDATE publish_queue SET status = ?, published_at = ?, attempts = attempts + 1 WHERE id = ?',
+            (status, time.time(), entry_id)
+        )
+
+    def post_entries(self, post_key):
+        """Все публикации поста по каналам"""
+        rows = self._db.execute(
+            f'SELECT {_COLUMNS} FROM publish_queue WHERE post_key = ? ORDER BY id', (post_key,)
+        ).fetchall()
+        return [_row_to_entry(row) for row in rows]
+
+    def forget(self, post_key):
+        """Удаляет записи поста, все публикации которого завершены"""
+        self._db.execute('DELETE FROM publish_queue WHERE post_key = ?', (post_key,))
+
+
+class PublishScheduler:
+    """
+    Фоновый обработчик очереди публикаций.
+
+    Спит до ближайшего назначенного времени, публикует наступившие записи
+    через publish(entry) и сообщает о каждой завершенной записи через
+    on_done(entry). За проход в канал выходит одна публикация: остальные
+    наступившие записи канала (накопившиеся за простой) сдвигаются на
+    свободное время канала. Неудачная публикация повторяется не раньше чем
+    через retry_delay секунд в свободное время канала, после max_attempts
+    попыток запись помечается как неудачная.
+    """
+
+    def __init__(self, queue, publish, on_done, max_attempts=3, retry_delay=60, batch_size=20):
+        self.queue = queue
+        self.publish = publish
+        self.on_done = on_done
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.batch_size = batch_size
+        self._wakeup = None
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    def wake(self):
+        """Пересчитывает время ближайшей публикации после изменения очереди"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                now = time.time()
+                due = self.queue.due(now, self.batch_size)
+                if due:
+                    # Самая ранняя запись канала выходит сейчас, следующие — через интервал после нее
+                    first = {}
+                    for entry in due:
+                        first.setdefault(entry.channel, entry)
+                    for entry in first.values():
+                        self.queue.respace(entry.channel, now, exclude=entry.id)
+                    await asyncio.gather(*(self._publish(entry) for entry in first.values()))
+                    continue
+
+                next_at = self.queue.next_at()
+                timeout = None if next_at is None else max(next_at - now, 0)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in publish scheduler: {e}", exc_info=True)
+                await asyncio.sleep(self.retry_delay)
+
+    async def _publish(self, entry):
+        try:
+            published = await self.publish(entry)
+        except Exception as e:
+            logger.error(f"Error publishing queued post {entry.post_key} to channel {entry.channel}: {e}")
+            published = False
+
+        if published:
+            self.queue.finish(entry.id, STATUS_PUBLISHED)
+        elif entry.attempts + 1 >= self.max_attempts:
+            logger.error(f"Giving up on queued post {entry.post_key} for channel {entry.channel}")
+            self.queue.finish(entry.id, STATUS_FAILED)
+        else:
+            publish_at = self.queue.retry(entry, time.time() + self.retry_delay)
+            logger.warning(
+                f"Retrying queued post {entry.post_key} for channel {entry.channel} in {publish_at - time.time():.0f}s"
+            )
+            return
+
+        try:
+            await self.on_done(entry)
+        except Exception as e:
+            logger.error(f"Error reporting queued post {entry.post_key}: {e}")
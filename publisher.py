@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import random
+from collections import namedtuple
+
+from pyrogram.errors import FloodWait
+
+from flood_control import TRANSIENT_ERRORS, TokenBucket
+from metrics import flood_wait_seconds_total, flood_waits_total, retries_total, stage_seconds
+
+logger = logging.getLogger(__name__)
+
+# Результат публикации в один канал
+ChannelResult = namedtuple('ChannelResult', ['channel', 'post', 'error', 'attempts'])
+
+
+class PublishReport:
+    """Итог публикации одного поста в несколько каналов."""
+
+    def __init__(self, results):
+        self.results = list(results)
+
+    @property
+    def successful_channels(self):
+        return [result.channel for result in self.results if result.post]
+
+    @property
+    def failed_channels(self):
+        return [result.channel for result in self.results if not result.post]
+
+    @property
+    def errors(self):
+        return {result.channel: result.error for result in self.results if result.error}
+
+
+class ChannelPublisher:
+    """
+    Публикует пост во все каналы параллельно.
+
+    Для каждого канала действует свой token bucket, поэтому медленный или
+    ограниченный FloodWait канал не задерживает остальные. Временные ошибки
+    и FloodWait повторяются с паузой и случайным разбросом (jitter).
+    """
+
+    def __init__(self, rate_per_minute=20, burst=3, max_retries=3, base_delay=1.0, max_flood_wait=120):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_flood_wait = max_flood_wait
+        self._buckets = {}
+
+    def bucket(self, channel):
+        if channel not in self._buckets:
+            self._buckets[channel] = TokenBucket(self.rate, self.burst)
+        return self._buckets[channel]
+
+    async def publish(self, channels, copy):
+        """
+        Копирует пост во все каналы.
+
+        Args:
+            channels: Список целевых каналов
+            copy: Корутина-функция copy(channel), выполняющая публикацию
+
+        Returns:
+            PublishReport: Результаты по каждому каналу
+        """
+        results = await asyncio.gather(*(self._publish_one(channel, copy) for channel in channels))
+        return PublishReport(results)
+
+    async def publish_many(self, posts, channels, prepare, concurrency=4):
+        """
+        Публикует несколько постов конвейером.
+
+        Одновременно готовится и публикуется не больше concurrency постов:
+        пока одни ждут token bucket каналов, следующие уже готовятся к
+        отправке. Частоту публикаций в каждый канал по-прежнему ограничивает
+        его token bucket.
+
+        Args:
+            posts: Посты для публикации
+            channels: Список целевых каналов
+            prepare: Корутина-функция prepare(post), возвращающая copy(channel) или None, если пост недоступен
+            concurrency: Максимальное число постов в работе
+
+        Returns:
+            list[PublishReport | None]: Результаты в порядке posts, None — пост недоступен
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(post):
+            async with semaphore:
+                try:
+                    copy = await prepare(post)
+                except Exception as e:
+                    logger.error(f"Error preparing post for publishing: {e}")
+                    return PublishReport(ChannelResult(channel, None, e, 0) for channel in channels)
+                if copy is None:
+                    return None
+                return await self.publish(channels, copy)
+
+        return await asyncio.gather(*(run(post) for post in posts))
+
+    async def _publish_one(self, channel, copy):
+        attempt = 0
+        while True:
+            attempt += 1
+            await self.bucket(channel).acquire()
+            try:
+                with stage_seconds.time(stage='channel_copy'):
+                    post = await copy(channel)
+                if not post:
+                    logger.error(f"Failed to publish to channel {channel}")
+                return ChannelResult(channel, post, None, attempt)
+            except FloodWait as e:
+                flood_waits_total.inc(component='publisher')
+                flood_wait_seconds_total.inc(e.value, component='publisher')
+                if attempt > self.max_retries or e.value > self.max_flood_wait:
+                    logger.error(f"Error publishing to channel {channel}: {e}")
+                    return ChannelResult(channel, None, e, attempt)
+                delay = e.value + random.uniform(0, self.base_delay)
+                logger.warning(f"FloodWait publishing to channel {channel}, retrying in {delay:.1f}s")
+            except TRANSIENT_ERRORS as e:
+                if attempt > self.max_retries:
+                    logger.error(f"Error publishing to channel {channel}: {e}")
+                    return ChannelResult(channel, None, e, attempt)
+                delay = random.uniform(0, self.base_delay * 2 ** attempt)
+                logger.warning(f"Transient error publishing to channel {channel}, retrying in {delay:.1f}s: {e}")
+            except Exception as e:
+                logger.error(f"Error publishing to channel {channel}: {e}")
+                return ChannelResult(channel, None, e, attempt)
+            retries_total.inc(component='publisher')
+            await asyncio.sleep(delay)
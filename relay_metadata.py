@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from collections import namedtuple
+
+from media_relay import get_media
+
+logger = logging.getLogger(__name__)
+
+# Сведения о посте, переданном админ-боту: источник, исходные id, тип медиа,
+# отпечаток для подавления повторов, время публикации в канале и получения User Bot
+RelayMetadata = namedtuple('RelayMetadata', [
+    'source_chat_id', 'source_info', 'message_ids', 'media_type', 'dedup_hash', 'posted_at', 'received_at'
+])
+
+# Как часто удалять устаревшие записи, секунды
+_CLEANUP_INTERVAL = 60
+
+
+def forward_key(chat_id, message_id):
+    """Ключ пересланного сообщения: по нему админ-бот находит запись через forward_from_chat"""
+    return f"fwd:{chat_id}:{message_id}"
+
+
+def content_key(message):
+    """Ключ воссозданной копии: file_unique_id медиа или хеш текста, одинаковые у обоих ботов"""
+    media_info = get_media(message)
+    if media_info and getattr(media_info[1], 'file_unique_id', None):
+        return f"file:{media_info[1].file_unique_id}"
+    text = message.text or message.caption
+    if text:
+        return 'text:' + hashlib.sha1(str(text).encode('utf-8')).hexdigest()
+    return None
+
+
+def relay_key(message):
+    """
+    Ключ, по которому админ-бот ищет метаданные входящего сообщения.
+
+    Args:
+        message: Сообщение, полученное от User Bot
+
+    Returns:
+        str | None: Ключ или None, если сообщение нечем сопоставить
+    """
+    if message.forward_from_chat and message.forward_from_message_id:
+        return forward_key(message.forward_from_chat.id, message.forward_from_message_id)
+    return content_key(message)
+
+
+class RelayMetadataStore:
+    """
+    Общая для User Bot и Admin Bot база метаданных пересланных постов.
+
+    User Bot записывает метаданные до пересылки под ключами forward_key, а
+    для постов, воссозданных вручную, добавляет ключи content_key отправленных
+    копий. Admin Bot находит запись по relay_key входящего сообщения, так что
+    источник не требует отдельного сообщения в Telegram. Записи старше ttl
+    удаляются.
+    """
+
+    def __init__(self, db_path, ttl=24 * 3600):
+        self.ttl = ttl
+        self._db = sqlite3.connect(db_path, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS relay_metadata ('
+            'key TEXT PRIMARY KEY, source_chat_id INTEGER, source_info TEXT, message_ids TEXT, '
+            'media_type TEXT, dedup_hash TEXT, posted_at REAL, received_at REAL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS relay_metadata_received ON relay_metadata (received_at)')
+        self._cleaned_at = 0.0
+
+    def publish(self, keys, metadata):
+        """
+        Записывает метаданные поста под ключами keys.
+
+        Args:
+            keys: Ключи сообщений поста
+            metadata: RelayMetadata
+        """
+        row = (
+            metadata.source_chat_id, metadata.source_info, json.dumps(metadata.message_ids), metadata.media_type,
+            metadata.dedup_hash, metadata.posted_at, metadata.received_at
+        )
+        with self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO relay_metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(key,) + row for key in keys if key]
+            )
+        self._cleanup()
+
+    def alias(self, key, new_keys):
+        """Делает запись key доступной также под ключами new_keys"""
+        metadata = self.get(key)
+        if metadata is not None:
+            self.publish(new_keys, metadata)
+        return metadata
+
+    def get(self, key):
+        row = self._db.execute(
+            'SELECT source_chat_id, source_info, message_ids, media_type, dedup_hash, posted_at, received_at '
+            'FROM relay_metadata WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return RelayMetadata(row[0], row[1], json.loads(row[2]), *row[3:])
+
+    async def lookup(self, key, timeout=0.0, interval=0.05):
+        """
+        Ищет метаданные, дожидаясь записи до timeout секунд.
+
+        Копия, воссозданная вручную, может прийти админ-боту раньше, чем
+        User Bot запишет ее ключ.
+
+        Returns:
+            RelayMetadata | None: Метаданные или None, если запись не появилась
+        """
+        if not key:
+            return None
+        deadline = time.monotonic() + timeout
+        while True:
+            metadata = self.get(key)
+            if metadata is not None or time.monotonic() >= deadline:
+                return metadata
+            await asyncio.sleep(interval)
+
+    def _cleanup(self):
+        now = time.time()
+        if now - self._cleaned_at < _CLEANUP_INTERVAL:
+            return
+        self._cleaned_at = now
+        try:
+            self._db.execute('DELETE FROM relay_metadata WHERE received_at < ?', (now - self.ttl,))
+        except sqlite3.Error as e:
+            logger.error(f"Error removing expired relay metadata: {e}")
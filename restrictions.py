@@ -0,0 +1,217 @@
+import json
+import logging
+import os
+import re
+from collections import Counter, namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Правила по умолчанию (используются, если файл конфигурации не найден)
+DEFAULT_RULES = {
+    'keywords': [
+        'не копировать',
+        'copyright',
+        'all rights reserved',
+        '©',
+        'watermark',
+        'водяной знак',
+        'запрещено копирование',
+        'копирование запрещено',
+        'do not copy',
+        'no repost',
+        'не репостить',
+        'без репоста'
+    ],
+    # Проверяются только в подписях к фото и видео
+    'media_keywords': [
+        'watermark',
+        'водяной знак'
+    ],
+    'hashtags': [
+        '#nocopy',
+        '#неrepost',
+        '#запретпоста'
+    ]
+}
+
+# Результат проверки: какое правило сработало и на каком термине
+RestrictionMatch = namedtuple('RestrictionMatch', ['rule', 'term', 'chat_id'])
+
+
+def _trie_pattern(terms):
+    """
+    Собирает регулярное выражение из префиксного дерева терминов.
+
+    Общие префиксы выносятся за скобки, поэтому движок re проверяет каждую
+    позицию текста один раз, а не по разу на каждое ключевое слово.
+    """
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[''] = None
+
+    def build(node):
+        if list(node) == ['']:
+            return None
+        optional = '' in node
+        branches = []
+        for char in sorted(key for key in node if key):
+            rest = build(node[char])
+            branches.append(re.escape(char) + (rest or ''))
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        result = '(?:' + '|'.join(branches) + ')'
+        return result + '?' if optional else result
+
+    return build(trie) or ''
+
+
+def _anchors(terms, length=5):
+    """
+    Подбирает небольшой набор подстрок, хотя бы одна из которых входит в каждый термин.
+
+    Жадно берется подстрока длины length, общая для наибольшего числа
+    терминов, и расширяется, пока остается общей для них. Текст без единой
+    такой подстроки не содержит ни одного термина, а проверка нескольких
+    подстрок через ``in`` быстрее поиска по регулярному выражению.
+    """
+    uncovered = set(terms)
+    anchors = []
+    while uncovered:
+        counts = Counter(
+            gram for term in uncovered
+            for gram in {term[start:start + length] for start in range(max(1, len(term) - length + 1))}
+        )
+        anchor = max(counts, key=lambda gram: (counts[gram], gram))
+        covered = [term for term in uncovered if anchor in term]
+
+        grown = True
+        while grown:
+            grown = False
+            start = covered[0].find(anchor)
+            for candidate in (covered[0][start - 1:start + len(anchor)] if start > 0 else None,
+                              covered[0][start:start + len(anchor) + 1]):
+                if candidate and len(candidate) > len(anchor) and all(candidate in term for term in covered):
+                    anchor, grown = candidate, True
+                    break
+
+        anchors.append(anchor)
+        uncovered.difference_update(covered)
+    return tuple(anchors)
+
+
+class _CompiledRuleSet:
+    """
+    Набор правил, скомпилированный в два регулярных выражения.
+
+    Перед поиском по регулярному выражению текст проверяется по короткому
+    набору подстрок (_anchors): большинство сообщений не содержит ни одной,
+    и регулярное выражение для них не запускается.
+    """
+
+    def __init__(self, keywords, media_keywords, hashtags):
+        self.rules = {}
+        for rule, terms in (('hashtag', hashtags), ('media_keyword', media_keywords), ('keyword', keywords)):
+            for term in terms:
+                term = term.strip().lower()
+                if term:
+                    self.rules[term] = rule
+
+        text_terms = [term for term, rule in self.rules.items() if rule != 'media_keyword']
+        self.text_pattern = re.compile(_trie_pattern(text_terms)) if text_terms else None
+        self.media_pattern = re.compile(_trie_pattern(self.rules)) if self.rules else None
+        self.text_anchors = _anchors(text_terms)
+        self.media_anchors = _anchors(self.rules)
+
+    def match(self, text, is_media):
+        if is_media:
+            pattern, anchors = self.media_pattern, self.media_anchors
+        else:
+            pattern, anchors = self.text_pattern, self.text_anchors
+        if pattern is None:
+            return None
+        for anchor in anchors:
+            if anchor in text:
+                break
+        else:
+            return None
+        found = pattern.search(text)
+        if not found:
+            return None
+        term = found.group(0)
+        return self.rules.get(term, 'keyword'), term
+
+
+class RestrictionEngine:
+    """
+    Проверка ограничений на копирование за один проход по тексту.
+
+    Правила компилируются один раз при запуске. Для отдельных исходных
+    каналов можно задать собственные правила в секции ``channels``
+    файла конфигурации.
+    """
+
+    def __init__(self, rules=None):
+        rules = rules or DEFAULT_RULES
+        self._default_rules = {key: list(rules.get(key, DEFAULT_RULES[key])) for key in DEFAULT_RULES}
+        self._default = self._compile(self._default_rules)
+        self._channels = {}
+
+        for chat_id, overrides in (rules.get('channels') or {}).items():
+            self._channels[int(chat_id)] = self._compile(self._merge(overrides))
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Загружает правила из JSON-файла.
+
+        Args:
+            path: Путь к файлу конфигурации
+
+        Returns:
+            RestrictionEngine: Движок с правилами из файла или правилами по умолчанию
+        """
+        if not path or not os.path.exists(path):
+            logger.info(f"Restrictions config {path!r} not found, using default rules")
+            return cls()
+
+        with open(path, encoding='utf-8') as config_file:
+            rules = json.load(config_file)
+        logger.info(f"Loaded restriction rules from {path} ({len(rules.get('channels') or {})} channel overrides)")
+        return cls(rules)
+
+    def _merge(self, overrides):
+        # По умолчанию правила канала дополняют общие, "inherit": false заменяет их
+        inherit = overrides.get('inherit', True)
+        merged = {}
+        for key in DEFAULT_RULES:
+            base = self._default_rules[key] if inherit else []
+            merged[key] = base + list(overrides.get(key, []))
+        return merged
+
+    @staticmethod
+    def _compile(rules):
+        return _CompiledRuleSet(rules['keywords'], rules['media_keywords'], rules['hashtags'])
+
+    def match(self, message):
+        """
+        Проверяет сообщение по правилам его исходного канала.
+
+        Args:
+            message: Объект сообщения Pyrogram
+
+        Returns:
+            RestrictionMatch | None: Сработавшее правило или None
+        """
+        text = message.text or message.caption or ''
+        if not text:
+            return None
+
+        chat_id = message.chat.id if message.chat else None
+        rule_set = self._channels.get(chat_id, self._default)
+        result = rule_set.match(text.lower(), bool(message.photo or message.video))
+        if result is None:
+            return None
+        return RestrictionMatch(result[0], result[1], chat_id)
@@ -0,0 +1,365 @@
+import asyncio
+import hashlib
+import logging
+import os
+import signal
+import sys
+import time
+from bisect import bisect
+
+from dotenv import load_dotenv
+
+from logging_setup import setup_logging_from_env
+
+# Загрузка переменных окружения
+load_dotenv()
+
+# Настройка логирования
+setup_logging_from_env(log_file_env='SUPERVISOR_LOG_FILE')
+logger = logging.getLogger(__name__)
+
+USER_BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'user_bot.py')
+
+# Шард, проработавший меньше этого времени, считается упавшим сразу после запуска
+STABLE_UPTIME = 60
+
+# Сколько ждать штатной остановки шарда перед принудительным завершением
+STOP_TIMEOUT = 30
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Кольцо консистентного хеширования.
+
+    Каждый узел занимает replicas точек на кольце; ключ принадлежит первому
+    узлу по часовой стрелке. При удалении узла его ключи расходятся по
+    остальным узлам, а ключи остальных узлов не перемещаются.
+    """
+
+    def __init__(self, nodes, replicas=100):
+        points = sorted((_hash(f"{node}#{replica}"), node) for node in nodes for replica in range(replicas))
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node(self, key):
+        if not self._points:
+            return None
+        return self._nodes[bisect(self._points, _hash(str(key))) % len(self._points)]
+
+
+def assign_channels(channels, nodes, replicas=100):
+    """
+    Распределяет каналы по узлам.
+
+    Args:
+        channels: id исходных каналов
+        nodes: Доступные узлы (имена сессий)
+        replicas: Точек на кольце у каждого узла
+
+    Returns:
+        dict: Узел -> список его каналов
+    """
+    ring = HashRing(nodes, replicas)
+    assignment = {node: [] for node in nodes}
+    for channel in channels:
+        node = ring.node(channel)
+        if node is not None:
+            assignment[node].append(channel)
+    return assignment
+
+
+def _shard_path(path, name):
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, f"{name}_{filename}")
+
+
+def _metric_totals(text, names):
+    """Суммы значений метрик names по всем меткам из ответа /metrics"""
+    totals = dict.fromkeys(names, 0.0)
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        name = line.split('{', 1)[0].split(' ', 1)[0]
+        if name in totals:
+            totals[name] += float(line.rsplit(' ', 1)[1])
+    return totals
+
+
+async def _scrape(host, port, timeout=5):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(f"GET /metrics HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode('latin-1'))
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    if not head.startswith(b'HTTP/1.1 200'):
+        raise ConnectionError(head.split(b'\r\n', 1)[0].decode('latin-1'))
+    return body.decode('utf-8')
+
+
+class Shard:
+    """Процесс user_bot.py с собственной сессией Telegram и своей частью каналов"""
+
+    def __init__(self, name, port):
+        self.name = name
+        self.port = port
+        self.process = None
+        self.channels = []
+        self.started_at = 0.0
+        self.stopping = False
+        self.restarts = 0
+        self.failures = 0
+        self.retry_at = 0.0
+        self.cooldown_until = 0.0
+        self.flood_checks = 0
+        self.last_sample = None
+        self.messages = 0
+        self.throughput = 0.0
+        self.flood_rate = 0.0
+
+    @property
+    def running(self):
+        return self.process is not None
+
+    def available(self, now):
+        return now >= self.retry_at and now >= self.cooldown_until
+
+    def state(self, now):
+        if self.running:
+            return 'running'
+        if now < self.cooldown_until:
+            return 'flood cooldown'
+        if now < self.retry_at:
+            return 'restarting'
+        return 'idle'
+
+
+class ShardSupervisor:
+    """
+    Запускает по процессу user_bot.py на каждую сессию и делит между ними
+    исходные каналы консистентным хешированием.
+
+    Если шард завершился, его каналы переходят к остальным шардам, а сам он
+    перезапускается с растущей паузой. Если шард несколько проверок подряд
+    тратит на FloodWait больше flood_threshold секунд в минуту, он
+    останавливается на flood_cooldown, а его каналы также переходят к
+    остальным. Шарды, у которых изменился набор каналов, перезапускаются;
+    общий файл отметок позволяет им догнать пропущенное при переезде.
+    Пропускная способность и FloodWait шардов читаются с их /metrics.
+    """
+
+    def __init__(self, sessions, channels, port_base=9200, metrics_host='127.0.0.1', check_interval=30,
+                 flood_threshold=30, flood_checks=3, flood_cooldown=900, restart_delay=5, max_restart_delay=300,
+                 replicas=100):
+        self.shards = [Shard(name, port_base + index) for index, name in enumerate(sessions)]
+        self.channels = list(channels)
+        self.metrics_host = metrics_host
+        self.check_interval = check_interval
+        self.flood_threshold = flood_threshold
+        self.flood_checks = flood_checks
+        self.flood_cooldown = flood_cooldown
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.replicas = replicas
+        self._wakeup = None
+        self._stopping = False
+        self._tasks = []
+
+    def request_stop(self):
+        """Останавливает супервизор и все шарды (обработчик SIGINT/SIGTERM)"""
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        logger.info(f"Starting {len(self.shards)} user bot shards for {len(self.channels)} source channels")
+        next_check = time.monotonic() + self.check_interval
+        try:
+            while not self._stopping:
+                await self._rebalance()
+                now = time.monotonic()
+                wake_at = min([next_check] + [
+                    max(shard.retry_at, shard.cooldown_until) for shard in self.shards
+                    if not shard.running and max(shard.retry_at, shard.cooldown_until) > now
+                ])
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), max(wake_at - now, 0))
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+                if time.monotonic() >= next_check and not self._stopping:
+                    await self._check()
+                    self._report()
+                    next_check = time.monotonic() + self.check_interval
+        finally:
+            await asyncio.gather(*(self._stop_shard(shard) for shard in self.shards if shard.running))
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._report()
+            logger.info("All shards stopped")
+
+    async def _rebalance(self):
+        now = time.monotonic()
+        available = [shard.name for shard in self.shards if shard.available(now)]
+        assignment = assign_channels(self.channels, available, self.replicas)
+        if self.channels and not available:
+            logger.error("No shards available, source channels are not watched")
+
+        changed = [
+            shard for shard in self.shards
+            if assignment.get(shard.name, []) != shard.channels or (shard.channels and not shard.running)
+        ]
+        if not changed:
+            return
+
+        # Сначала останавливаем шарды, теряющие каналы, чтобы канал не читали два процесса
+        await asyncio.gather(*(self._stop_shard(shard) for shard in changed if shard.running))
+        for shard in changed:
+            shard.channels = assignment.get(shard.name, [])
+            if shard.channels:
+                await self._start_shard(shard)
+        logger.info(
+            "Channel assignment: " + ', '.join(f"{shard.name}={len(shard.channels)}" for shard in self.shards)
+        )
+
+    def _shard_env(self, shard):
+        env = dict(os.environ)
+        env.update({
+            'USER_BOT_SESSION': shard.name,
+            'SOURCE_CHANNEL_IDS': ','.join(str(channel) for channel in shard.channels),
+            'USER_BOT_METRICS_PORT': str(shard.port),
+            'METRICS_HOST': self.metrics_host,
+            # file_id медиа и очередь обработки принадлежат аккаунту шарда
+            'MEDIA_CACHE_PATH': _shard_path(env.get('MEDIA_CACHE_PATH') or 'media_cache.db', shard.name),
+            'WORK_QUEUE_SPILL_PATH': _shard_path(env.get('WORK_QUEUE_SPILL_PATH') or 'work_queue.db', shard.name),
+            # Индекс повторов общий, как отметки догонки: повтор из канала другого шарда тоже подавляется
+            'DEDUP_DB_PATH': env.get('DEDUP_DB_PATH') or 'dedup.db',
+        })
+        if env.get('USER_BOT_LOG_FILE'):
+            env['USER_BOT_LOG_FILE'] = _shard_path(env['USER_BOT_LOG_FILE'], shard.name)
+        return env
+
+    async def _start_shard(self, shard):
+        process = await asyncio.create_subprocess_exec(sys.executable, USER_BOT_SCRIPT, env=self._shard_env(shard))
+        shard.process = process
+        shard.started_at = time.monotonic()
+        shard.stopping = False
+        shard.last_sample = None
+        shard.throughput = shard.flood_rate = 0.0
+        shard.flood_checks = 0
+        self._tasks = [task for task in self._tasks if not task.done()]
+        self._tasks.append(asyncio.ensure_future(self._watch(shard, process)))
+        logger.info(f"Shard {shard.name} started (pid {process.pid}) with {len(shard.channels)} channels")
+
+    async def _stop_shard(self, shard):
+        process = shard.process
+        if process is None:
+            return
+        shard.stopping = True
+        if process.returncode is None:
+            process.terminate()
+            try:
+                await asyncio.wait_for(process.wait(), STOP_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"Shard {shard.name} did not stop in {STOP_TIMEOUT}s, killing it")
+                process.kill()
+                await process.wait()
+        shard.process = None
+        shard.throughput = shard.flood_rate = 0.0
+        logger.info(f"Shard {shard.name} stopped")
+
+    async def _watch(self, shard, process):
+        code = await process.wait()
+        if shard.process is not process or shard.stopping:
+            return
+
+        now = time.monotonic()
+        uptime = now - shard.started_at
+        shard.process = None
+        shard.throughput = shard.flood_rate = 0.0
+        shard.failures = shard.failures + 1 if uptime < STABLE_UPTIME else 1
+        shard.restarts += 1
+        delay = min(self.restart_delay * 2 ** (shard.failures - 1), self.max_restart_delay)
+        shard.retry_at = now + delay
+        logger.error(
+            f"Shard {shard.name} exited with code {code} after {uptime:.0f}s, "
+            f"reassigning its {len(shard.channels)} channels, restart in {delay:.0f}s"
+        )
+        self._wakeup.set()
+
+    async def _check(self):
+        await asyncio.gather(*(self._sample(shard) for shard in self.shards if shard.running))
+
+    async def _sample(self, shard):
+        try:
+            text = await _scrape(self.metrics_host, shard.port)
+        except Exception as e:
+            # Только что запущенный шард может еще не открыть эндпоинт
+            if shard.last_sample is not None:
+                logger.warning(f"Shard {shard.name}: metrics unavailable: {e}")
+            return
+
+        now = time.monotonic()
+        totals = _metric_totals(text, ('tgbot_messages_relayed_total', 'tgbot_flood_wait_seconds_total'))
+        messages, flood_wait = totals['tgbot_messages_relayed_total'], totals['tgbot_flood_wait_seconds_total']
+        if shard.last_sample is not None:
+            sampled_at, last_messages, last_flood_wait = shard.last_sample
+            elapsed = max(now - sampled_at, 1e-6)
+            shard.throughput = (messages - last_messages) / elapsed
+            shard.flood_rate = (flood_wait - last_flood_wait) / elapsed * 60
+            shard.flood_checks = shard.flood_checks + 1 if shard.flood_rate >= self.flood_threshold else 0
+        shard.last_sample = (now, messages, flood_wait)
+        shard.messages = int(messages)
+
+        if shard.flood_checks >= self.flood_checks and len(self.shards) > 1:
+            shard.cooldown_until = now + self.flood_cooldown
+            logger.warning(
+                f"Shard {shard.name} spends {shard.flood_rate:.0f}s per minute in FloodWait, "
+                f"reassigning its {len(shard.channels)} channels for {self.flood_cooldown:.0f}s"
+            )
+            self._wakeup.set()
+
+    def _report(self):
+        now = time.monotonic()
+        for shard in self.shards:
+            logger.info(
+                f"Shard {shard.name}: {shard.state(now)}, {len(shard.channels)} channels, "
+                f"{shard.throughput:.2f} msg/s, {shard.messages} messages, "
+                f"FloodWait {shard.flood_rate:.0f}s/min, {shard.restarts} restarts"
+            )
+        logger.info(f"Total throughput: {sum(shard.throughput for shard in self.shards if shard.running):.2f} msg/s")
+
+
+def main():
+    sessions = [name.strip() for name in (os.getenv('SHARD_SESSIONS') or 'user_bot').split(',') if name.strip()]
+    channels = [int(id.strip()) for id in os.getenv('SOURCE_CHANNEL_IDS', '').split(',') if id.strip()]
+    supervisor = ShardSupervisor(
+        sessions,
+        channels,
+        port_base=int(os.getenv('SHARD_METRICS_PORT_BASE') or 9200),
+        metrics_host=os.getenv('METRICS_HOST') or '127.0.0.1',
+        check_interval=float(os.getenv('SHARD_CHECK_INTERVAL') or 30),
+        flood_threshold=float(os.getenv('SHARD_FLOOD_THRESHOLD') or 30),
+        flood_checks=int(os.getenv('SHARD_FLOOD_CHECKS') or 3),
+        flood_cooldown=float(os.getenv('SHARD_FLOOD_COOLDOWN') or 900),
+        restart_delay=float(os.getenv('SHARD_RESTART_DELAY') or 5)
+    )
+
+    loop = asyncio.get_event_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, supervisor.request_stop)
+    try:
+        loop.run_until_complete(supervisor.run())
+    except Exception as e:
+        logger.error(f"Error running shard supervisor: {e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+from chunked_transfer import CHUNK_SIZE, ChunkedDownloader
+
+PARTS = 4
+
+
+class FakeClient:
+    """stream_media, отдающий чанк с номером чанка в первом байте; первые gate чанков отдаются сразу"""
+
+    def __init__(self, gate=None):
+        self.requests = []
+        self.gate = gate
+        self.streamed = 0
+        self.release = asyncio.Event()
+
+    async def stream_media(self, file_id, offset=0, limit=0):
+        self.requests.append((offset, limit))
+        for index in range(offset, offset + limit):
+            if self.gate is not None and self.streamed >= self.gate:
+                await self.release.wait()
+            self.streamed += 1
+            await asyncio.sleep(0)
+            yield bytes([index]) * CHUNK_SIZE
+
+
+def make_media():
+    return SimpleNamespace(file_id='file', file_unique_id='unique', file_size=PARTS * CHUNK_SIZE)
+
+
+def test_download_cancelled_by_shutdown_resumes_on_next_run(tmp_path):
+    async def scenario():
+        media = make_media()
+
+        # Первый запуск: готова только первая часть, остальные ждут, когда бота останавливают
+        first = ChunkedDownloader(FakeClient(gate=1), max_parts=1, part_size=CHUNK_SIZE, work_dir=str(tmp_path))
+
+        async def relay():
+            async with first.fetch(media, 'video.mp4'):
+                pass
+
+        task = asyncio.ensure_future(relay())
+        while first.client.streamed < 1 or not os.path.exists(tmp_path / 'relay_unique.mp4.parts'):
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert sorted(os.listdir(tmp_path)) == ['relay_unique.mp4', 'relay_unique.mp4.parts']
+
+        # Следующий запуск догоняет тот же пост и докачивает только оставшиеся части
+        client = FakeClient()
+        second = ChunkedDownloader(client, max_parts=PARTS, part_size=CHUNK_SIZE, work_dir=str(tmp_path))
+        async with second.fetch(media, 'video.mp4') as path:
+            with open(path, 'rb') as file:
+                content = file.read()
+        assert second.resumed == 1
+        assert sorted(client.requests) == [(index, 1) for index in range(1, PARTS)]
+        assert [content[index * CHUNK_SIZE] for index in range(PARTS)] == list(range(PARTS))
+        assert os.listdir(tmp_path) == []
+
+    asyncio.run(scenario())
+
+
+def test_failed_send_removes_partial_file(tmp_path):
+    async def scenario():
+        downloader = ChunkedDownloader(FakeClient(), part_size=CHUNK_SIZE, work_dir=str(tmp_path))
+        try:
+            async with downloader.fetch(make_media(), 'video.mp4'):
+                raise RuntimeError('send failed')
+        except RuntimeError:
+            pass
+        assert os.listdir(tmp_path) == []
+
+    asyncio.run(scenario())
@@ -1,31 +1,135 @@
-from pyrogram import Client, filters
+from pyrogram import Client, filters, idle
+from pyrogram.errors import FloodWait
 from dotenv import load_dotenv
+import asyncio
 import os
 import logging
-import re
+import time
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
+from backfill import CheckpointStore, HistoryBackfill
+from batching import KeyedBatcher
+from chunked_transfer import ChunkedDownloader
+from dedup import DedupIndex
+from logging_setup import setup_logging_from_env
+from media_cache import MediaCache
+from media_relay import MB, MediaRelay, get_media
+from metrics import (
+    MetricsServer, flood_wait_seconds_total, flood_waits_total, manual_fallbacks_total, registry, stage_seconds
+)
+from peer_registry import PeerRegistry
+from relay_metadata import RelayMetadata, RelayMetadataStore, content_key, forward_key
+from restrictions import RestrictionEngine
+from work_queue import PRIORITY_HIGH, PRIORITY_LOW, WorkQueue
 
 # Загрузка переменных окружения
 load_dotenv()
 
+# Настройка логирования: запись в консоль и файл выполняется в фоновом потоке
+setup_logging_from_env(log_file_env='USER_BOT_LOG_FILE')
+logger = logging.getLogger(__name__)
+
 # Параметры подключения
 api_id = os.getenv('API_ID')
 api_hash = os.getenv('API_HASH')
 phone_number = os.getenv('PHONE_NUMBER')
+session_name = os.getenv('USER_BOT_SESSION') or 'user_bot'
 source_channel_ids = [int(id.strip()) for id in os.getenv('SOURCE_CHANNEL_IDS', '').split(',')]
 admin_bot_id = int(os.getenv('ADMIN_BOT_ID'))
+restrictions_config = os.getenv('RESTRICTIONS_CONFIG') or 'restrictions.json'
+
+relay_memory_threshold = int(os.getenv('RELAY_MEMORY_THRESHOLD_MB') or 20) * MB
+relay_memory_cap = int(os.getenv('RELAY_MEMORY_CAP_MB') or 200) * MB
+relay_spill_cap = int(os.getenv('RELAY_SPILL_CAP_MB') or 2048) * MB
+relay_spill_dir = os.getenv('RELAY_SPILL_DIR') or None
+media_cache_max_entries = int(os.getenv('MEDIA_CACHE_MAX_ENTRIES') or 20000)
+media_cache_ttl_days = float(os.getenv('MEDIA_CACHE_TTL_DAYS') or 30)
+media_cache_path = os.getenv('MEDIA_CACHE_PATH') or 'media_cache.db'
+large_transfer_threshold = float(os.getenv('LARGE_TRANSFER_MB') or 50) * MB
+large_transfer_parts = int(os.getenv('LARGE_TRANSFER_PARTS') or 4)
+transfer_bandwidth = float(os.getenv('TRANSFER_BANDWIDTH_MB') or 0) * MB
+album_delay = float(os.getenv('ALBUM_DELAY') or 1.5)
+burst_window = float(os.getenv('BURST_WINDOW') or 0.5)
+burst_max_size = min(int(os.getenv('BURST_MAX_SIZE') or 100), 100)
+dedup_window_hours = float(os.getenv('DEDUP_WINDOW_HOURS') or 24)
+dedup_max_entries = int(os.getenv('DEDUP_MAX_ENTRIES') or 50000)
+dedup_threshold = float(os.getenv('DEDUP_THRESHOLD') or 0.8)
+dedup_db_path = os.getenv('DEDUP_DB_PATH') or None
+transfer_workers = int(os.getenv('TRANSFER_WORKERS') or 4)
+work_queue_size = int(os.getenv('WORK_QUEUE_SIZE') or 1000)
+work_queue_policy = os.getenv('WORK_QUEUE_POLICY') or 'block'
+work_queue_spill_path = os.getenv('WORK_QUEUE_SPILL_PATH') or 'work_queue.db'
+large_media_threshold = float(os.getenv('LARGE_MEDIA_MB') or 10) * MB
+checkpoint_path = os.getenv('CHECKPOINT_PATH') or 'checkpoints.db'
+backfill_max_messages = int(os.getenv('BACKFILL_MAX_MESSAGES') or 200)
+backfill_concurrency = int(os.getenv('BACKFILL_CONCURRENCY') or 3)
+backfill_rate = float(os.getenv('BACKFILL_RATE') or 1)
+relay_metadata_path = os.getenv('RELAY_METADATA_PATH') or 'relay_metadata.db'
+shutdown_drain_timeout = float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT') or 20)
+metrics_port = int(os.getenv('USER_BOT_METRICS_PORT') or 0)
+metrics_host = os.getenv('METRICS_HOST') or '127.0.0.1'
+
+# Правила ограничений компилируются один раз при запуске
+restriction_engine = RestrictionEngine.from_file(restrictions_config)
+
+# Индекс пересланных постов для подавления повторов (0 часов — отключено)
+dedup_index = DedupIndex(
+    window=dedup_window_hours * 3600,
+    max_entries=dedup_max_entries,
+    threshold=dedup_threshold,
+    db_path=dedup_db_path
+) if dedup_window_hours > 0 else None
+
+# Метаданные пересланных постов для админ-бота (источник, тип, отпечаток, время)
+relay_metadata = RelayMetadataStore(relay_metadata_path)
 
-# Создание клиента
+# Создание клиента: сверх частей крупных файлов остаются соединения для небольших постов
 app = Client(
-    "user_bot", 
+    session_name, 
     api_id=api_id, 
     api_hash=api_hash,
-    phone_number=phone_number
+    phone_number=phone_number,
+    max_concurrent_transmissions=large_transfer_parts + 2
 )
 
+# Исходные каналы и админ-бот разрешаются один раз при запуске
+peer_registry = PeerRegistry(app)
+
+# Пересылка медиа без промежуточных файлов в рабочем каталоге
+media_relay = MediaRelay(
+    app,
+    memory_threshold=relay_memory_threshold,
+    memory_cap=relay_memory_cap,
+    spill_cap=relay_spill_cap,
+    spill_dir=relay_spill_dir,
+    cache=MediaCache(
+        max_entries=media_cache_max_entries,
+        ttl=media_cache_ttl_days * 24 * 3600,
+        db_path=media_cache_path
+    ) if media_cache_max_entries > 0 else None,
+    chunked=ChunkedDownloader(
+        app,
+        max_parts=large_transfer_parts,
+        bandwidth=transfer_bandwidth,
+        work_dir=relay_spill_dir,
+        prefix=f'relay_{session_name}_'
+    ) if large_transfer_parts > 0 else None,
+    chunked_threshold=large_transfer_threshold
+)
+
+# Число передач медиа, выполняющихся прямо сейчас
+registry.gauge('tgbot_transfers_in_flight', 'Media transfers in progress', callback=lambda: media_relay.in_flight)
+
+# Доставленные админ-боту сообщения: по ним супервизор шардов считает пропускную способность
+messages_relayed_total = registry.counter(
+    'tgbot_messages_relayed_total', 'Messages delivered to the admin bot', ('route',)
+)
+
+def record_flood_wait(error, component):
+    """Учитывает FloodWait в метриках: по ним супервизор замечает перегруженный аккаунт"""
+    if isinstance(error, FloodWait):
+        flood_waits_total.inc(component=component)
+        flood_wait_seconds_total.inc(error.value, component=component)
+
 def check_copy_restrictions(message):
     """
     Проверяет наличие ограничений на копирование в сообщении.
@@ -34,54 +138,337 @@ def check_copy_restrictions(message):
         message: Объект сообщения Pyrogram
     
     Returns:
-        bool: True, если копирование запрещено, False в противном случае
-    """
-    # Расширенный список ключевых слов, указывающих на запрет копирования
-    copy_restriction_keywords = [
-        'не копировать', 
-        'copyright', 
-        'all rights reserved', 
-        '©', 
-        'watermark', 
-        'водяной знак',
-        'запрещено копирование',
-        'копирование запрещено',
-        'do not copy',
-        'no repost',
-        'не репостить',
-        'без репоста'
-    ]
-    
-    # Проверка текста сообщения
-    text_to_check = message.text or message.caption or ''
-    text_lower = text_to_check.lower()
-    
-    # Проверяем каждое ключевое слово
-    for keyword in copy_restriction_keywords:
-        if keyword in text_lower:
-            logger.warning(f"Копирование запрещено по ключевому слову: {keyword}")
-            return True
-    
-    # Дополнительные проверки
+        RestrictionMatch | None: Сработавшее правило, если копирование запрещено, иначе None
+    """
     try:
-        # Проверка наличия водяных знаков в медиафайлах
-        if message.photo or message.video:
-            if message.caption and any(mark in message.caption.lower() for mark in ['watermark', 'водяной знак']):
-                logger.warning("Обнаружен водяной знак в медиафайле")
-                return True
-        
-        # Проверка прав на репост через теги
-        if message.entities:
-            for entity in message.entities:
-                if entity.type in ['hashtag', 'cashtag']:
-                    hashtag = text_lower[entity.offset:entity.offset+entity.length].lower()
-                    if any(tag in hashtag for tag in ['#nocopy', '#неrepost', '#запретпоста']):
-                        logger.warning(f"Обнаружен запрещающий хэштег: {hashtag}")
-                        return True
+        restriction = restriction_engine.match(message)
     except Exception as e:
         logger.error(f"Ошибка при проверке ограничений: {e}")
-    
-    return False
+        return None
+
+    if restriction:
+        logger.warning(f"Копирование запрещено правилом {restriction.rule}: {restriction.term}")
+    return restriction
+
+def mark_processed(messages):
+    """Отмечает сообщения поста обработанными: отметка догонки может сдвинуться за них"""
+    if checkpoints is not None:
+        for message in messages:
+            checkpoints.done(message.chat.id, message.id)
+
+async def relay_manually(message):
+    """
+    Воссоздает сообщение у админ-бота, когда переслать его нельзя.
+
+    Args:
+        message: Объект сообщения Pyrogram
+
+    Returns:
+        Message | None: Отправленная копия или None, если тип не поддерживается
+    """
+    with stage_seconds.time(stage='manual_relay'):
+        sent_msg = await media_relay.copy_to(admin_bot_id, message)
+    if sent_msg:
+        messages_relayed_total.inc(route='manual')
+        alias_metadata([message], [sent_msg])
+        media_info = get_media(message)
+        kind = media_info[0] if media_info else 'text'
+        logger.info(f"Manually forwarded {kind} message {message.id} to admin bot")
+        if media_relay.cache is not None and kind != 'text':
+            logger.info(f"Media cache: {media_relay.cache.stats}")
+    return sent_msg
+
+async def fingerprint_post(messages):
+    """Отпечатки сообщений поста для подавления повторов и метаданных"""
+    if dedup_index is None:
+        return [None] * len(messages)
+    with stage_seconds.time(stage='dedup'):
+        return [await dedup_index.fingerprint(message) for message in messages]
+
+async def is_duplicate(messages, fingerprints):
+    """
+    Проверяет, пересылался ли уже этот пост из какого-либо исходного канала.
+
+    Args:
+        messages: Сообщения поста (несколько — для альбома)
+        fingerprints: Отпечатки сообщений из fingerprint_post
+
+    Returns:
+        bool: True, если повторяются все сообщения поста
+    """
+    if dedup_index is None:
+        return False
+
+    with stage_seconds.time(stage='dedup'):
+        matches = [
+            await dedup_index.check(message, fingerprint) for message, fingerprint in zip(messages, fingerprints)
+        ]
+    if not all(matches):
+        return False
+
+    logger.info(
+        f"Suppressed duplicate message {messages[0].id} from chat {messages[0].chat.id} "
+        f"({matches[0].kind}), suppressed total: {dedup_index.suppressed}"
+    )
+    return True
+
+def get_source_info(chat):
+    """Описание исходного канала для админов"""
+    source_channel_info = f"Channel ID: {chat.id}"
+    if chat.username:
+        source_channel_info += f" (@{chat.username})"
+    if chat.title:
+        source_channel_info += f" - {chat.title}"
+    return source_channel_info
+
+def publish_metadata(messages, fingerprints):
+    """
+    Записывает метаданные поста для админ-бота до пересылки.
+
+    Админ-бот находит их по forward_from_chat и forward_from_message_id
+    пересланного сообщения, поэтому источник не отправляется отдельным сообщением.
+
+    Args:
+        messages: Сообщения поста
+        fingerprints: Отпечатки сообщений из fingerprint_post
+    """
+    message = messages[0]
+    media_info = get_media(message)
+    if message.media_group_id:
+        media_type = 'media_group'
+    else:
+        media_type = media_info[0] if media_info else 'text'
+    try:
+        relay_metadata.publish(
+            [forward_key(message.chat.id, item.id) for item in messages],
+            RelayMetadata(
+                source_chat_id=message.chat.id,
+                source_info=get_source_info(message.chat),
+                message_ids=[item.id for item in messages],
+                media_type=media_type,
+                dedup_hash=next((fingerprint for fingerprint in fingerprints if fingerprint), None),
+                posted_at=message.date.timestamp() if message.date else None,
+                received_at=time.time()
+            )
+        )
+    except Exception as e:
+        logger.error(f"Error publishing metadata of message {message.id}: {e}")
+
+def alias_metadata(messages, sent_messages):
+    """Делает метаданные поста доступными по ключам копий, воссозданных вручную"""
+    message = messages[0]
+    try:
+        relay_metadata.alias(
+            forward_key(message.chat.id, message.id), [content_key(sent) for sent in sent_messages]
+        )
+    except Exception as e:
+        logger.error(f"Error publishing metadata of relayed message {message.id}: {e}")
+
+async def forward_album(media_group_id, messages):
+    """
+    Пересылает альбом админ-боту одним запросом.
+
+    Args:
+        media_group_id: Идентификатор альбома
+        messages: Собранные сообщения альбома
+    """
+    try:
+        await _forward_album(media_group_id, messages)
+    except asyncio.CancelledError:
+        # Остановка бота: альбом не отмечается обработанным и будет догнан после запуска
+        raise
+    except Exception as e:
+        logger.error(f"Error forwarding album {media_group_id}: {e}", exc_info=True)
+    mark_processed(messages)
+
+async def _forward_album(media_group_id, messages):
+    messages.sort(key=lambda message: message.id)
+    fingerprints = await fingerprint_post(messages)
+    if await is_duplicate(messages, fingerprints):
+        return
+    publish_metadata(messages, fingerprints)
+
+    chat = messages[0].chat
+    source_channel_info = get_source_info(chat)
+    message_ids = [message.id for message in messages]
+
+    # Ограничение на любом элементе распространяется на весь альбом
+    if any(check_copy_restrictions(message) for message in messages):
+        logger.warning(f"Copying restricted for album {media_group_id} from {source_channel_info}")
+        manual_fallbacks_total.inc(reason='restricted')
+        try:
+            with stage_seconds.time(stage='manual_relay'):
+                sent_messages = await media_relay.copy_album_to(admin_bot_id, messages)
+            if sent_messages:
+                messages_relayed_total.inc(len(sent_messages), route='manual')
+                alias_metadata(messages, sent_messages)
+                logger.info(f"Manually forwarded album {media_group_id} ({len(sent_messages)} items) to admin bot")
+        except Exception as e:
+            record_flood_wait(e, 'manual_relay')
+            logger.error(f"Error manually forwarding restricted album {media_group_id}: {e}")
+        return
+
+    try:
+        with stage_seconds.time(stage='forward'):
+            await peer_registry.send(admin_bot_id, lambda peer_id: app.forward_messages(
+                chat_id=peer_id,
+                from_chat_id=chat.id,
+                message_ids=message_ids
+            ))
+        messages_relayed_total.inc(len(message_ids), route='forward')
+        logger.info(f"Forwarded album {media_group_id} ({len(message_ids)} items) from {source_channel_info} to admin bot")
+    except Exception as e:
+        record_flood_wait(e, 'forward')
+        logger.warning(f"Error forwarding album {media_group_id}, trying to manually forward: {e}")
+        manual_fallbacks_total.inc(reason='forward_failed')
+        try:
+            with stage_seconds.time(stage='manual_relay'):
+                sent_messages = await media_relay.copy_album_to(admin_bot_id, messages)
+            messages_relayed_total.inc(len(sent_messages), route='manual')
+            alias_metadata(messages, sent_messages)
+            logger.info(f"Manually forwarded album {media_group_id} ({len(sent_messages)} items) to admin bot")
+        except Exception as e:
+            record_flood_wait(e, 'manual_relay')
+            logger.error(f"Error manually forwarding album {media_group_id}: {e}")
+
+async def forward_burst(chat_id, messages):
+    """
+    Пересылает админ-боту все посты канала, накопленные за окно, одним forward_messages.
+
+    Args:
+        chat_id: Исходный канал
+        messages: Сообщения канала в порядке поступления
+    """
+    messages.sort(key=lambda message: message.id)
+    source_channel_info = get_source_info(messages[0].chat)
+    message_ids = [message.id for message in messages]
+
+    try:
+        # Пересылаем сообщения админ-боту
+        with stage_seconds.time(stage='forward'):
+            await peer_registry.send(admin_bot_id, lambda peer_id: app.forward_messages(
+                chat_id=peer_id,
+                from_chat_id=chat_id,
+                message_ids=message_ids
+            ))
+        messages_relayed_total.inc(len(message_ids), route='forward')
+        logger.info(
+            f"Forwarded {len(message_ids)} messages {message_ids} from {source_channel_info} to admin bot "
+            f"(average batch {burst_buffer.average_batch:.1f}, max {burst_buffer.max_batch})"
+        )
+        mark_processed(messages)
+        return
+    except Exception as e:
+        record_flood_wait(e, 'forward')
+        logger.warning(f"Error forwarding messages {message_ids}, trying to manually forward: {e}")
+        manual_fallbacks_total.inc(len(messages), reason='forward_failed')
+
+    # Если пересылка не удалась, воссоздаем сообщения вручную по одному через очередь передач
+    for message in messages:
+        await work_queue.put(post_priority([message]), 'relay', [message])
+
+async def relay_post(messages):
+    """Воссоздает у админ-бота пост, который не удалось переслать"""
+    message = messages[0]
+    try:
+        await relay_manually(message)
+    except asyncio.CancelledError:
+        # Остановка бота: пост не отмечается обработанным и будет догнан после запуска
+        raise
+    except Exception as e:
+        record_flood_wait(e, 'manual_relay')
+        logger.error(f"Error manually forwarding message {message.id}: {e}")
+    mark_processed(messages)
+
+async def process_post(messages):
+    """
+    Обрабатывает пост из очереди: подавляет повторы, проверяет ограничения
+    и пересылает админ-боту.
+
+    Args:
+        messages: Список из одного сообщения поста
+    """
+    message = messages[0]
+    try:
+        # Пост, переданный в буфер всплесков, отмечается обработанным после пересылки
+        if await _process_post(message):
+            return
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Error processing message {message.id} from chat {message.chat.id}: {e}", exc_info=True)
+    mark_processed(messages)
+
+async def _process_post(message):
+    """Возвращает True, если пост передан в буфер всплесков"""
+    # Пропускаем повторы уже пересланных постов
+    fingerprints = await fingerprint_post([message])
+    if await is_duplicate([message], fingerprints):
+        return False
+
+    # Источник и остальные сведения админ-бот прочитает из общей базы метаданных
+    publish_metadata([message], fingerprints)
+
+    # Добавляем информацию об исходном канале
+    source_channel_info = get_source_info(message.chat)
+
+    # Проверяем наличие ограничений на копирование
+    if check_copy_restrictions(message):
+        logger.warning(f"Copying restricted for message {message.id} from {source_channel_info}")
+        manual_fallbacks_total.inc(reason='restricted')
+        # Воссоздаем сообщение вручную
+        try:
+            await relay_manually(message)
+        except Exception as e:
+            record_flood_wait(e, 'manual_relay')
+            logger.error(f"Error manually forwarding restricted message {message.id}: {e}")
+        return False
+
+    # Пересылаем сообщение админ-боту вместе с остальными постами всплеска
+    burst_buffer.add(message.chat.id, message)
+    return True
+
+async def process_album(messages):
+    """Обрабатывает собранный альбом из очереди"""
+    await forward_album(messages[0].media_group_id, messages)
+
+def post_priority(messages):
+    """Текст и небольшие медиа обрабатываются раньше крупных видео и документов"""
+    size = 0
+    for message in messages:
+        media_info = get_media(message)
+        if media_info:
+            size += getattr(media_info[1], 'file_size', 0) or 0
+    return PRIORITY_LOW if size > large_media_threshold else PRIORITY_HIGH
+
+async def enqueue_album(media_group_id, messages):
+    """Ставит собранный альбом в очередь обработки"""
+    await work_queue.put(post_priority(messages), 'album', messages)
+
+async def load_messages(chat_id, message_ids):
+    """Заново запрашивает сообщения, выгруженные из очереди на диск"""
+    return await app.get_messages(chat_id, message_ids)
+
+# Очередь обработки: прием сообщений отделен от скачивания и пересылки
+work_queue = WorkQueue(
+    {'post': process_post, 'album': process_album, 'relay': relay_post},
+    workers=transfer_workers,
+    max_size=work_queue_size,
+    policy=work_queue_policy,
+    spill_path=work_queue_spill_path,
+    load_messages=load_messages,
+    # Выгруженные на диск посты переживут перезапуск, отброшенные потеряны по политике очереди
+    on_evict=mark_processed
+)
+
+# Буфер альбомов: элементы одного media_group_id приходят отдельными апдейтами
+album_buffer = KeyedBatcher(enqueue_album, delay=album_delay)
+
+# Буфер всплесков: посты одного канала за окно пересылаются одним запросом
+burst_buffer = KeyedBatcher(forward_burst, delay=burst_window, max_size=burst_max_size, debounce=False)
+
+# При остановке новые посты не принимаются: их догонит следующий запуск
+intake_open = True
 
 @app.on_message(filters.chat(source_channel_ids))
 async def forward_new_post(client, message):
@@ -91,139 +478,104 @@ async def forward_new_post(client, message):
             logger.error("Source channels or admin bot not configured")
             return
 
-        # Добавляем информацию об исходном канале
-        source_channel_info = f"Channel ID: {message.chat.id}"
-        if message.chat.username:
-            source_channel_info += f" (@{message.chat.username})"
-        if message.chat.title:
-            source_channel_info += f" - {message.chat.title}"
-
-        # Проверяем наличие ограничений на копирование
-        if check_copy_restrictions(message):
-            logger.warning(f"Copying restricted for message {message.id} from {source_channel_info}")
-            # Воссоздаем сообщение вручную
-            try:
-                # Добавляем информацию об исходном канале к caption или тексту
-                if message.text:
-                    text = message.text
-                    await client.send_message(admin_bot_id, text)
-                    await client.send_message(admin_bot_id, f"💬 Source: {source_channel_info}")
-                    logger.info(f"Manually forwarded text message {message.id} to admin bot")
-                elif message.photo:
-                    file = await client.download_media(message.photo.file_id)
-                    caption = message.caption or ''
-                    await client.send_photo(admin_bot_id, file, caption=caption)
-                    await client.send_message(admin_bot_id, f"💬 Source: {source_channel_info}")
-                    logger.info(f"Manually forwarded photo message {message.id} to admin bot")
-                    os.remove(file)
-                elif message.video:
-                    file = await client.download_media(message.video.file_id)
-                    caption = message.caption or ''
-                    await client.send_video(admin_bot_id, file, caption=caption)
-                    await client.send_message(admin_bot_id, f"💬 Source: {source_channel_info}")
-                    logger.info(f"Manually forwarded video message {message.id} to admin bot")
-                    os.remove(file)
-                elif message.document:
-                    file = await client.download_media(message.document.file_id)
-                    caption = message.caption or ''
-                    await client.send_document(admin_bot_id, file, caption=caption)
-                    await client.send_message(admin_bot_id, f"💬 Source: {source_channel_info}")
-                    logger.info(f"Manually forwarded document message {message.id} to admin bot")
-                    os.remove(file)
-                elif message.voice:
-                    file = await client.download_media(message.voice.file_id)
-                    caption = message.caption or ''
-                    await client.send_voice(admin_bot_id, file, caption=caption)
-                    await client.send_message(admin_bot_id, f"💬 Source: {source_channel_info}")
-                    logger.info(f"Manually forwarded voice message {message.id} to admin bot")
-                    os.remove(file)
-                elif message.video_note:
-                    file = await client.download_media(message.video_note.file_id)
-                    # Для video note нельзя добавить caption, отправим отдельным сообщением
-                    await client.send_video_note(admin_bot_id, file)
-                    await client.send_message(admin_bot_id, f"💬 Source: {source_channel_info}")
-                    logger.info(f"Manually forwarded video note {message.id} to admin bot")
-                    os.remove(file)
-                else:
-                    logger.warning(f"Unsupported message type for manual forwarding: {message}")
-            except Exception as e:
-                logger.error(f"Error manually forwarding restricted message {message.id}: {e}")
+        if not intake_open:
             return
 
-        try:
-            # Пересылаем сообщение админ-боту
-            forwarded = await client.forward_messages(
-                chat_id=admin_bot_id,
-                from_chat_id=message.chat.id,
-                message_ids=message.id
-            )
-            # Сохраняем информацию об источнике в метаданных сообщения
-            if not hasattr(forwarded, '_client'):
-                forwarded._client = client
-            if not hasattr(forwarded, '_source_info'):
-                forwarded._source_info = source_channel_info
-            logger.info(f"Forwarded message {message.id} from {source_channel_info} to admin bot")
-        except Exception as e:
-            logger.warning(f"Error forwarding message {message.id}, trying to manually forward: {e}")
-            # Если пересылка не удалась, воссоздаем сообщение вручную
-            try:
-                if message.text:
-                    text = message.text
-                    sent_msg = await client.send_message(admin_bot_id, text)
-                    if not hasattr(sent_msg, '_source_info'):
-                        sent_msg._source_info = source_channel_info
-                    logger.info(f"Manually forwarded text message {message.id} to admin bot")
-                elif message.photo:
-                    file = await client.download_media(message.photo.file_id)
-                    caption = message.caption or ''
-                    sent_msg = await client.send_photo(admin_bot_id, file, caption=caption)
-                    if not hasattr(sent_msg, '_source_info'):
-                        sent_msg._source_info = source_channel_info
-                    logger.info(f"Manually forwarded photo message {message.id} to admin bot")
-                    os.remove(file)
-                elif message.video:
-                    file = await client.download_media(message.video.file_id)
-                    caption = message.caption or ''
-                    sent_msg = await client.send_video(admin_bot_id, file, caption=caption)
-                    if not hasattr(sent_msg, '_source_info'):
-                        sent_msg._source_info = source_channel_info
-                    logger.info(f"Manually forwarded video message {message.id} to admin bot")
-                    os.remove(file)
-                elif message.document:
-                    file = await client.download_media(message.document.file_id)
-                    caption = message.caption or ''
-                    sent_msg = await client.send_document(admin_bot_id, file, caption=caption)
-                    if not hasattr(sent_msg, '_source_info'):
-                        sent_msg._source_info = source_channel_info
-                    logger.info(f"Manually forwarded document message {message.id} to admin bot")
-                    os.remove(file)
-                elif message.voice:
-                    file = await client.download_media(message.voice.file_id)
-                    caption = message.caption or ''
-                    sent_msg = await client.send_voice(admin_bot_id, file, caption=caption)
-                    if not hasattr(sent_msg, '_source_info'):
-                        sent_msg._source_info = source_channel_info
-                    logger.info(f"Manually forwarded voice message {message.id} to admin bot")
-                    os.remove(file)
-                elif message.video_note:
-                    file = await client.download_media(message.video_note.file_id)
-                    # Для video note нельзя добавить caption, отправим отдельным сообщением
-                    sent_msg = await client.send_video_note(admin_bot_id, file)
-                    if not hasattr(sent_msg, '_source_info'):
-                        sent_msg._source_info = source_channel_info
-                    logger.info(f"Manually forwarded video note {message.id} to admin bot")
-                    os.remove(file)
-                else:
-                    logger.warning(f"Unsupported message type for manual forwarding: {message}")
-            except Exception as e:
-                logger.error(f"Error manually forwarding message {message.id}: {e}")
+        # Отметка канала сдвинется за пост, только когда он будет обработан
+        if checkpoints is not None:
+            checkpoints.received(message.chat.id, message.id)
+
+        # Элементы альбома собираем и пересылаем одной пачкой
+        if message.media_group_id:
+            album_buffer.add(message.media_group_id, message)
+            return
+
+        # Вся дальнейшая работа выполняется обработчиками очереди
+        await work_queue.put(post_priority([message]), 'post', [message])
     except Exception as e:
         logger.error(f"Unexpected error processing message {message.id}: {e}")
+        mark_processed([message])
+
+async def backfill_post(message):
+    """Передает пропущенный пост в тот же конвейер, что и новые сообщения"""
+    await forward_new_post(app, message)
+
+# Догонка постов, пропущенных во время простоя (0 сообщений — отключена)
+checkpoints = CheckpointStore(checkpoint_path) if backfill_max_messages > 0 else None
+history_backfill = HistoryBackfill(
+    app,
+    checkpoints,
+    backfill_post,
+    max_messages=backfill_max_messages,
+    concurrency=backfill_concurrency,
+    rate=backfill_rate
+) if checkpoints is not None else None
+
+@app.on_disconnect()
+async def on_disconnect(client):
+    """После переподключения догоняем посты, пришедшие без связи"""
+    if history_backfill is not None:
+        history_backfill.schedule_after_reconnect()
+
+async def drain_pipeline():
+    """
+    Дорабатывает принятые посты перед остановкой.
+
+    Альбомы и всплески отдаются, не дожидаясь окна, очередь обработки
+    разбирается до конца. Пересылка всплеска может поставить в очередь
+    ручную пересылку, поэтому проход повторяется, пока все не опустеет.
+    """
+    while True:
+        await album_buffer.drain()
+        await work_queue.join()
+        await burst_buffer.drain()
+        await work_queue.join()
+        if not (album_buffer.busy or burst_buffer.busy or len(work_queue) or work_queue.active):
+            return
+
+async def shutdown():
+    """Прекращает прием постов и дорабатывает принятые за SHUTDOWN_DRAIN_TIMEOUT секунд"""
+    global intake_open
+    intake_open = False
+    if history_backfill is not None:
+        history_backfill.close()
+    started = time.monotonic()
+    try:
+        await asyncio.wait_for(drain_pipeline(), shutdown_drain_timeout)
+        logger.info(f"Drained work queue and buffers in {time.monotonic() - started:.2f}s")
+    except asyncio.TimeoutError:
+        # Недоработанные посты не отмечены обработанными и будут догнаны при запуске
+        logger.warning(
+            f"Shutdown drain timed out after {shutdown_drain_timeout}s: {len(work_queue)} queued, "
+            f"{work_queue.active} in progress, {len(album_buffer)} albums and {len(burst_buffer)} bursts buffered"
+        )
+    await work_queue.stop()
+
+async def run_bot():
+    """Запускает клиента и проверяет, что все чаты из конфигурации доступны"""
+    if metrics_port:
+        await MetricsServer(registry, metrics_port, metrics_host).start()
+    # Отметки фиксируются до подключения: новые посты начнут приходить сразу после start
+    snapshot = checkpoints.snapshot() if checkpoints is not None else None
+    backfill_task = None
+    await app.start()
+    try:
+        # Неизвестный канал или бот — ошибка конфигурации, работать без него нет смысла
+        await peer_registry.resolve_all(source_channel_ids + [admin_bot_id])
+        if history_backfill is not None:
+            backfill_task = asyncio.ensure_future(history_backfill.run(source_channel_ids, snapshot))
+        # idle возвращается по SIGINT и SIGTERM (например, от супервизора шардов)
+        await idle()
+    finally:
+        if backfill_task is not None:
+            backfill_task.cancel()
+        await shutdown()
+        await app.stop()
 
 def main():
     try:
         logger.info("Starting User Bot...")
-        app.run()
+        app.run(run_bot())
     except Exception as e:
         logger.error(f"Error starting bot: {e}")
 
@@ -0,0 +1,214 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import sqlite3
+import time
+
+from metrics import registry, stage_seconds
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: меньше — раньше
+PRIORITY_HIGH = 0
+PRIORITY_LOW = 1
+
+# Политики при переполнении очереди
+POLICIES = ('block', 'drop_oldest', 'spill')
+
+dropped_total = registry.counter('tgbot_queue_dropped_total', 'Work items dropped because the queue was full')
+spilled_total = registry.counter('tgbot_queue_spilled_total', 'Work items spilled to disk because the queue was full')
+
+
+class WorkQueue:
+    """
+    Ограниченная очередь работ с приоритетами и пулом обработчиков.
+
+    Элемент очереди — сообщения одного поста и вид работы: handlers[kind]
+    вызывается с этим списком сообщений. Элементы с меньшим приоритетом
+    обрабатываются раньше, внутри класса — в порядке поступления. Одновременно
+    выполняется не больше workers работ.
+
+    Если очередь заполнена, policy определяет поведение:
+    block — put ждет освобождения места, drop_oldest — отбрасывается самый
+    старый элемент, spill — элемент (только id сообщений) записывается в
+    SQLite и возвращается в очередь, когда появляется место; сообщения
+    заново запрашиваются через load_messages(chat_id, message_ids).
+    Отброшенные и выгруженные на диск сообщения передаются в on_evict(messages).
+    """
+
+    def __init__(self, handlers, workers=4, max_size=1000, policy='block', spill_path=None, load_messages=None,
+                 on_evict=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy {policy!r}, expected one of {POLICIES}")
+        if policy == 'spill' and not (spill_path and load_messages):
+            raise ValueError("Spill policy requires spill_path and load_messages")
+
+        self.handlers = handlers
+        self.workers = workers
+        self.max_size = max_size
+        self.policy = policy
+        self.load_messages = load_messages
+        self.on_evict = on_evict
+        self.processed = 0
+        self.active = 0
+        self.dropped = 0
+        self.spilled = 0
+        self._heap = []
+        self._seq = itertools.count()
+        self._condition = None
+        self._tasks = []
+        self._db = None
+
+        if policy == 'spill':
+            self._db = sqlite3.connect(spill_path, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS spilled_work ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, priority INTEGER, kind TEXT, '
+                'chat_id INTEGER, message_ids TEXT, enqueued_at REAL)'
+            )
+            self.spilled = self._db.execute('SELECT COUNT(*) FROM spilled_work').fetchone()[0]
+            if self.spilled:
+                logger.info(f"Work queue {spill_path}: {self.spilled} spilled items restored")
+
+        registry.gauge('tgbot_queue_depth', 'Work items waiting in the queue', callback=lambda: len(self._heap))
+        registry.gauge('tgbot_queue_spilled', 'Work items spilled to disk', callback=lambda: self.spilled)
+
+    def __len__(self):
+        return len(self._heap)
+
+    @property
+    def stats(self):
+        return {
+            'depth': len(self._heap),
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'spilled': self.spilled,
+        }
+
+    def start(self):
+        """Запускает обработчики; put вызывает его сам при первом элементе."""
+        if self._tasks:
+            return
+        self._condition = asyncio.Condition()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        if self.spilled:
+            asyncio.ensure_future(self._restore_spilled())
+
+    async def join(self):
+        """Ждет, пока очередь в памяти опустеет и все начатые работы завершатся."""
+        if not self._tasks:
+            return
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._heap and not self.active)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def put(self, priority, kind, messages):
+        """
+        Ставит работу в очередь.
+
+        Args:
+            priority: PRIORITY_HIGH или PRIORITY_LOW
+            kind: Вид работы (ключ в handlers)
+            messages: Сообщения поста
+        """
+        self.start()
+        async with self._condition:
+            if len(self._heap) >= self.max_size:
+                if self.policy == 'spill':
+                    self._spill(priority, kind, messages)
+                    return
+                if self.policy == 'drop_oldest':
+                    self._drop_oldest()
+                else:
+                    await self._condition.wait_for(lambda: len(self._heap) < self.max_size)
+            self._push(priority, kind, messages, time.monotonic())
+
+    def _push(self, priority, kind, messages, enqueued_at):
+        heapq.heappush(self._heap, (priority, next(self._seq), enqueued_at, kind, messages))
+        self._condition.notify_all()
+
+    def _drop_oldest(self):
+        oldest = min(range(len(self._heap)), key=lambda index: self._heap[index][1])
+        _, _, _, kind, messages = self._heap[oldest]
+        self._heap[oldest] = self._heap[-1]
+        self._heap.pop()
+        heapq.heapify(self._heap)
+        self.dropped += 1
+        dropped_total.inc()
+        logger.warning(
+            f"Work queue full ({self.max_size}), dropped oldest {kind} "
+            f"of message {messages[0].id} from chat {messages[0].chat.id}"
+        )
+        self._evict(messages)
+
+    def _evict(self, messages):
+        if self.on_evict is not None:
+            try:
+                self.on_evict(messages)
+            except Exception as e:
+                logger.error(f"Error in work queue eviction callback: {e}")
+
+    def _spill(self, priority, kind, messages):
+        self._db.execute(
+            'INSERT INTO spilled_work (priority, kind, chat_id, message_ids, enqueued_at) VALUES (?, ?, ?, ?, ?)',
+            (priority, kind, messages[0].chat.id, json.dumps([message.id for message in messages]), time.time())
+        )
+        self.spilled += 1
+        spilled_total.inc()
+        logger.warning(f"Work queue full ({self.max_size}), spilled {kind} of message {messages[0].id} to disk")
+        self._evict(messages)
+
+    async def _restore_spilled(self):
+        """Возвращает в очередь сохраненные на диск элементы, пока есть место."""
+        while self.spilled and len(self._heap) < self.max_size:
+            row = self._db.execute(
+                'SELECT id, priority, kind, chat_id, message_ids, enqueued_at FROM spilled_work '
+                'ORDER BY priority, id LIMIT 1'
+            ).fetchone()
+            if row is None:
+                return
+            row_id, priority, kind, chat_id, message_ids, enqueued_at = row
+            self._db.execute('DELETE FROM spilled_work WHERE id = ?', (row_id,))
+            self.spilled -= 1
+            try:
+                messages = await self.load_messages(chat_id, json.loads(message_ids))
+            except Exception as e:
+                logger.error(f"Error loading spilled {kind} {message_ids} from chat {chat_id}: {e}")
+                continue
+            messages = [message for message in messages if message and not message.empty]
+            if not messages:
+                continue
+            # Время ожидания на диске тоже входит в задержку очереди
+            waited = time.time() - enqueued_at
+            async with self._condition:
+                self._push(priority, kind, messages, time.monotonic() - waited)
+
+    async def _worker(self):
+        while True:
+            async with self._condition:
+                await self._condition.wait_for(lambda: self._heap)
+                priority, _, enqueued_at, kind, messages = heapq.heappop(self._heap)
+                self.active += 1
+                self._condition.notify_all()
+
+            stage_seconds.observe(time.monotonic() - enqueued_at, stage='queue_wait')
+            try:
+                await self.handlers[kind](messages)
+            except Exception as e:
+                logger.error(f"Error processing {kind} of message {messages[0].id}: {e}", exc_info=True)
+            finally:
+                async with self._condition:
+                    self.active -= 1
+                    self._condition.notify_all()
+            self.processed += 1
+
+            if self.spilled and len(self._heap) < self.max_size:
+                await self._restore_spilled()